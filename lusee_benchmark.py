@@ -0,0 +1,297 @@
+import os
+import sys
+import json
+import time
+import threading
+import statistics
+import logging
+import logging.config
+from datetime import datetime
+from queue import Empty
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from utils import LuSEE_ETHERNET
+from utils import LuSEE_COMMS
+from utils import LuSEE_STANDIN
+
+#Measures how fast the readout stack is, against the real board or the local stand-in in utils/lusee_standin.py
+#Every test adds its numbers to one results dictionary that gets written out as JSON, so runs can be compared later
+class LuSEE_BENCHMARK:
+    def __init__(self, config_file):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.debug("Class created")
+        self.output_dir = "output"
+        with open(config_file, "r") as jsonfile:
+            self.json_data = json.load(jsonfile)
+
+        self.standin = None
+        endpoint = self.json_data.get("endpoint")
+        if (self.json_data.get("standin", False)):
+            self.standin = LuSEE_STANDIN(endpoint = endpoint, settings = self.json_data.get("standin_settings"))
+            self.standin.start()
+        self.connection = LuSEE_ETHERNET(endpoint = endpoint)
+        self.comm = LuSEE_COMMS(self.connection)
+
+        #Register used for the write and read tests, the first scratchpad is harmless to overwrite
+        self.test_register = 0x120
+        #How often the queue depths are sampled while the tests run
+        self.monitor_interval = self.json_data.get("monitor_interval", 0.01)
+        self.monitor_stop = threading.Event()
+        self.queues = {"send_queue": self.connection.send_queue,
+                       "reg_input_queue": self.connection.processing.reg_input_queue,
+                       "data_input_queue": self.connection.processing.data_input_queue,
+                       "hk_input_queue": self.connection.processing.hk_input_queue,
+                       "adc_output_queue": self.connection.processing.adc_output_queue,
+                       "pfb_output_queue": self.connection.processing.pfb_output_queue,
+                       "count_output_queue": self.connection.processing.count_output_queue,
+                       "calib_output_queue": self.connection.processing.calib_output_queue}
+        self.high_water = {name: 0 for name in self.queues}
+        self.high_water["pending_reads"] = 0
+        #Last CCSDS sequence count seen for each APID, used to count packets that never arrived
+        self.sequence = {}
+        self.packets_missing = 0
+        self.packets_seen = 0
+
+        self.results = {}
+
+    def stop(self):
+        self.monitor_stop.set()
+        self.comm.stop()
+        if (self.standin):
+            self.standin.stop()
+
+    def monitor(self):
+        name = threading.current_thread().name
+        self.logger.debug(f"{name} started")
+        while not self.monitor_stop.wait(self.monitor_interval):
+            self.sample_queues()
+        self.logger.debug(f"{name} exited")
+
+    def sample_queues(self):
+        depths = {name: q.qsize() for name, q in self.queues.items()}
+        depths["pending_reads"] = len(self.connection.processing.reg.pending_reads)
+        for name, depth in depths.items():
+            self.high_water[name] = max(self.high_water[name], depth)
+        return depths
+
+    def memory_usage(self):
+        #Peak resident memory of this process, in kilobytes on Linux
+        if (resource):
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return None
+
+    def percentiles(self, values):
+        if not values:
+            return {}
+        ordered = sorted(values)
+        result = {"count": len(ordered),
+                  "mean": statistics.mean(ordered),
+                  "min": ordered[0],
+                  "max": ordered[-1]}
+        for p in (50, 90, 99):
+            result[f"p{p}"] = ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+        return result
+
+    #Packet headers come back as a dictionary of packet number to LuSEE_HEADER record
+    def track_sequence(self, headers):
+        for header in headers.values():
+            apid = header.ccsds_appid
+            seq = header.ccsds_sequence_cnt
+            self.packets_seen += 1
+            if (apid in self.sequence):
+                self.packets_missing += (seq - self.sequence[apid] - 1) & 0x3FFF
+            self.sequence[apid] = seq
+
+    def rate(self, count, elapsed):
+        return count / elapsed if elapsed > 0 else None
+
+    def write_throughput(self, num):
+        self.logger.info(f"Timing {num} register writes")
+        writes = [(self.test_register, i) for i in range(num)]
+        #Timed until every write has been acknowledged, a batch that timed out has no rate
+        start = time.perf_counter()
+        futures = self.connection.write_regs(writes, wait = False)
+        ok = self.connection.wait_writes(futures)
+        batch_time = time.perf_counter() - start
+        if not all(i.done() for i in futures):
+            batch_time = 0
+
+        start = time.perf_counter()
+        for reg, val in writes:
+            ok = self.connection.wait_writes([self.connection.write_reg(reg, val, wait = False)]) and ok
+        single_time = time.perf_counter() - start
+
+        return {"writes": num,
+                "all_ok": ok,
+                "batch_writes_per_second": self.rate(num, batch_time),
+                "single_writes_per_second": self.rate(num, single_time)}
+
+    def read_latency(self, num):
+        self.logger.info(f"Timing {num} register reads")
+        latencies = []
+        failures = 0
+        for i in range(num):
+            start = time.perf_counter()
+            resp = self.connection.read_reg(self.test_register)
+            latencies.append(time.perf_counter() - start)
+            if (resp is None):
+                failures += 1
+
+        regs = [self.test_register] * num
+        start = time.perf_counter()
+        resp = self.connection.read_many(regs)
+        many_time = time.perf_counter() - start
+
+        return {"reads": num,
+                "failures": failures,
+                "read_reg_latency": self.percentiles(latencies),
+                "read_many_reads_per_second": self.rate(num, many_time)}
+
+    def product_rate(self, product, num):
+        self.logger.info(f"Timing {num} {product} products")
+        if (product == "pfb_sw"):
+            self.comm.readout_mode("sw")
+            self.comm.set_main_average(self.json_data.get("pfb_averages", 0))
+        else:
+            self.comm.readout_mode("fpga")
+            self.comm.set_function("FFT1" if product == "pfb_fpga" else "ADC1")
+        received = 0
+        failures = 0
+        spectra = 0
+        start = time.perf_counter()
+        for i in range(num):
+            try:
+                if (product == "pfb_fpga"):
+                    resp = self.comm.get_pfb_data()
+                    headers = [resp["header"]] if resp else []
+                elif (product == "pfb_sw"):
+                    resp = self.comm.get_pfb_data_sw(header_return = True)
+                    #After too many errors only the data that did come in is returned, without headers
+                    data, headers = resp if isinstance(resp, tuple) else (resp, [])
+                    resp = data if len(data) == 16 else None
+                    spectra += len(data)
+                else:
+                    resp = self.comm.get_adc_data()
+                    headers = [resp["header"]] if resp else []
+            except Empty:
+                resp = None
+                headers = []
+            if (resp):
+                received += 1
+            else:
+                failures += 1
+            for header in headers:
+                self.track_sequence(header)
+        elapsed = time.perf_counter() - start
+        result = {"requested": num,
+                  "received": received,
+                  "failures": failures,
+                  "products_per_second": self.rate(received, elapsed)}
+        if (product == "pfb_sw"):
+            result["spectra_per_second"] = self.rate(spectra, elapsed)
+        return result
+
+    #Keeps pulling products for a long time, recording a timeline so slow queue growth or memory leaks show up
+    def soak(self, product, duration, interval):
+        self.logger.info(f"Soaking with {product} products for {duration} seconds")
+        if (self.standin and "soak_packet_rate" in self.json_data):
+            self.standin.packet_rate = self.json_data["soak_packet_rate"]
+        timeline = []
+        total = {"received": 0, "failures": 0}
+        start = time.perf_counter()
+        next_sample = start + interval
+        while (time.perf_counter() - start < duration):
+            resp = self.product_rate(product, 1)
+            total["received"] += resp["received"]
+            total["failures"] += resp["failures"]
+            now = time.perf_counter()
+            if (now >= next_sample):
+                timeline.append({"elapsed": now - start,
+                                 "received": total["received"],
+                                 "failures": total["failures"],
+                                 "packets_missing": self.packets_missing,
+                                 "queue_depths": self.sample_queues(),
+                                 "max_rss_kb": self.memory_usage()})
+                next_sample += interval
+        elapsed = time.perf_counter() - start
+        return dict(total, duration = elapsed,
+                    products_per_second = self.rate(total["received"], elapsed),
+                    timeline = timeline)
+
+    def run(self):
+        self.datastore = {}
+        self.datastore['input_params'] = self.json_data
+        self.start_time = datetime.now()
+        self.datastore['start_time'] = self.start_time
+
+        if (self.json_data["relative"] == True):
+            output_path = os.path.abspath(os.path.join(self.output_dir, self.json_data["output_directory"]))
+        else:
+            output_path = os.path.normpath(os.path.join(self.output_dir, self.json_data["output_directory"]))
+        json_date = datetime.today().strftime('%Y%m%d%H%M%S')
+        self.results_path = os.path.join(output_path, json_date)
+        os.makedirs(self.results_path)
+        self.json_output_file = os.path.join(self.results_path, "benchmark.json")
+
+        monitor_thread = threading.Thread(target=self.monitor, name="Benchmark Monitor Thread", daemon = True)
+        monitor_thread.start()
+
+        tests = self.json_data["tests"]
+        if ("write" in tests):
+            self.results["write"] = self.write_throughput(self.json_data.get("num_writes", 1000))
+        if ("read" in tests):
+            self.results["read"] = self.read_latency(self.json_data.get("num_reads", 1000))
+        for product in ("pfb_fpga", "pfb_sw", "adc"):
+            if (product in tests):
+                self.results[product] = self.product_rate(product, self.json_data.get(f"num_{product}", 10))
+        if ("soak" in tests):
+            self.results["soak"] = self.soak(self.json_data.get("soak_product", "pfb_fpga"),
+                                             self.json_data.get("soak_duration", 3600),
+                                             self.json_data.get("soak_interval", 10))
+
+        self.monitor_stop.set()
+        monitor_thread.join()
+
+        self.results["queue_high_water"] = self.high_water
+        self.results["queue_stats"] = self.connection.processing.get_queue_stats()
+        self.results["packet_loss"] = {"packets_seen": self.packets_seen,
+                                       "packets_missing": self.packets_missing,
+                                       "fraction": self.rate(self.packets_missing, self.packets_seen + self.packets_missing)}
+        self.results["reassembly"] = self.connection.processing.data.get_stats()
+        self.results["buffer_pool"] = self.connection.processing.buffer_pool.get_stats()
+        self.results["receive"] = dict(self.connection.receive_stats)
+        self.results["rtt"] = self.connection.get_rtt_stats()
+        self.results["timeouts"] = self.connection.get_timeout_stats()
+        self.results["cdi_writes_skipped"] = self.connection.cdi_writes_skipped
+        self.results["max_rss_kb"] = self.memory_usage()
+        if (self.standin):
+            self.results["standin"] = self.standin.stats
+
+        self.datastore['end_time'] = datetime.now()
+        self.datastore['results'] = self.results
+        with open(self.json_output_file, 'w', encoding='utf-8') as f:
+            json.dump(self.datastore, f, ensure_ascii=False, indent=4, default=str)
+        self.logger.info(f"Results are in {self.json_output_file}")
+        return self.results
+
+if __name__ == "__main__":
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    relative_path = 'config/config_logger.ini'
+    config_path = os.path.join(script_dir, relative_path)
+    logging.config.fileConfig(config_path)
+
+    if len(sys.argv) < 2:
+        print(f"Error: You need to supply a config file for this test as the argument! You had {len(sys.argv)-1} arguments!")
+        sys.exit()
+
+    benchmark = LuSEE_BENCHMARK(sys.argv[1])
+    try:
+        results = benchmark.run()
+        print(json.dumps({k: v for k, v in results.items() if k != "soak"}, indent=4, default=str))
+    finally:
+        benchmark.stop()
+    benchmark.logger.info("Finished!")
@@ -6,10 +6,11 @@ import logging.config
 from utils import LuSEE_ETHERNET
 
 class LuSEE_BOOTLOADER:
-    def __init__(self):
+    #Give it a LuSEE_ETHERNET connection to talk to a particular board, otherwise it uses the default one (see LuSEE_ETHERNET.__new__)
+    def __init__(self, connection = None):
         self.logger = logging.getLogger(self.__class__.__name__)
         self.logger.debug("Class created")
-        self.connection = LuSEE_ETHERNET()
+        self.connection = connection or LuSEE_ETHERNET()
         self.debug_file = "lusee_bootloader_operations.txt"
 
         self.REMAIN = 0xB00000
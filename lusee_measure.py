@@ -11,10 +11,13 @@ from utils import LuSEE_COMMS
 from utils import LuSEE_PLOTTING
 
 class LuSEE_MEASURE:
-    def __init__(self):
+    #The connection picks the board, see LuSEE_COMMS
+    def __init__(self, connection = None):
         self.logger = logging.getLogger(self.__class__.__name__)
         self.logger.debug("Class created")
-        self.comm = LuSEE_COMMS()
+        self.comm = LuSEE_COMMS(connection)
+        #Products carry numpy arrays, this writes them into the JSON files as lists
+        self.decoder = self.comm.connection.processing.decoder
         self.output_dir = "output"
         self.tick_size = 22
         self.title_size = 32
@@ -98,7 +101,7 @@ class LuSEE_MEASURE:
         self.setup_calibrator()
         self.logger.info("Set up calibrator")
         with open(self.json_output_file, 'w', encoding='utf-8') as f:
-            json.dump(self.datastore, f, ensure_ascii=False, indent=4, default=str)
+            json.dump(self.datastore, f, ensure_ascii=False, indent=4, default=self.decoder.json_default)
 
         self.plotter = LuSEE_PLOTTING(self.results_path)
 
@@ -117,7 +120,7 @@ class LuSEE_MEASURE:
             calib_dict = {"header": all_headers,
                             "data": all_data}
             with open(os.path.join(self.results_path, f"calib_output1.json"), 'w', encoding='utf-8') as f:
-                json.dump(calib_dict, f, ensure_ascii=False, indent=4, default=str)
+                json.dump(calib_dict, f, ensure_ascii=False, indent=4, default=self.decoder.json_default)
             if (self.json_data[f"calib_single_bin_plot"]):
                 self.plotter.plot_single_bin(self.json_data[f"calib_single_bin_show"], self.json_data[f"calib_single_bin_save"], self.json_data["calib_single_bin"])
         if (self.json_data["mode2"]):
@@ -131,7 +134,7 @@ class LuSEE_MEASURE:
             calib_dict = {"header": all_headers,
                             "data": all_data}
             with open(os.path.join(self.results_path, f"calib_output2.json"), 'w', encoding='utf-8') as f:
-                json.dump(calib_dict, f, ensure_ascii=False, indent=4, default=str)
+                json.dump(calib_dict, f, ensure_ascii=False, indent=4, default=self.decoder.json_default)
             if (self.json_data[f"calib_correlator_plot"]):
                 self.plotter.plot_cal_correlator(self.json_data[f"calib_correlator_show"], self.json_data[f"calib_correlator_save"])
         if (self.json_data["mode3"]):
@@ -145,7 +148,7 @@ class LuSEE_MEASURE:
             calib_dict = {"header": all_headers,
                             "data": all_data}
             with open(os.path.join(self.results_path, f"calib_output3.json"), 'w', encoding='utf-8') as f:
-                json.dump(calib_dict, f, ensure_ascii=False, indent=4, default=str)
+                json.dump(calib_dict, f, ensure_ascii=False, indent=4, default=self.decoder.json_default)
 
             if (self.json_data[f"print_calib"]):
                 self.plotter.print_calib()
@@ -169,7 +172,7 @@ class LuSEE_MEASURE:
             calib_dict = {"header": all_headers,
                             "data": all_data}
             with open(os.path.join(self.results_path, f"calib_output0.json"), 'w', encoding='utf-8') as f:
-                json.dump(calib_dict, f, ensure_ascii=False, indent=4, default=str)
+                json.dump(calib_dict, f, ensure_ascii=False, indent=4, default=self.decoder.json_default)
             if (self.json_data[f"calib_fout_plot"]):
                 self.plotter.plot_fout(self.json_data[f"calib_fout_plot_show"], self.json_data[f"calib_fout_plot_save"])
             #You get gNacc and gphase also
@@ -180,7 +183,7 @@ class LuSEE_MEASURE:
             if (self.json_data[f"adc{i}_save_data"]):
                 adc_dict = self.get_adc_data(i)
                 with open(os.path.join(self.results_path, f"adc{i}_output.json"), 'w', encoding='utf-8') as f:
-                    json.dump(adc_dict, f, ensure_ascii=False, indent=4, default=str)
+                    json.dump(adc_dict, f, ensure_ascii=False, indent=4, default=self.decoder.json_default)
 
                 if (self.json_data[f"adc{i}_plot"]):
                     self.plotter.plot_adc(i, self.json_data[f"adc{i}_plot_show"], self.json_data[f"adc{i}_plot_save"])
@@ -192,27 +195,31 @@ class LuSEE_MEASURE:
         self.comm.readout_mode("fpga")
         #input("ready?")
         time.sleep(.2)
-        for i in range(1, 5):
-            if (self.json_data[f"pfb{i}_fpga_save_data"]):
-                self.comm.set_function(f"FFT{i}")
-                # while(True):
-                pfb_dict = self.comm.get_pfb_data()
-                with open(os.path.join(self.results_path, f"pfb_fpga{i}_output.json"), 'w', encoding='utf-8') as f:
-                    json.dump(pfb_dict, f, ensure_ascii=False, indent=4, default=str)
-
-                if (self.json_data[f"pfb{i}_fpga_plot"]):
-                    self.plotter.plot_pfb_fpga(i, self.json_data[f"pfb{i}_fpga_plot_show"], self.json_data[f"pfb{i}_fpga_plot_save"])
-                    #self.plotter.plot_notches(i, self.json_data[f"pfb{i}_fpga_plot_show"], self.json_data[f"pfb{i}_fpga_plot_save"])
-
-                    # self.comm.stop_spectrometer()
-                    # input("Next?")
-                    #
-                    # self.comm.start_spectrometer()
-                    # time.sleep(.1)
-                    # self.comm.load_fft_fifos()
-                    # time.sleep(1)
-
-                #self.plotter.plot_notches(i, True, True)
+        #Every FFT that's saved is read out of the same snapshot in one go
+        ffts = [i for i in range(1, 5) if self.json_data[f"pfb{i}_fpga_save_data"]]
+        spectra, headers, valid = self.comm.get_pfb_burst(1, ffts)
+        for j, i in enumerate(ffts):
+            if (not valid[0, j]):
+                self.logger.error(f"FFT{i} through the FPGA never came, nothing saved for it")
+                continue
+            pfb_dict = {"header": headers[0][j],
+                        "data": spectra[0, j]}
+            with open(os.path.join(self.results_path, f"pfb_fpga{i}_output.json"), 'w', encoding='utf-8') as f:
+                json.dump(pfb_dict, f, ensure_ascii=False, indent=4, default=self.decoder.json_default)
+
+            if (self.json_data[f"pfb{i}_fpga_plot"]):
+                self.plotter.plot_pfb_fpga(i, self.json_data[f"pfb{i}_fpga_plot_show"], self.json_data[f"pfb{i}_fpga_plot_save"])
+                #self.plotter.plot_notches(i, self.json_data[f"pfb{i}_fpga_plot_show"], self.json_data[f"pfb{i}_fpga_plot_save"])
+
+                # self.comm.stop_spectrometer()
+                # input("Next?")
+                #
+                # self.comm.start_spectrometer()
+                # time.sleep(.1)
+                # self.comm.load_fft_fifos()
+                # time.sleep(1)
+
+            #self.plotter.plot_notches(i, True, True)
 
         if (self.json_data[f"pfb_sw_save_data"]):
             self.logger.info("Doing software")
@@ -222,7 +229,7 @@ class LuSEE_MEASURE:
             pfb_dict = {"header": all_headers,
                         "data": all_data}
             with open(os.path.join(self.results_path, f"pfb_sw_output.json"), 'w', encoding='utf-8') as f:
-                json.dump(pfb_dict, f, ensure_ascii=False, indent=4, default=str)
+                json.dump(pfb_dict, f, ensure_ascii=False, indent=4, default=self.decoder.json_default)
 
             if (self.json_data[f"pfb_sw_plot"]):
                 self.plotter.plot_pfb_sw(self.json_data[f"pfb_sw_plot_show"], self.json_data[f"pfb_sw_plot_save"])
@@ -236,7 +243,7 @@ class LuSEE_MEASURE:
                     adc_dict = {"header": header,
                                 "data": data}
                     with open(os.path.join(self.results_path, f"adc{i}_output.json"), 'w', encoding='utf-8') as f:
-                        json.dump(adc_dict, f, ensure_ascii=False, indent=4, default=str)
+                        json.dump(adc_dict, f, ensure_ascii=False, indent=4, default=self.decoder.json_default)
 
                     if (self.json_data[f"adc{i}_plot"]):
                         self.plotter.plot_adc_overlay(i)
@@ -248,7 +255,7 @@ class LuSEE_MEASURE:
                 pfb_dict = {"header": all_headers,
                             "data": all_data}
                 with open(os.path.join(self.results_path, f"pfb_sw_output.json"), 'w', encoding='utf-8') as f:
-                    json.dump(pfb_dict, f, ensure_ascii=False, indent=4, default=str)
+                    json.dump(pfb_dict, f, ensure_ascii=False, indent=4, default=self.decoder.json_default)
 
                 if (self.json_data[f"pfb_sw_plot"]):
                     self.plotter.plot_pfb_sw(self.json_data[f"pfb_sw_plot_show"], self.json_data[f"pfb_sw_plot_save"])
@@ -257,17 +264,19 @@ class LuSEE_MEASURE:
         pfb_dict = {}
 
         iterations = 64
-        for i in range(iterations):
-            self.comm.set_function(f"FFT1")
-            data, header = self.comm.get_pfb_data(header = True)
-            #self.comm.set_function(f"FFT3")
-            #data, header = self.comm.get_pfb_data(header = True)
-            pfb_dict.update({f"header{i}": header,
-                        f"data{i}": data})
-            self.comm.load_fft_fifos()
-            self.logger.info("got it")
+        #Use ffts = (1, 3) and spectra[i, 1] to look at FFT3 as well
+        spectra, headers, valid = self.comm.get_pfb_burst(iterations, ffts = (1,))
+        #Snapshots that never came are left out, the rest keep their order
+        kept = [i for i in range(iterations) if valid[i, 0]]
+        if (len(kept) < iterations):
+            self.logger.error(f"{iterations - len(kept)} of {iterations} snapshots never came, leaving them out")
+        for num, i in enumerate(kept):
+            pfb_dict.update({f"header{num}": headers[i][0],
+                        f"data{num}": spectra[i, 0]})
+        iterations = len(kept)
+        self.logger.info("got it")
         with open(os.path.join(self.results_path, f"notch_filter_output.json"), 'w', encoding='utf-8') as f:
-            json.dump(pfb_dict, f, ensure_ascii=False, indent=4, default=str)
+            json.dump(pfb_dict, f, ensure_ascii=False, indent=4, default=self.decoder.json_default)
 
         self.plotter.plot_notches_multiple(iterations)
         self.plotter.plot_notches_multiple_freq(iterations)
@@ -305,11 +314,9 @@ class LuSEE_MEASURE:
         self.comm.set_sticky_error(self.json_data["sticky_errors"])
         self.comm.spectrometer_test_mode(self.json_data["pfb_test_mode"])
 
-        for i in range(1, 17):
-            main_index = int(self.json_data[f"pfb{i}_main_index"], 16)
-            notch_index = int(self.json_data[f"pfb{i}_notch_index"], 16)
-            self.comm.set_index_array(i-1, main_index, "main")
-            self.comm.set_index_array(i-1, notch_index, "notch")
+        main_indexes = [int(self.json_data[f"pfb{i}_main_index"], 16) for i in range(1, 17)]
+        notch_indexes = [int(self.json_data[f"pfb{i}_notch_index"], 16) for i in range(1, 17)]
+        self.comm.set_index_arrays(main_indexes, notch_indexes)
 
         self.comm.reset_all_fifos()
         self.comm.load_fft_fifos()
@@ -419,8 +426,7 @@ class LuSEE_MEASURE:
         #This takes time, so if you're keeping it in the same configuration as last time without a reset, maybe you want to skip it
         if (self.json_data[f"apply_weights"]):
             self.logger.info("Applying weights")
-            for i in range(410):
-                self.comm.apply_weight(i, int(self.json_data[f"weight{i}"], 16))
+            self.comm.apply_weights([int(self.json_data[f"weight{i}"], 16) for i in range(410)])
         else:
             self.logger.info("Not applying weights")
 
@@ -453,7 +459,7 @@ class LuSEE_MEASURE:
         self.datastore['json_path'] = self.json_output_file
 
         with open(self.json_output_file, 'w', encoding='utf-8') as f:
-            json.dump(self.datastore, f, ensure_ascii=False, indent=4, default=str)
+            json.dump(self.datastore, f, ensure_ascii=False, indent=4, default=self.decoder.json_default)
 
         self.plotter = LuSEE_PLOTTING(self.results_path)
 
@@ -474,7 +480,7 @@ class LuSEE_MEASURE:
         self.datastore['test_time'] = test_time
 
         with open(self.json_output_file, 'w', encoding='utf-8') as f:
-            json.dump(self.datastore, f, ensure_ascii=False, indent=4, default=str)
+            json.dump(self.datastore, f, ensure_ascii=False, indent=4, default=self.decoder.json_default)
 
         self.logger.info(f"Test complete")
 
@@ -191,33 +191,45 @@ class LuSEE_POWER:
         self.logger.info(stats)
         adc_stats.update(stats)
 
-        self.settings_info['Register 0x100'] = hex(comm.connection.read_reg(comm.uC_reset))
-        self.settings_info['Register 0x101'] = hex(comm.connection.read_reg(comm.DDR_reg))
-        self.settings_info['ADC0 gain and config (Register 0x500)'] = hex(comm.connection.read_reg(comm.mux0_reg))
-        self.settings_info['ADC1 gain and config (Register 0x501)'] = hex(comm.connection.read_reg(comm.mux1_reg))
-        self.settings_info['ADC2 gain and config (Register 0x502)'] = hex(comm.connection.read_reg(comm.mux2_reg))
-        self.settings_info['ADC3 gain and config (Register 0x503)'] = hex(comm.connection.read_reg(comm.mux3_reg))
-        self.settings_info['Spectrometer Enabled'] = hex(comm.connection.read_reg(comm.enable_spe))
-        self.settings_info['Spectrometer Averages'] = 2 ** comm.connection.read_reg(comm.main_average)
-        self.settings_info['Notch Filter Enabled'] = hex(comm.connection.read_reg(comm.notch_reg))
-        self.settings_info['Notch Averages'] = 2 ** comm.connection.read_reg(comm.notch_average)
-
-        self.settings_info['Spectrometer Blocks Disabled'] = hex(comm.connection.read_reg(comm.spe_disable))
-        self.settings_info['Notch Averagers Disabled'] = hex(comm.connection.read_reg(comm.calibrator_and_notch_disable))
-        self.settings_info['Main Averagers Disabled'] = hex(comm.connection.read_reg(comm.avg_disable))
-        self.settings_info['Notch Correlators Disabled'] = hex(comm.connection.read_reg(comm.corr_notch_disable))
-        self.settings_info['Main Correlators Disabled'] = hex(comm.connection.read_reg(comm.corr_main_disable))
-        self.settings_info['Notch Subtract Disabled'] = hex(comm.connection.read_reg(comm.notch_subtract_disable))
-
-        self.settings_info['Correlation Array 1'] = hex(comm.connection.read_reg(comm.corr_array1))
-        self.settings_info['Correlation Array 2'] = hex(comm.connection.read_reg(comm.corr_array2))
-        self.settings_info['Correlation Array 3'] = hex(comm.connection.read_reg(comm.corr_array3))
-        self.settings_info['Notch Array 1'] = hex(comm.connection.read_reg(comm.notch_array1))
-        self.settings_info['Notch Array 2'] = hex(comm.connection.read_reg(comm.notch_array2))
-        self.settings_info['Notch Array 3'] = hex(comm.connection.read_reg(comm.notch_array3))
-
-        self.settings_info['Calibrator Phaser Averages'] = 2 ** (5 + (comm.connection.read_reg(comm.Nac1)))
-        self.settings_info['Calibrator Process Averages'] = 2 ** comm.connection.read_reg(comm.Nac2)
+        #All the settings registers are read in one batch
+        settings = comm.connection.read_many([comm.uC_reset, comm.DDR_reg, comm.mux0_reg, comm.mux1_reg, comm.mux2_reg, comm.mux3_reg,
+                                              comm.enable_spe, comm.main_average, comm.notch_reg, comm.notch_average,
+                                              comm.spe_disable, comm.calibrator_and_notch_disable, comm.avg_disable, comm.corr_notch_disable,
+                                              comm.corr_main_disable, comm.notch_subtract_disable,
+                                              comm.corr_array1, comm.corr_array2, comm.corr_array3, comm.notch_array1, comm.notch_array2, comm.notch_array3,
+                                              comm.Nac1, comm.Nac2])
+
+        self.settings_info['Register 0x100'] = hex(settings[comm.uC_reset])
+        self.settings_info['Register 0x101'] = hex(settings[comm.DDR_reg])
+        self.settings_info['ADC0 gain and config (Register 0x500)'] = hex(settings[comm.mux0_reg])
+        self.settings_info['ADC1 gain and config (Register 0x501)'] = hex(settings[comm.mux1_reg])
+        self.settings_info['ADC2 gain and config (Register 0x502)'] = hex(settings[comm.mux2_reg])
+        self.settings_info['ADC3 gain and config (Register 0x503)'] = hex(settings[comm.mux3_reg])
+        self.settings_info['Spectrometer Enabled'] = hex(settings[comm.enable_spe])
+        self.settings_info['Spectrometer Averages'] = 2 ** settings[comm.main_average]
+        self.settings_info['Notch Filter Enabled'] = hex(settings[comm.notch_reg])
+        self.settings_info['Notch Averages'] = 2 ** settings[comm.notch_average]
+
+        self.settings_info['Spectrometer Blocks Disabled'] = hex(settings[comm.spe_disable])
+        self.settings_info['Notch Averagers Disabled'] = hex(settings[comm.calibrator_and_notch_disable])
+        self.settings_info['Main Averagers Disabled'] = hex(settings[comm.avg_disable])
+        self.settings_info['Notch Correlators Disabled'] = hex(settings[comm.corr_notch_disable])
+        self.settings_info['Main Correlators Disabled'] = hex(settings[comm.corr_main_disable])
+        self.settings_info['Notch Subtract Disabled'] = hex(settings[comm.notch_subtract_disable])
+
+        self.settings_info['Correlation Array 1'] = hex(settings[comm.corr_array1])
+        self.settings_info['Correlation Array 2'] = hex(settings[comm.corr_array2])
+        self.settings_info['Correlation Array 3'] = hex(settings[comm.corr_array3])
+        self.settings_info['Notch Array 1'] = hex(settings[comm.notch_array1])
+        self.settings_info['Notch Array 2'] = hex(settings[comm.notch_array2])
+        self.settings_info['Notch Array 3'] = hex(settings[comm.notch_array3])
+        main_indexes = comm.unpack_index_array([settings[comm.corr_array1], settings[comm.corr_array2], settings[comm.corr_array3]])
+        notch_indexes = comm.unpack_index_array([settings[comm.notch_array1], settings[comm.notch_array2], settings[comm.notch_array3]])
+        self.settings_info['Main Correlator Indexes'] = ", ".join(hex(i) for i in main_indexes)
+        self.settings_info['Notch Correlator Indexes'] = ", ".join(hex(i) for i in notch_indexes)
+
+        self.settings_info['Calibrator Phaser Averages'] = 2 ** (5 + (settings[comm.Nac1]))
+        self.settings_info['Calibrator Process Averages'] = 2 ** settings[comm.Nac2]
 
         self.logger.info("Setting up internal FPGA voltage readings")
         self.hk.setup_fpga_internal()
@@ -1,9 +1,22 @@
+from .ccsds_header import LuSEE_HEADER
+from .payload_decoder import LuSEE_DECODER
+from .buffer_pool import LuSEE_BUFFER_POOL
+from .ring_queue import LuSEE_RING_QUEUE
+from .rtt_estimator import LuSEE_RTT_ESTIMATOR
+from .capture_writer import LuSEE_CAPTURE_WRITER
 from .process_data import LuSEE_PROCESS_DATA
 from .process_hk import LuSEE_PROCESS_HK
 from .process_reg import LuSEE_PROCESS_REG
 from .ethernet_processing import LuSEE_PROCESSING
+from .capture_replay import LuSEE_CAPTURE_REPLAY
+from .link_udp import LuSEE_LINK_UDP
+from .link_tcp import LuSEE_LINK_TCP
 from .ethernet_comm import LuSEE_ETHERNET
+from .ethernet_async import LuSEE_ETHERNET_ASYNC
+from .ethernet_blocking import LuSEE_ETHERNET_BLOCKING
 from .lusee_comm import LuSEE_COMMS
 from .lusee_plotting import LuSEE_PLOTTING
 from .lusee_hk_emulator import LuSEE_HK_EMULATOR
 from .lusee_hk_eric import LuSEE_HK
+from .lusee_standin import LuSEE_STANDIN
+from .lusee_tcp_bridge import LuSEE_TCP_BRIDGE
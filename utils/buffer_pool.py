@@ -0,0 +1,47 @@
+import threading
+import logging
+import logging.config
+from collections import deque
+
+#Recycled receive buffers, so the listeners don't allocate a new bytes object for every datagram
+#A listener takes a slot with acquire(), fills it with recv_into() and passes a memoryview of it downstream
+#Whoever finishes with that memoryview gives the slot back with release()
+class LuSEE_BUFFER_POOL:
+    def __init__(self, slot_size = 9014, slots = 512):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.debug("Class created")
+        self.slot_size = slot_size
+        self.lock = threading.Lock()
+        #deque appends and pops are atomic, so the free list itself doesn't need the lock
+        self.free = deque(bytearray(slot_size) for i in range(slots))
+        self.stats = {"slots": slots,
+                      "allocated": 0,
+                      "in_use": 0,
+                      "in_use_high_water": 0}
+
+    #Never blocks. If every slot is in use, a new one is made and joins the pool when it's released
+    def acquire(self):
+        try:
+            buf = self.free.pop()
+        except IndexError:
+            buf = bytearray(self.slot_size)
+            with self.lock:
+                self.stats["slots"] += 1
+                self.stats["allocated"] += 1
+        with self.lock:
+            self.stats["in_use"] += 1
+            self.stats["in_use_high_water"] = max(self.stats["in_use_high_water"], self.stats["in_use"])
+        return buf
+
+    #Takes the memoryview that was handed out (or the slot itself). Anything that isn't a pool slot is ignored
+    def release(self, view):
+        buf = view.obj if isinstance(view, memoryview) else view
+        if (not isinstance(buf, bytearray) or len(buf) != self.slot_size):
+            return
+        with self.lock:
+            self.stats["in_use"] -= 1
+        self.free.append(buf)
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats, free = len(self.free))
@@ -0,0 +1,147 @@
+import os
+import sys
+import mmap
+import time
+import json
+import logging
+import logging.config
+
+from utils import LuSEE_CAPTURE_WRITER
+from utils import LuSEE_PROCESSING
+
+#Plays back a file from LuSEE_CAPTURE_WRITER into LuSEE_PROCESSING, the same way the receive thread hands datagrams to it
+#The file is memory mapped, so a capture doesn't have to fit in memory and records aren't read one at a time
+#It can be played at the speed it was recorded at (or a multiple of it) or as fast as processing takes it, for regression runs and decode benchmarks
+class LuSEE_CAPTURE_REPLAY:
+    def __init__(self, path):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.debug("Class created")
+        self.path = path
+        self.file_struct = LuSEE_CAPTURE_WRITER.file_struct
+        self.record_struct = LuSEE_CAPTURE_WRITER.record_struct
+        self.PORT_RREGRESP = 32002
+        self.PORT_HSDATA = 32003
+        self.PORT_HK = 32004
+
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+        magic, version = self.file_struct.unpack_from(self.view)
+        if (magic != LuSEE_CAPTURE_WRITER.magic or version != LuSEE_CAPTURE_WRITER.version):
+            self.close()
+            raise ValueError(f"{path} is not a version {LuSEE_CAPTURE_WRITER.version} capture file")
+        self.stats = {}
+
+    #Any record views still held must be dropped first
+    def close(self):
+        self.view.release()
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    #Yields (time in ns, port, datagram) for every record. The datagram is a view straight into the file, valid until close()
+    def records(self):
+        offset = self.file_struct.size
+        end = len(self.view)
+        header_size = self.record_struct.size
+        while end - offset >= header_size:
+            length, timestamp, port = self.record_struct.unpack_from(self.view, offset)
+            start = offset + header_size
+            if (end - start < length):
+                break
+            offset = start + length
+            yield timestamp, port, self.view[start:offset]
+        if (offset != end):
+            #The writer was stopped partway through a record
+            self.logger.warning(f"{self.path} ends with {end - offset} bytes of an unfinished record, ignoring them")
+
+    #Feeds the capture into processing, or into a new LuSEE_PROCESSING if there isn't one
+    #speed is how many times faster than it was recorded to play it, None plays it as fast as processing takes it
+    #ports are the ones to play back. Register responses are left out by default, since nothing is waiting on them
+    #lossless makes the input queues wait for processing instead of dropping packets while the capture plays
+    #Returns the stats of the playback, with the processing's reassembly stats under "reassembly"
+    def replay(self, processing = None, speed = None, ports = None, lossless = True):
+        own_processing = processing is None
+        if (own_processing):
+            processing = LuSEE_PROCESSING()
+        port_queues = {self.PORT_RREGRESP: "reg_input_queue",
+                       self.PORT_HSDATA: "data_input_queue",
+                       self.PORT_HK: "hk_input_queue"}
+        if (ports is None):
+            ports = (self.PORT_HSDATA, self.PORT_HK)
+        queues = {port: getattr(processing, port_queues[port]) for port in ports}
+        policies = {port_queues[port]: (q.maxsize, q.policy) for port, q in queues.items()}
+        if (lossless):
+            for name, (maxsize, policy) in policies.items():
+                processing.set_queue_policy(name, maxsize, "block")
+
+        pool = processing.buffer_pool
+        in_use = pool.get_stats()["in_use"]
+        stats = {"records": 0, "bytes": 0, "skipped": 0, "too_big": 0}
+        first = None
+        start = time.perf_counter()
+        try:
+            for timestamp, port, data in self.records():
+                q = queues.get(port)
+                if (q is None):
+                    stats["skipped"] += 1
+                    continue
+                if (speed):
+                    if (first is None):
+                        first = timestamp
+                    delay = start + (timestamp - first) / 1e9 / speed - time.perf_counter()
+                    if (delay > 0):
+                        time.sleep(delay)
+                length = len(data)
+                buf = pool.acquire()
+                if (length > len(buf)):
+                    pool.release(buf)
+                    stats["too_big"] += 1
+                    continue
+                buf[:length] = data
+                q.put(memoryview(buf)[:length])
+                stats["records"] += 1
+                stats["bytes"] += length
+            self.wait_idle(processing, queues.values(), in_use)
+        finally:
+            #Lets go of the last view into the file, so it can be closed
+            data = None
+            if (lossless):
+                for name, (maxsize, policy) in policies.items():
+                    processing.set_queue_policy(name, maxsize, policy)
+        stats["elapsed"] = time.perf_counter() - start
+        stats["records_per_second"] = stats["records"] / stats["elapsed"] if stats["elapsed"] else 0
+        stats["reassembly"] = processing.data.get_stats()
+        if (own_processing):
+            processing.stop()
+        self.stats = stats
+        self.logger.info(f"Replayed {stats['records']} records in {stats['elapsed']:.3f} seconds")
+        return stats
+
+    #Processing threads give every receive buffer back to the pool once they're done with it
+    def wait_idle(self, processing, queues, in_use, timeout = 10):
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            if all(q.qsize() == 0 for q in queues) and processing.buffer_pool.get_stats()["in_use"] <= in_use:
+                return True
+            time.sleep(0.001)
+        self.logger.warning(f"Processing still had packets after {timeout} seconds")
+        return False
+
+if __name__ == "__main__":
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    relative_path = '../config/config_logger.ini'
+    config_path = os.path.join(script_dir, relative_path)
+    logging.config.fileConfig(config_path)
+
+    if (len(sys.argv) < 2):
+        print("Usage: python3 -m utils.capture_replay <capture file> [speed]")
+        sys.exit(1)
+    speed = float(sys.argv[2]) if len(sys.argv) > 2 else None
+    with LuSEE_CAPTURE_REPLAY(sys.argv[1]) as replay:
+        print(json.dumps(replay.replay(speed = speed), indent = 4))
@@ -0,0 +1,97 @@
+import struct
+import time
+import threading
+import logging
+import logging.config
+
+#Records every datagram that comes in to a file, so decoding can be run again later with LuSEE_CAPTURE_REPLAY
+#The file starts with a magic string and version, then every datagram is a record of its length (32 bits), the time it came in
+#from time.monotonic_ns() (64 bits) and its UDP port (16 bits), followed by the datagram itself. Everything is little endian
+#write() is called from the receive thread and only copies the datagram. A thread of its own appends them to the file in batches
+class LuSEE_CAPTURE_WRITER:
+    magic = b"LUSEECAP"
+    version = 1
+    file_struct = struct.Struct("<8sH")
+    record_struct = struct.Struct("<IQH")
+
+    def __init__(self, path, flush_interval = 0.2, batch_bytes = 1024 * 1024, max_pending_bytes = 64 * 1024 * 1024):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.debug("Class created")
+        self.path = path
+        #Records are written at least this often in seconds, or as soon as batch_bytes of them are waiting
+        self.flush_interval = flush_interval
+        self.batch_bytes = batch_bytes
+        #If the disk can't keep up, records past this are dropped rather than growing memory forever
+        self.max_pending_bytes = max_pending_bytes
+        self.lock = threading.Lock()
+        self.pending = []
+        self.pending_bytes = 0
+        self.wakeup = threading.Event()
+        self.stop_event = threading.Event()
+        self.stats = {"records": 0, "bytes": 0, "dropped": 0, "writes": 0}
+        self.thread = None
+
+    def start(self):
+        #Appends to a capture that's already there, as long as it is one
+        self.file = open(self.path, "ab")
+        if (self.file.tell() == 0):
+            self.file.write(self.file_struct.pack(self.magic, self.version))
+        else:
+            with open(self.path, "rb") as existing:
+                magic, version = self.file_struct.unpack(existing.read(self.file_struct.size))
+            if (magic != self.magic or version != self.version):
+                self.file.close()
+                raise ValueError(f"{self.path} is not a version {self.version} capture file")
+        self.thread = threading.Thread(target=self.writer,
+                        name="Capture Writer Thread",
+                        daemon = True)
+        self.thread.start()
+        self.logger.info(f"Capturing to {self.path}")
+
+    def stop(self):
+        self.stop_event.set()
+        self.wakeup.set()
+        if (self.thread):
+            self.logger.debug(f"Waiting for {self.thread.name} to join")
+            self.thread.join()
+        self.file.close()
+        self.logger.info(f"Capture to {self.path} closed, {self.stats}")
+
+    def write(self, port, data):
+        record = self.record_struct.pack(len(data), time.monotonic_ns(), port) + bytes(data)
+        with self.lock:
+            if (self.pending_bytes + len(record) > self.max_pending_bytes):
+                self.stats["dropped"] += 1
+                return
+            self.pending.append(record)
+            self.pending_bytes += len(record)
+            full = self.pending_bytes >= self.batch_bytes
+        if (full):
+            self.wakeup.set()
+
+    def writer(self):
+        name = threading.current_thread().name
+        self.logger.debug(f"{name} started")
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            with self.lock:
+                batch = self.pending
+                self.pending = []
+                self.pending_bytes = 0
+            if (batch):
+                data = b"".join(batch)
+                self.file.write(data)
+                self.file.flush()
+                with self.lock:
+                    self.stats["records"] += len(batch)
+                    self.stats["bytes"] += len(data)
+                    self.stats["writes"] += 1
+            #Whatever came in before stop() is written out first
+            if (self.stop_event.is_set()):
+                break
+        self.logger.debug(f"{name} exited")
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats, pending_bytes = self.pending_bytes)
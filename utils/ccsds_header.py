@@ -0,0 +1,36 @@
+import struct
+
+#The CDI header in front of every data and housekeeping packet, kept as integers
+#Packet format defined by Jack Fried in VHDL for custom CDI interface, 13 16 bit words
+#Hex strings like the old header dictionaries are only made by to_dict(), when a product gets written out
+class LuSEE_HEADER:
+    __slots__ = ("udp_packet_num", "header_user_info", "system_status", "message_id", "message_length", "message_spare",
+                 "ccsds_version", "ccsds_packet_type", "ccsds_secheaderflag", "ccsds_appid", "ccsds_groupflags",
+                 "ccsds_sequence_cnt", "ccsds_packetlen")
+
+    header_struct = struct.Struct(">13H")
+
+    def __init__(self, formatted_data):
+        self.udp_packet_num = (formatted_data[0] << 16) + formatted_data[1]
+        self.header_user_info = (formatted_data[2] << 48) + (formatted_data[3] << 32) + (formatted_data[4] << 16) + formatted_data[5]
+        self.system_status = (formatted_data[6] << 16) + formatted_data[7]
+        self.message_id = formatted_data[8] >> 10
+        self.message_length = formatted_data[8] & 0x3FF
+        self.message_spare = formatted_data[9]
+        self.ccsds_version = formatted_data[10] >> 13
+        self.ccsds_packet_type = (formatted_data[10] >> 12) & 0x1
+        self.ccsds_secheaderflag = (formatted_data[10] >> 11) & 0x1
+        self.ccsds_appid = formatted_data[10] & 0x7FF
+        self.ccsds_groupflags = formatted_data[11] >> 14
+        self.ccsds_sequence_cnt = formatted_data[11] & 0x3FFF
+        self.ccsds_packetlen = formatted_data[12]
+
+    @classmethod
+    def from_packet(cls, data):
+        return cls(cls.header_struct.unpack_from(data))
+
+    def to_dict(self):
+        return {name: hex(getattr(self, name)) for name in self.__slots__}
+
+    def __repr__(self):
+        return f"LuSEE_HEADER(ccsds_appid={hex(self.ccsds_appid)}, ccsds_sequence_cnt={self.ccsds_sequence_cnt}, ccsds_groupflags={self.ccsds_groupflags})"
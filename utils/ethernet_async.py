@@ -0,0 +1,362 @@
+import struct
+import socket
+import time
+import asyncio
+import itertools
+import threading
+import logging
+import logging.config
+
+from utils import LuSEE_DECODER
+from utils import LuSEE_BUFFER_POOL
+from utils import LuSEE_RING_QUEUE
+from utils import LuSEE_HEADER
+from utils import LuSEE_PROCESS_DATA
+from utils import LuSEE_PROCESS_HK
+from utils import LuSEE_PROCESS_REG
+from utils import LuSEE_RTT_ESTIMATOR
+
+#Hands every datagram that arrives on one port to a callback, which runs in the event loop
+class LuSEE_DATAGRAM_PROTOCOL(asyncio.DatagramProtocol):
+    def __init__(self, name, callback):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.name = name
+        self.callback = callback
+
+    def datagram_received(self, data, addr):
+        try:
+            self.callback(data)
+        except Exception as e:
+            self.logger.error(f"Exception handling a {self.name} packet: {e}")
+
+    def error_received(self, exc):
+        self.logger.warning(f"Socket error on the {self.name} port: {exc}")
+
+#The same connection as LuSEE_ETHERNET, but run from one asyncio event loop instead of a sender thread, a receive thread and processing threads
+#Packets are decoded as they arrive, with the same register, data and housekeeping processing that LuSEE_PROCESSING uses
+#Many reads and writes can be outstanding at once without any extra threads, like
+#    connection = LuSEE_ETHERNET_ASYNC(endpoint)
+#    await connection.start()
+#    values = await asyncio.gather(*(connection.read_reg(reg) for reg in regs))
+#    async for spectrum in connection.products("pfb"):
+#See ethernet_blocking.py for the same thing with the blocking calls of LuSEE_ETHERNET
+class LuSEE_ETHERNET_ASYNC:
+    def __init__(self, endpoint = None):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.debug("Class created")
+
+        self.UDP_IP = "192.168.121.1"
+        self.PC_IP = "192.168.121.50"
+        self.read_timeout = 1
+
+        self.PORT_WREG = 32000
+        self.PORT_RREG = 32001
+        self.PORT_RREGRESP = 32002
+        self.PORT_HSDATA = 32003
+        self.PORT_HK = 32004
+        self.BUFFER_SIZE = 9014
+        self.RCVBUF_SIZE = 4 * 1024 * 1024
+
+        for key, val in (endpoint or {}).items():
+            if key not in ("UDP_IP", "PC_IP", "PORT_WREG", "PORT_RREG", "PORT_RREGRESP", "PORT_HSDATA", "PORT_HK", "RCVBUF_SIZE"):
+                self.logger.warning(f"Endpoint setting {key} is not a valid setting, ignoring it")
+                continue
+            setattr(self, key, val)
+
+        self.KEY1 = 0xDEAD
+        self.KEY2 = 0xBEEF
+        self.FOOTER = 0xFFFF
+        self.write_struct = struct.Struct(">6H6x")
+
+        self.wait_time = 0.01
+        #"latch" sends the next CDI word as soon as the latch register reports done, "sleep" also waits wait_time after every CDI write
+        self.flow_control = "latch"
+        self.write_combining = True
+        self.cdi_latches = {}
+        self.cdi_writes_skipped = 0
+        self.read_tags = itertools.count()
+        #read_timeout is only the first guess, like LuSEE_ETHERNET the timeouts follow how long replies have been taking
+        self.rtt_estimators = {"cdi": LuSEE_RTT_ESTIMATOR("cdi", initial = self.read_timeout),
+                               "reg": LuSEE_RTT_ESTIMATOR("reg", initial = self.read_timeout)}
+
+        self.start_tlm_data = 0x210
+        self.tlm_reg = 0x218
+        self.cdi_reset = 0x0
+        self.spectrometer_reset = 0x0
+
+        self.latch_register = 0x1
+        self.write_register = 0x2
+        self.readback_register = 0xB
+
+        self.address_read = 0xA30000
+        self.address_write = 0xA20000
+        self.first_data_pack = 0xA00000
+        self.second_data_pack = 0xA10000
+
+        #The processors are shared with the threaded stack, and look for these on their parent
+        self.stop_event = threading.Event()
+        self.stop_signal = object()
+        self.decoder = LuSEE_DECODER()
+        #Datagrams come in as bytes here, the pool is only used for its slot size when sizing product buffers
+        self.buffer_pool = LuSEE_BUFFER_POOL(self.BUFFER_SIZE, slots = 0)
+        self.reg_input_queue = None
+        self.reg_output_queue = None
+        self.data_input_queue = None
+        self.hk_input_queue = None
+        self.dcb_emulator_queue = LuSEE_RING_QUEUE(1024, "drop_oldest", stop_signal = self.stop_signal)
+        #Decoded products wait here for the caller. When one is full the oldest product is dropped, like the threaded output queues
+        self.queue_settings = {"count_output_queue": 16,
+                               "adc_output_queue": 16,
+                               "pfb_output_queue": 64,
+                               "hk_output_queue": 256,
+                               "calib_output_queue": 256}
+        for name, maxsize in self.queue_settings.items():
+            setattr(self, name, asyncio.Queue(maxsize))
+        self.output_queues = {"count": self.count_output_queue,
+                              "adc": self.adc_output_queue,
+                              "pfb": self.pfb_output_queue,
+                              "hk": self.hk_output_queue,
+                              "calib": self.calib_output_queue}
+        self.products_dropped = 0
+
+        self.reg = LuSEE_PROCESS_REG(self)
+        self.data = LuSEE_PROCESS_DATA(self)
+        self.hk = LuSEE_PROCESS_HK(self)
+
+        self.transports = []
+        self.write_transport = None
+        self.cdi_lock = None
+
+    #Opens the sockets in the running event loop
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        #Only one CDI transaction can go out at a time, the DCB emulator latches need the words in order
+        self.cdi_lock = asyncio.Lock()
+        listening_settings = [("register", self.PORT_RREGRESP, self.reg.handle_response),
+                              ("data", self.PORT_HSDATA, self.handle_data),
+                              ("housekeeping", self.PORT_HK, self.handle_hk)]
+        for name, port, callback in listening_settings:
+            transport, protocol = await loop.create_datagram_endpoint(lambda: LuSEE_DATAGRAM_PROTOCOL(name, callback),
+                                                                      sock = self.open_listen_socket(port))
+            self.transports.append(transport)
+        self.write_transport, protocol = await loop.create_datagram_endpoint(lambda: LuSEE_DATAGRAM_PROTOCOL("write", None),
+                                                                             family = socket.AF_INET)
+        self.transports.append(self.write_transport)
+        self.logger.debug(f"Listening at {self.PC_IP} on ports {self.PORT_RREGRESP}, {self.PORT_HSDATA} and {self.PORT_HK}")
+        return self
+
+    async def stop(self):
+        self.logger.debug("Stopping")
+        self.stop_event.set()
+        for transport in self.transports:
+            transport.close()
+        self.transports = []
+        self.reg.cancel_pending_reads()
+        #Anyone waiting on a product gets the stop signal, like with the threaded queues
+        for q in self.output_queues.values():
+            self.put_output(q, self.stop_signal)
+        self.logger.info("Closed gracefully")
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    def open_listen_socket(self, port):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if (self.RCVBUF_SIZE):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.RCVBUF_SIZE)
+        sock.bind((self.PC_IP, port))
+        sock.setblocking(False)
+        return sock
+
+    #Unpack the header into a LuSEE_HEADER record, this is common for all CDI responses
+    def organize_header(self, formatted_data):
+        return LuSEE_HEADER(formatted_data)
+
+    def put_output(self, q, item):
+        if (q.full()):
+            q.get_nowait()
+            self.products_dropped += 1
+        q.put_nowait(item)
+
+    def handle_data(self, data):
+        spec, product = self.data.process_packet(data)
+        if product is None:
+            return
+        self.data.count_event("products")
+        self.put_output(spec["output_queue"], product)
+
+    def handle_hk(self, data):
+        self.put_output(self.hk_output_queue, self.hk.check_data_bootloader(data))
+
+    def write_cdi_reg(self, reg, data, port):
+        self.logger.debug(f"Writing {hex(data)} to CDI Register {hex(reg)}")
+        message = self.write_struct.pack(self.KEY1, self.KEY2, reg, (data >> 16) & 0xFFFF, data & 0xFFFF, self.FOOTER)
+        self.write_transport.sendto(message, (self.UDP_IP, port))
+
+    async def pace(self):
+        if (self.flow_control == "sleep"):
+            await asyncio.sleep(self.wait_time)
+
+    #The estimator for one kind of reply, made with these settings the first time it's asked for
+    def get_rtt_estimator(self, name, initial = 1.0, minimum = 0.01, maximum = 10.0):
+        if name not in self.rtt_estimators:
+            self.rtt_estimators[name] = LuSEE_RTT_ESTIMATOR(name, initial = initial, minimum = minimum, maximum = maximum)
+        return self.rtt_estimators[name]
+
+    def get_timeout_stats(self):
+        return {name: estimator.get_stats() for name, estimator in self.rtt_estimators.items()}
+
+    #Returns the response dictionary, or None if the DCB emulator didn't answer in time
+    async def read_cdi_reg(self, reg):
+        estimator = self.rtt_estimators["cdi"]
+        future = asyncio.get_running_loop().create_future()
+        self.reg.add_pending_cdi_read(int(reg), future)
+        self.write_cdi_reg(int(reg), 0, self.PORT_RREG)
+        try:
+            resp = await asyncio.wait_for(future, estimator.timeout())
+        except asyncio.TimeoutError:
+            estimator.timed_out()
+            self.logger.warning(f"No response when reading CDI Register {hex(reg)}")
+            return None
+        estimator.sample(resp["rtt"])
+        return resp
+
+    async def toggle_cdi_latch(self):
+        self.write_cdi_reg(self.latch_register, 1, self.PORT_WREG)
+        await self.pace()
+        self.write_cdi_reg(self.latch_register, 0, self.PORT_WREG)
+        for attempt in range(11):
+            resp = await self.read_cdi_reg(self.latch_register)
+            if (resp is not None) and (resp["data"] >> 31):
+                return True
+        self.logger.warning(f"toggle_cdi_latch was unable to see the latch register complete. Returned {resp}")
+        return False
+
+    #Writes a word to the CDI write register and latches it, skipping it if the DCB emulator already holds it
+    async def write_cdi_latched(self, latch, value, force = False):
+        if (self.write_combining and not force and self.cdi_latches.get(latch) == value):
+            self.cdi_writes_skipped += 1
+            return True
+        self.write_cdi_reg(self.write_register, value, self.PORT_WREG)
+        await self.pace()
+        success = await self.toggle_cdi_latch()
+        if (success):
+            self.cdi_latches[latch] = value
+        else:
+            self.cdi_latches.pop(latch, None)
+        return success
+
+    #Must be called holding cdi_lock
+    async def spectrometer_write(self, reg, val):
+        self.logger.debug(f"Writing {hex(val)} to Register {hex(reg)}")
+        success = await self.write_cdi_latched("msb", self.first_data_pack + ((val >> 16) & 0xFFFF))
+        success &= await self.write_cdi_latched("lsb", self.second_data_pack + (val & 0xFFFF))
+        success &= await self.write_cdi_latched("address", self.address_write + reg, force = True)
+        return success
+
+    #Returns whether every latch toggle was acknowledged
+    async def write_reg(self, reg, val):
+        async with self.cdi_lock:
+            return await self.spectrometer_write(int(reg), int(val))
+
+    #The writes go out back to back in this order, returns one result per write
+    async def write_regs(self, writes):
+        results = []
+        async with self.cdi_lock:
+            for reg, val in writes:
+                results.append(await self.spectrometer_write(int(reg), int(val)))
+        return results
+
+    #Only the request holds the CDI lock. The response is awaited after it's released, so the next read can go out meanwhile
+    async def read_reg(self, reg):
+        reg = int(reg)
+        estimator = self.rtt_estimators["reg"]
+        tries = 10
+        for i in range(tries):
+            future = asyncio.get_running_loop().create_future()
+            async with self.cdi_lock:
+                #Latching the address is what makes the DCB emulator fetch the value, so it goes out even if it didn't change
+                await self.write_cdi_latched("address", self.address_read + reg, force = True)
+                self.reg.add_pending_read(next(self.read_tags), reg, future)
+                self.write_cdi_reg(self.readback_register, 0, self.PORT_RREG)
+            start = time.perf_counter()
+            timeout = estimator.timeout()
+            try:
+                resp = await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                #The read stays in the pending table until it's taken as lost, so if its response is just late it gets dropped
+                lost_after = self.reg.give_up_read(future, timeout)
+                estimator.timed_out()
+                self.logger.warning(f"Register {hex(reg)} had no response for the {i} time. Retrying")
+                await asyncio.sleep(max(lost_after - time.perf_counter(), 0))
+                continue
+            self.logger.debug(f"Read back {hex(resp['data'])}")
+            estimator.sample(time.perf_counter() - start)
+            return resp["data"]
+        self.logger.warning(f"Register tried {tries} times, but could not get a response for the register")
+        return None
+
+    #Reads a list of registers with all the reads in flight at once, returns a dictionary of register to value
+    async def read_many(self, regs):
+        regs = [int(i) for i in regs]
+        values = await asyncio.gather(*(self.read_reg(reg) for reg in regs))
+        return dict(zip(regs, values))
+
+    async def reset(self):
+        self.logger.info("Resetting, wait a few seconds")
+        await self.write_reg(self.spectrometer_reset, 1)
+        await asyncio.sleep(3)
+        await self.write_reg(self.spectrometer_reset, 0)
+        await asyncio.sleep(2)
+        async with self.cdi_lock:
+            self.cdi_latches.clear()
+            self.write_cdi_reg(self.cdi_reset, 1, self.PORT_WREG)
+            await asyncio.sleep(2)
+            self.write_cdi_reg(self.cdi_reset, 0, self.PORT_WREG)
+            await asyncio.sleep(1)
+            self.write_cdi_reg(self.latch_register, 0, self.PORT_WREG)
+            await asyncio.sleep(self.wait_time)
+
+    async def request_fw_packet(self):
+        await self.write_regs([(self.start_tlm_data, 1), (self.start_tlm_data, 0)])
+
+    async def request_sw_packet(self):
+        await self.write_regs([(self.tlm_reg, 1), (self.tlm_reg, 0)])
+
+    #The next product of a type ("pfb", "adc", "count", "calib" or "hk"), or None if nothing comes within the timeout
+    async def get_product(self, product, timeout = 1):
+        try:
+            resp = await asyncio.wait_for(self.output_queues[product].get(), timeout)
+        except asyncio.TimeoutError:
+            self.logger.warning(f"{product} data never came")
+            return None
+        if resp is self.stop_signal:
+            return None
+        return resp
+
+    #Throws away the products of a type waiting in the queue, returns how many there were
+    def clear_products(self, product):
+        q = self.output_queues[product]
+        cleared = 0
+        while not q.empty():
+            resp = q.get_nowait()
+            if resp is self.stop_signal:
+                #Whoever waits next still has to see it
+                q.put_nowait(resp)
+                break
+            cleared += 1
+        if (cleared):
+            self.logger.warning(f"Cleared {cleared} {product} products from the queue")
+        return cleared
+
+    #Yields every product of a type as it's decoded, until the connection is stopped
+    async def products(self, product):
+        q = self.output_queues[product]
+        while not self.stop_event.is_set():
+            resp = await q.get()
+            if resp is self.stop_signal:
+                break
+            yield resp
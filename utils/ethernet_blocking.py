@@ -0,0 +1,149 @@
+import asyncio
+import threading
+from queue import Empty
+from concurrent.futures import wait as wait_futures
+import logging
+import logging.config
+
+from utils import LuSEE_ETHERNET_ASYNC
+
+#Blocking calls like LuSEE_ETHERNET's, run on a LuSEE_ETHERNET_ASYNC connection in one event loop thread
+#Each call hands a coroutine to the loop and waits on it, so scripts written for the threaded connection keep working
+#That includes LuSEE_COMMS, so the calls it makes behave like LuSEE_ETHERNET's, down to product timeouts raising queue.Empty
+class LuSEE_ETHERNET_BLOCKING:
+    def __init__(self, endpoint = None):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.debug("Class created")
+        #Like LuSEE_ETHERNET, a batch of writes is waited on for write_timeout plus write_timeout_per_write for each write
+        self.write_timeout = 10
+        self.write_timeout_per_write = 1
+
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = threading.Thread(target=self.loop.run_forever,
+                            name="Event Loop Thread",
+                            daemon = True)
+        self.loop_thread.start()
+        self.connection = self.call(self.make_connection(endpoint))
+        #Has the same decoder and data, housekeeping and register processors as LuSEE_PROCESSING
+        self.processing = self.connection
+        self.stop_signal = self.connection.stop_signal
+        self.spectrometer_reset = self.connection.spectrometer_reset
+        self.cdi_reset = self.connection.cdi_reset
+
+    #The async queues and lock have to be made inside the loop
+    async def make_connection(self, endpoint):
+        return await LuSEE_ETHERNET_ASYNC(endpoint).start()
+
+    #Runs a coroutine in the loop thread and returns its concurrent.futures.Future
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def call(self, coro, timeout = None):
+        return self.submit(coro).result(timeout)
+
+    def stop(self):
+        self.call(self.connection.stop())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loop_thread.join()
+        self.loop.close()
+
+    def read_reg(self, reg):
+        return self.call(self.connection.read_reg(reg))
+
+    def read_many(self, regs):
+        return self.call(self.connection.read_many(regs))
+
+    #Reads every register from start to end, including end
+    def read_range(self, start, end):
+        return self.read_many(range(int(start), int(end) + 1))
+
+    #There are no shadowed registers here, every read goes to the board
+    def read_reg_cached(self, reg):
+        return self.read_reg(reg)
+
+    def invalidate_shadow(self):
+        pass
+
+    def read_cdi_reg(self, reg):
+        return self.call(self.connection.read_cdi_reg(reg))
+
+    def write_reg(self, reg, val, wait = True):
+        return self.write_regs([(reg, val)], wait = wait)[0]
+
+    #Returns one future per write like LuSEE_ETHERNET. The loop runs them in order, since each one waits its turn for the CDI lock
+    def write_regs(self, writes, wait = True):
+        futures = [self.submit(self.connection.write_reg(reg, val)) for reg, val in writes]
+        if (wait):
+            self.wait_writes(futures)
+        return futures
+
+    #Blocks until the given write futures are done, and warns about any that weren't or didn't get a latch acknowledgement
+    def wait_writes(self, futures, timeout = None):
+        if (timeout is None):
+            timeout = self.write_timeout + self.write_timeout_per_write * len(futures)
+        done, not_done = wait_futures(futures, timeout)
+        if (not_done):
+            self.logger.warning(f"{len(not_done)} register writes were not done after {timeout} seconds")
+            return False
+        failed = [i for i in done if i.cancelled() or i.exception() or not i.result()]
+        if (failed):
+            self.logger.warning(f"{len(failed)} register writes did not get a CDI latch acknowledgement")
+            return False
+        return True
+
+    def get_rtt_estimator(self, name, initial = 1.0, minimum = 0.01, maximum = 10.0):
+        return self.connection.get_rtt_estimator(name, initial = initial, minimum = minimum, maximum = maximum)
+
+    def get_timeout_stats(self):
+        return self.connection.get_timeout_stats()
+
+    def reset(self):
+        self.call(self.connection.reset())
+
+    def request_fw_packet(self):
+        self.call(self.connection.request_fw_packet())
+
+    def request_sw_packet(self):
+        self.call(self.connection.request_sw_packet())
+
+    #Like the threaded output queues, raises queue.Empty if nothing comes within the timeout and returns None once stopped
+    async def next_product(self, product, timeout):
+        try:
+            resp = await asyncio.wait_for(self.connection.output_queues[product].get(), timeout)
+        except asyncio.TimeoutError:
+            raise Empty
+        if resp is self.stop_signal:
+            return None
+        return resp
+
+    def get_product(self, product, timeout, clear = False):
+        resp = self.call(self.next_product(product, timeout))
+        if (clear and resp is not None):
+            self.call(self.clear_products(product))
+        return resp
+
+    async def clear_products(self, product):
+        return self.connection.clear_products(product)
+
+    #Returns None if the ADC data never came, like LuSEE_ETHERNET
+    def get_adc_data(self, timeout = 1):
+        try:
+            return self.get_product("adc", timeout)
+        except Empty:
+            self.logger.warning(f"ADC data never came")
+            return None
+
+    def get_count_data(self, timeout = 1):
+        return self.get_product("count", timeout)
+
+    def get_pfb_data(self, timeout = 1, clear = False):
+        return self.get_product("pfb", timeout, clear)
+
+    def clear_pfb_data(self):
+        return self.call(self.clear_products("pfb"))
+
+    def get_calib_data(self, timeout = 10, clear = False):
+        return self.get_product("calib", timeout, clear)
+
+    def read_hk_message(self, timeout = 10):
+        return self.call(self.connection.get_product("hk", timeout))
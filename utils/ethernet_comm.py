@@ -6,25 +6,51 @@ import binascii
 import threading
 import queue
 from queue import Empty
-import select
+import itertools
+import contextlib
+from concurrent.futures import Future, CancelledError, TimeoutError as FutureTimeout, wait as wait_futures
 import logging
 import logging.config
 from datetime import datetime
+from utils import LuSEE_HEADER
+from utils import LuSEE_RTT_ESTIMATOR
+from utils import LuSEE_CAPTURE_WRITER
 from utils import LuSEE_PROCESSING
+from utils import LuSEE_LINK_UDP
+from utils import LuSEE_LINK_TCP
 
 class LuSEE_ETHERNET:
-    _instance = None
-
-    def __new__(cls, *args, **kwargs):
-        if cls._instance is None:
-            cls._instance = super().__new__(cls, *args, **kwargs)
-        return cls._instance
-
-    def __init__(self):
+    #There is one connection per endpoint, so several boards can be driven from one process
+    #Creating it again with the same endpoint gives back the same connection, with its own processing, queues and threads
+    #LuSEE_ETHERNET() with no endpoint gives back the connection with the default endpoint, or the only connection open,
+    #so code written for one board keeps working. With several boards open it can't tell which one is meant, and raises ValueError
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __new__(cls, endpoint = None, *args, **kwargs):
+        with cls._instances_lock:
+            key = cls.endpoint_key(endpoint)
+            if (endpoint is None and key not in cls._instances and cls._instances):
+                if (len(cls._instances) > 1):
+                    raise ValueError(f"There are {len(cls._instances)} connections open, give the endpoint of the one you want")
+                return next(iter(cls._instances.values()))
+            if key not in cls._instances:
+                cls._instances[key] = super().__new__(cls)
+            return cls._instances[key]
+
+    @staticmethod
+    def endpoint_key(endpoint):
+        return tuple(sorted((endpoint or {}).items()))
+
+    #The endpoint is a dictionary that can override any of the IP and port settings below, like
+    #{"UDP_IP": "127.0.0.1", "PC_IP": "127.0.0.1"} to talk to the local stand-in in lusee_standin.py
+    #Boards driven from the same process need different PC_IP or listening ports, since each connection binds its own
+    def __init__(self, endpoint = None):
         if not hasattr(self, '_initialized'):
             self._initialized = True
             self.logger = logging.getLogger(self.__class__.__name__)
             self.logger.debug("Class created")
+            self.key = self.endpoint_key(endpoint)
 
             self.UDP_IP = "192.168.121.1"
             self.PC_IP = "192.168.121.50"
@@ -36,6 +62,19 @@ class LuSEE_ETHERNET:
             self.PORT_HSDATA = 32003
             self.PORT_HK = 32004
             self.BUFFER_SIZE = 9014
+            #Kernel receive buffer for each listening socket, so bursts like a calibrator dump aren't dropped by the OS
+            #The OS may cap it (net.core.rmem_max on Linux). None leaves the OS default
+            self.RCVBUF_SIZE = 4 * 1024 * 1024
+            #"udp" talks straight to the DCB emulator. "tcp" goes through one connection to a lusee_tcp_bridge.py at TCP_IP:TCP_PORT
+            self.LINK = "udp"
+            self.TCP_IP = "127.0.0.1"
+            self.TCP_PORT = 32010
+
+            for key, val in (endpoint or {}).items():
+                if key not in ("UDP_IP", "PC_IP", "PORT_WREG", "PORT_RREG", "PORT_RREGRESP", "PORT_HSDATA", "PORT_HK", "RCVBUF_SIZE", "LINK", "TCP_IP", "TCP_PORT"):
+                    self.logger.warning(f"Endpoint setting {key} is not a valid setting, ignoring it")
+                    continue
+                setattr(self, key, val)
 
             self.KEY1 = 0xDEAD
             self.KEY2 = 0xBEEF
@@ -43,6 +82,28 @@ class LuSEE_ETHERNET:
 
             self.wait_time = 0.01
             self.cdi_wait_time = 0.1
+            #How long a caller of write_reg/write_regs will block waiting for the sender thread to finish the writes
+            #A batch gets write_timeout plus write_timeout_per_write for each write in it, since they go out one after another
+            self.write_timeout = 10
+            self.write_timeout_per_write = 1
+            #"latch" sends the next CDI word as soon as the latch register reports done
+            #"sleep" also waits wait_time after every CDI write, for links where the latch readback can't be trusted
+            #"pipelined" doesn't wait for each latch and only checks the last latch of a batch. It's for links that keep the words in order
+            #all the way to the DCB emulator, and hasn't been tried against hardware yet, so nothing turns it on by itself
+            self.flow_control = "latch"
+            self.rtt_lock = threading.Lock()
+            self.rtt_stats = {}
+            #How long to wait for a reply adapts to how long replies have been taking, see LuSEE_RTT_ESTIMATOR
+            #read_timeout is only the first guess. Products get their own estimators from get_rtt_estimator, by type and averaging
+            self.rtt_estimators = {"cdi": LuSEE_RTT_ESTIMATOR("cdi", initial = self.read_timeout),
+                                   "reg": LuSEE_RTT_ESTIMATOR("reg", initial = self.read_timeout)}
+            #Remembers what the DCB emulator holds in its data and address latches, so identical words aren't sent again
+            self.write_combining = True
+            self.cdi_latches = {}
+            self.cdi_writes_skipped = 0
+            #Every spectrometer register read gets a sequence tag so its response can be matched to it
+            self.read_tags = itertools.count()
+            self.last_read = None
 
             self.start_tlm_data = 0x210
             self.tlm_reg = 0x218
@@ -63,25 +124,46 @@ class LuSEE_ETHERNET:
             self.max_packet = 0x7FB
             self.exception_registers = [0x0, 0x200, 0x240, 0x241, 0x300, 0x303, 0x400, 0x500, 0x600, 0x700, 0x703, 0x800]
 
+            #Optional copy of what was last written to or read from each spectrometer register
+            #When enabled, it serves read-modify-writes without a round trip and skips writes of a value that's already on the board
+            self.shadow_enabled = False
+            self.shadow_lock = threading.Lock()
+            self.shadow = {}
+            self.shadow_writes_skipped = 0
+            #Status, counter and strobe registers change on their own or must always be written, so they never go in the shadow
+            self.volatile_registers = set(self.exception_registers)
+            self.volatile_registers.update([0x004, 0x005, 0x006, 0x007, 0x008, 0x010, 0x015,
+                                            0x020, 0x021, 0x022, 0x023, 0x100, 0x120, 0x121,
+                                            0x210, 0x213, 0x218, 0x220, 0x224, 0x230, 0x231,
+                                            0x302, 0x320, 0x324, 0x432, 0x852])
+            self.volatile_registers.update(range(0x330, 0x380))
+            self.volatile_registers.update(range(0x460, 0x470))
+            self.volatile_registers.update(range(0x620, 0x680))
+            self.volatile_registers.update(range(0x81C, 0x83C))
+            self.volatile_registers.update(range(0x9EB, 0x9EF))
+
             self.stop_event = threading.Event()
             self.processing = LuSEE_PROCESSING()
 
-            self.dummy_socket, self.dummy_socket_wakeup = socket.socketpair()
-            listening_thread_settings = [("Register Response Thread", self.PORT_RREGRESP, self.processing.reg_input_queue),
-                                        ("Data Thread", self.PORT_HSDATA, self.processing.data_input_queue),
-                                        ("Housekeeping Thread", self.PORT_HK, self.processing.hk_input_queue)]
-            self.listen_threads = []
-            for listen_settings in listening_thread_settings:
-                thread = threading.Thread(target=self.listener,
-                            name=listen_settings[0],
-                            daemon = True,
-                            args=(listen_settings[1], listen_settings[2])
-                            )
-                thread.start()
-                self.listen_threads.append(thread)
-
-            #Set up socket for IPv4 and UDP
-            self.sock_write = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            #Each port's datagrams go to its own processing queue
+            self.port_queues = {self.PORT_RREGRESP: self.processing.reg_input_queue,
+                                self.PORT_HSDATA: self.processing.data_input_queue,
+                                self.PORT_HK: self.processing.hk_input_queue}
+            #Register responses are decoded in the receive thread and complete the waiting read right there
+            #Set to False to send them through reg_input_queue and the register processing thread instead
+            self.fast_register_path = True
+            #When there's a LuSEE_CAPTURE_WRITER here, every datagram that comes in is recorded to it, see start_capture()
+            self.capture = None
+            #Set once the link can't receive any more, see link_lost()
+            self.link_error = None
+            if (self.LINK == "tcp"):
+                #Still "latch" flow control. The bridge sends every word on as its own datagram, so the DCB emulator needs the same pacing
+                self.link = LuSEE_LINK_TCP(self.TCP_IP, self.TCP_PORT, self.processing.buffer_pool)
+            else:
+                self.link = LuSEE_LINK_UDP(self.UDP_IP, self.PC_IP, list(self.port_queues), self.processing.buffer_pool, self.RCVBUF_SIZE)
+            self.receive_stats = self.link.stats
+            self.link.start(self.deliver, self.link_lost)
+
             self.stop_signal = object()
             self.send_queue = queue.Queue()
             self.send_thread = threading.Thread(target=self.sender,
@@ -96,50 +178,64 @@ class LuSEE_ETHERNET:
         self.logger.debug(f"Waiting for {self.send_thread.name} to join")
         self.send_thread.join()
         self.logger.debug(f"Class sees that {self.send_thread.name} is done")
-        try:
-            self.dummy_socket_wakeup.send(b'\x00')
-        except OSError:
-            pass
-        for i in self.listen_threads:
-            self.logger.debug(f"Waiting for {i.name} to join")
-            i.join()
-            self.logger.debug(f"Class sees that {i.name} is done")
+        #Anything still in the send queue will never be written, so don't leave callers waiting on it
+        while not self.send_queue.empty():
+            task = self.send_queue.get()
+            if task is not self.stop_signal:
+                for future in task.get("futures", [task.get("future")]):
+                    if (future):
+                        future.cancel()
+        self.link.stop()
+        self.stop_capture()
         self.processing.stop()
+        #A new connection can be made to this endpoint from now on
+        with self._instances_lock:
+            if (self._instances.get(self.key) is self):
+                del self._instances[self.key]
         self.logger.info("Closed gracefully")
 
-    def listener(self, port, q):
-        name = threading.current_thread().name
-        self.logger.debug(f"{name} started, will listen at {self.PC_IP}:{port}")
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.bind((self.PC_IP, port))
-        try:
-            while not self.stop_event.is_set():
-                #This checks the sockets at an OS level and blocks unless there's data in any of the two sockets
-                #This is needed to gracefully exit when recvfrom blocks and wont get any signal in the thread
-                ready, _, _ = select.select([sock, self.dummy_socket], [], [], None)
-                if self.dummy_socket in ready:
-                    self.logger.debug(f"{name} has been told to stop. Exiting...")
-                    break
-                if sock in ready:
-                    try:
-                        data, addr = sock.recvfrom(self.BUFFER_SIZE)
-                        self.logger.debug(f"Received data in {name} from {addr}")
-                        q.put(data)
-                    except OSError as e:
-                        self.logger.debug(f"OSError in {name}: {e}")
-                        break
-        except Exception as e:
-            self.logger.debug(f"Exception in {name}: {e}")
-        finally:
-            self.logger.debug(f"{name} finally")
-            if sock:
-                sock.close()
-            if self.dummy_socket:
-                self.logger.debug(f"{name} sees dummy socket")
-                self.dummy_socket.close()
-            if self.dummy_socket_wakeup:
-                self.dummy_socket_wakeup.close()
-            self.logger.debug(f"{name} exited")
+    #Called from the link's receive thread for every datagram, with a memoryview of a buffer pool slot
+    def deliver(self, port, view):
+        capture = self.capture
+        if (capture):
+            capture.write(port, view)
+        if (self.fast_register_path and port == self.PORT_RREGRESP):
+            try:
+                self.processing.reg.handle_response(view)
+            finally:
+                self.processing.buffer_pool.release(view)
+            return
+        q = self.port_queues.get(port)
+        if (q is None):
+            self.logger.warning(f"Got a packet for port {port}, which isn't listened to")
+            self.processing.buffer_pool.release(view)
+            return
+        q.put(view)
+
+    #Called from the link's receive thread when nothing more can come back, like when the TCP bridge closes the connection
+    #Reads waiting on a response are ended right away with CancelledError instead of each timing out, and new reads and writes fail straight away
+    #There's no reconnecting, stop() this connection and make a new one
+    def link_lost(self, reason):
+        self.link_error = reason
+        self.logger.error(f"Lost the link to the DCB emulator ({reason}), reads and writes will fail until a new connection is made")
+        self.processing.reg.cancel_pending_reads()
+
+    #Starts recording every datagram on the listening ports to a capture file, which LuSEE_CAPTURE_REPLAY can play back later
+    #Recording to a file that's already a capture adds to the end of it
+    def start_capture(self, path, **kwargs):
+        self.stop_capture()
+        capture = LuSEE_CAPTURE_WRITER(path, **kwargs)
+        capture.start()
+        self.capture = capture
+
+    #Returns the stats of the capture that was stopped, or None if nothing was being recorded
+    def stop_capture(self):
+        capture = self.capture
+        self.capture = None
+        if (capture is None):
+            return None
+        capture.stop()
+        return capture.get_stats()
 
     #There needs to be only one sending thread, because with the LuSEE DCB emulator,
     #Reading back register values requires writing to be done in a specific ccsds_sequence_cnt
@@ -156,80 +252,203 @@ class LuSEE_ETHERNET:
                 break
 
             if (task["command"] == "write"):
-                reg = int(task["reg"])
-                val = int(task["val"])
-                self.logger.debug(f"Thread is writing {hex(val)} to Register {hex(reg)}")
-
-                #Splits the register up, since both halves need to go through socket.htons seperately
-                dataValMSB = ((val >> 16) & 0xFFFF)
-                dataValLSB = val & 0xFFFF
-
-                dataMSB = self.first_data_pack + dataValMSB
-                self.write_cdi_reg(self.write_register, dataMSB, self.PORT_WREG)
-                time.sleep(self.wait_time)
-                self.toggle_cdi_latch()
-
-                dataLSB = self.second_data_pack + dataValLSB
-                self.write_cdi_reg(self.write_register, dataLSB, self.PORT_WREG)
-                time.sleep(self.wait_time)
-                self.toggle_cdi_latch()
-
-                address_value = self.address_write + reg
-                self.write_cdi_reg(self.write_register, address_value, self.PORT_WREG)
-                time.sleep(self.wait_time)
-                self.toggle_cdi_latch()
+                self.spectrometer_write(task["reg"], task["val"])
+            elif (task["command"] == "write_batch"):
+                #The whole batch goes out back to back, only paced by the CDI latch acknowledgements
+                #With "pipelined" flow control it goes out in one write, and the last latch acknowledgement stands for all of it
+                results = []
+                with self.coalesce():
+                    for (reg, val), future in zip(task["writes"], task["futures"]):
+                        if (self.link_error):
+                            #Queued before the link was lost, it can't go out now
+                            future.cancel()
+                        if not future.set_running_or_notify_cancel():
+                            self.forget_shadow(reg)
+                            continue
+                        results.append((reg, future, self.spectrometer_write(reg, val)))
+                        if (self.flow_control != "pipelined"):
+                            self.finish_write(*results.pop())
+                confirmed = self.confirm_pipelined()
+                for reg, future, success in results:
+                    self.finish_write(reg, future, success and confirmed)
             elif (task["command"] == "read"):
                 reg = int(task["reg"])
-                self.logger.debug(f"Thread is reading Register {hex(reg)}")
+                future = task["future"]
+                if (self.link_error):
+                    future.cancel()
+                if not future.set_running_or_notify_cancel():
+                    continue
+                self.logger.debug(f"Thread is reading Register {hex(reg)} (read #{task['tag']})")
+                if (self.flow_control == "pipelined" and self.last_read is not None):
+                    #No latch poll goes out between readbacks to show that one's response was lost, so only one is in flight at a time
+                    done, not_done = wait_futures([self.last_read], self.rtt_estimators["reg"].timeout())
+                    if (not_done):
+                        #Its response is taken as lost, so it isn't given to this read
+                        self.processing.reg.give_up_read(self.last_read, 0)
+                self.last_read = future
 
                 address_value = self.address_read + reg
-                #Tells the DCB emulator which register to read
-                self.write_cdi_reg(self.write_register, address_value, self.PORT_WREG)
-                time.sleep(self.wait_time)
-                self.toggle_cdi_latch()
-                #Tells the DCB emulator the command to read
-                self.write_cdi_reg(self.readback_register, 0, self.PORT_RREG)
+                with self.coalesce():
+                    #Tells the DCB emulator which register to read. Latching it is what makes the DCB emulator fetch the value
+                    #into its readback register, so it has to go out even if it's the same register as last time
+                    self.write_cdi_latched("address", address_value, force = True)
+                    #Tells the DCB emulator the command to read
+                    self.processing.reg.add_pending_read(task["tag"], reg, future)
+                    self.write_cdi_reg(self.readback_register, 0, self.PORT_RREG)
+                if (task["sent"]):
+                    task["sent"].set()
             elif (task["command"] == "write_bootloader"):
                 self.logger.info(f"Writing {hex(task['message'])} to the bootloader")
+                #Bootloader messages go through the same write register, so forget what the latches hold
+                self.cdi_latches.clear()
                 self.write_cdi_reg(self.write_register, task["message"])
-                time.sleep(self.wait_time)
+                self.pace()
                 self.toggle_cdi_latch()
+                self.confirm_pipelined()
             else:
                 self.logger.warning(f"Unknown command in send queue: {task}")
 
-        self.sock_write.close()
         self.logger.debug(f"{name} exited")
 
+    #Only "pipelined" flow control can hold words back, the others wait for each latch readback before going on
+    def coalesce(self):
+        if (self.flow_control == "pipelined"):
+            return self.link.coalesce()
+        return contextlib.nullcontext()
+
+    #Writes to a spectrometer register go through the DCB emulator's CDI data and address latches
+    #Returns whether every latch toggle was acknowledged
+    def spectrometer_write(self, reg, val):
+        reg = int(reg)
+        val = int(val)
+        self.logger.debug(f"Thread is writing {hex(val)} to Register {hex(reg)}")
+        start = time.perf_counter()
+
+        #Splits the register up, since both halves need to go through socket.htons seperately
+        dataValMSB = ((val >> 16) & 0xFFFF)
+        dataValLSB = val & 0xFFFF
+
+        #Consecutive writes often share the same upper or lower half, those don't need to be sent again
+        dataMSB = self.first_data_pack + dataValMSB
+        success = self.write_cdi_latched("msb", dataMSB)
+
+        dataLSB = self.second_data_pack + dataValLSB
+        success &= self.write_cdi_latched("lsb", dataLSB)
+
+        #The address write is what triggers the register write, so it always goes out
+        address_value = self.address_write + reg
+        success &= self.write_cdi_latched("address", address_value, force = True)
+        self.record_rtt("write", time.perf_counter() - start)
+        return success
+
+    #Writes a word to the CDI write register and latches it, skipping it if the DCB emulator already holds it
+    def write_cdi_latched(self, latch, value, force = False):
+        if (self.write_combining and not force and self.cdi_latches.get(latch) == value):
+            self.cdi_writes_skipped += 1
+            return True
+        self.write_cdi_reg(self.write_register, value, self.PORT_WREG)
+        self.pace()
+        success = self.toggle_cdi_latch()
+        #If the latch wasn't acknowledged, we can't know what the DCB emulator ended up holding
+        if (success):
+            self.cdi_latches[latch] = value
+        else:
+            self.cdi_latches.pop(latch, None)
+        return success
+
+    #In "latch" flow control the latch readback is the only pacing, the fixed sleep is the fallback
+    def pace(self):
+        if (self.flow_control == "sleep"):
+            time.sleep(self.wait_time)
+
     def toggle_cdi_latch(self):
+        start = time.perf_counter()
         self.write_cdi_reg(self.latch_register, 1, self.PORT_WREG)
-        time.sleep(self.wait_time)
+        self.pace()
         self.write_cdi_reg(self.latch_register, 0, self.PORT_WREG)
+        if (self.flow_control == "pipelined"):
+            #Checked once for the whole batch by confirm_pipelined
+            return True
+        return self.wait_cdi_latch(start)
+
+    #Polls the latch register until it reports done
+    def wait_cdi_latch(self, start):
         attempt = 0
         while True:
             resp = self.read_cdi_reg(self.latch_register)
             if resp is self.processing.stop_signal:
                 self.logger.debug(f"toggle_cdi_latch has been told to stop. Exiting...")
-                break
-            if (resp["data"] >> 31):
+                return False
+            if (resp is not None) and (resp["data"] >> 31):
                 self.logger.debug(f"toggle_cdi_latch was successful outer loop")
-                break
+                self.record_rtt("latch", time.perf_counter() - start)
+                return True
             else:
                 attempt += 1
             if (attempt > 10):
                 self.logger.warning(f"toggle_cdi_latch was unable to see the latch register complete. Returned {resp}")
-                break
+                return False
+
+    #In "pipelined" flow control, waits for the last latch that was sent. The DCB emulator handles words in order, so all the ones before it are done too
+    def confirm_pipelined(self):
+        if (self.flow_control != "pipelined"):
+            return True
+        success = self.wait_cdi_latch(time.perf_counter())
+        if (not success):
+            self.cdi_latches.clear()
+        return success
+
+    def finish_write(self, reg, future, success):
+        if (not success):
+            self.forget_shadow(reg)
+        future.set_result(success)
+
+    #Keeps running round trip time statistics for each type of operation, in seconds
+    def record_rtt(self, op, rtt):
+        with self.rtt_lock:
+            stats = self.rtt_stats.setdefault(op, {"count": 0, "total": 0.0, "min": rtt, "max": rtt, "last": rtt})
+            stats["count"] += 1
+            stats["total"] += rtt
+            stats["min"] = min(stats["min"], rtt)
+            stats["max"] = max(stats["max"], rtt)
+            stats["last"] = rtt
+
+    def get_rtt_stats(self):
+        with self.rtt_lock:
+            return {op: dict(stats, mean = stats["total"] / stats["count"]) for op, stats in self.rtt_stats.items()}
+
+    #The estimator for one kind of reply, made with these settings the first time it's asked for
+    def get_rtt_estimator(self, name, initial = 1.0, minimum = 0.01, maximum = 10.0):
+        with self.rtt_lock:
+            if name not in self.rtt_estimators:
+                self.rtt_estimators[name] = LuSEE_RTT_ESTIMATOR(name, initial = initial, minimum = minimum, maximum = maximum)
+            return self.rtt_estimators[name]
+
+    def get_timeout_stats(self):
+        with self.rtt_lock:
+            estimators = dict(self.rtt_estimators)
+        return {name: estimator.get_stats() for name, estimator in estimators.items()}
 
     def read_cdi_reg(self, reg):
         self.logger.debug(f"Reading CD Register {hex(reg)}")
+        if self.stop_event.is_set() or self.link_error:
+            return self.processing.stop_signal
+        estimator = self.rtt_estimators["cdi"]
+        future = Future()
+        self.processing.reg.add_pending_cdi_read(int(reg), future)
         self.write_cdi_reg(int(reg), 0, self.PORT_RREG)
-        while not self.stop_event.is_set():
-            resp = self.processing.dcb_emulator_queue.get(True, self.read_timeout)
-            self.processing.dcb_emulator_queue.task_done()
-            if resp is self.processing.stop_signal:
-                self.logger.debug(f"toggle_cdi_latch has been told to stop. Exiting...")
-                break
-            else:
-                return resp
+        try:
+            resp = future.result(estimator.timeout())
+        except FutureTimeout:
+            future.cancel()
+            estimator.timed_out()
+            self.logger.warning(f"No response when reading CDI Register {hex(reg)}")
+            return None
+        except CancelledError:
+            self.logger.debug(f"read_cdi_reg has been told to stop. Exiting...")
+            return self.processing.stop_signal
+        estimator.sample(resp["rtt"])
+        return resp
 
     def write_cdi_reg(self, reg, data, port):
         self.logger.debug(f"Writing {hex(data)} to CDI Register {hex(reg)}")
@@ -240,41 +459,187 @@ class LuSEE_ETHERNET:
                                     socket.htons(reg),socket.htons(dataValMSB),
                                     socket.htons(dataValLSB),socket.htons(self.FOOTER), 0x0, 0x0, 0x0)
 
-        self.sock_write.sendto(WRITE_MESSAGE,(self.UDP_IP, port))
-
-    def write_reg(self, reg, val):
-        write_dict = {"command": "write",
-                      "reg": int(reg),
-                      "val": int(val)}
-        self.send_queue.put(write_dict)
-        self.logger.debug(f"Writing {hex(val)} to Register {hex(reg)}")
-        time.sleep(self.cdi_wait_time)
+        self.link.send(port, WRITE_MESSAGE)
+
+    def write_reg(self, reg, val, wait = True):
+        return self.write_regs([(reg, val)], wait = wait)[0]
+
+    #Queues a list of (register, value) writes as a single transaction for the sender thread
+    #Returns one future per write, whose result is whether the CDI latch acknowledged the write
+    def write_regs(self, writes, wait = True):
+        writes = [(int(reg), int(val)) for reg, val in writes]
+        futures = [Future() for _ in writes]
+        send_writes = []
+        send_futures = []
+        for (reg, val), future in zip(writes, futures):
+            if (self.update_shadow(reg, val, write = True)):
+                send_writes.append((reg, val))
+                send_futures.append(future)
+            else:
+                #The board already has this value
+                future.set_result(True)
+        if (send_writes and self.link_error):
+            self.logger.error(f"Can't write {len(send_writes)} registers, the link is down ({self.link_error})")
+            for (reg, val), future in zip(send_writes, send_futures):
+                self.forget_shadow(reg)
+                #Only a cancelled future that's been notified counts as done for wait_writes
+                future.cancel()
+                future.set_running_or_notify_cancel()
+        elif (send_writes):
+            write_dict = {"command": "write_batch",
+                          "writes": send_writes,
+                          "futures": send_futures}
+            self.send_queue.put(write_dict)
+            self.logger.debug(f"Writing {len(send_writes)} registers starting with {hex(send_writes[0][1])} to Register {hex(send_writes[0][0])}")
+        if (wait):
+            self.wait_writes(futures)
+        return futures
+
+    #Blocks until the given write futures are done, instead of sleeping for a fixed time
+    #By default the timeout grows with how many writes there are
+    def wait_writes(self, futures, timeout = None):
+        if (timeout is None):
+            timeout = self.write_timeout + self.write_timeout_per_write * len(futures)
+        done, not_done = wait_futures(futures, timeout)
+        if (not_done):
+            self.logger.warning(f"{len(not_done)} register writes were not done after {timeout} seconds")
+            return False
+        failed = [i for i in done if i.cancelled() or not i.result()]
+        if (failed):
+            self.logger.warning(f"{len(failed)} register writes did not get a CDI latch acknowledgement")
+            return False
+        return True
 
     def read_reg(self, reg):
+        estimator = self.rtt_estimators["reg"]
         tries = 10
         for i in range(tries):
-            read_dict = {"command": "read",
-                        "reg": int(reg)}
-            self.send_queue.put(read_dict)
-            self.logger.debug(f"Reading Register {hex(reg)}")
-            while not self.stop_event.is_set():
-                try:
-                    resp = self.processing.reg_output_queue.get(True, self.read_timeout)
-                except Empty:
-                    self.logger.warning(f"Register queue was empty for the {i} time. Retrying")
-                    break
-                self.processing.reg_output_queue.task_done()
-                if resp is self.processing.stop_signal:
+            sent = threading.Event()
+            future = self.read_reg_async(reg, sent)
+            start = self.wait_sent(sent, future)
+            timeout = estimator.timeout()
+            try:
+                resp = future.result(timeout)
+            except FutureTimeout:
+                #Leaves the read in the pending table for a while, so if the response does show up late it gets dropped
+                lost_after = self.processing.reg.give_up_read(future, timeout)
+                estimator.timed_out()
+                self.logger.warning(f"Register {hex(reg)} had no response for the {i} time. Retrying")
+                self.wait_until(lost_after)
+                continue
+            except CancelledError:
+                if (self.link_error):
+                    self.logger.error(f"Register {hex(reg)} can't be read, the link is down ({self.link_error})")
+                else:
                     self.logger.debug(f"read_reg has been told to stop. Exiting...")
-                    break
-                self.logger.debug(f"Read back {hex(resp['data'])}")
-                if (not self.processing.reg_output_queue.empty()):
-                    self.logger.warning(f"Register queue still has {self.processing.reg_output_queue.qsize()} items")
-                return resp["data"]
+                return None
+            self.logger.debug(f"Read back {hex(resp['data'])}")
+            self.record_rtt("read", resp["rtt"])
+            #Every try is a new read with its own response, so each one can be timed
+            estimator.sample(time.perf_counter() - start)
+            self.update_shadow(reg, resp["data"])
+            return resp["data"]
         self.logger.warning(f"Register tried {tries} times, but could not get a response for the register")
         return None
 
+    #Queues a read without waiting for it. Several can be in flight at once, each response is matched to its request
+    #Returns a future with the response dictionary
+    #sent is an optional threading.Event that's set once the read has gone out
+    def read_reg_async(self, reg, sent = None):
+        future = Future()
+        if (self.link_error):
+            #Nothing would ever answer it
+            future.cancel()
+            return future
+        read_dict = {"command": "read",
+                     "reg": int(reg),
+                     "tag": next(self.read_tags),
+                     "future": future,
+                     "sent": sent}
+        self.send_queue.put(read_dict)
+        self.logger.debug(f"Reading Register {hex(reg)}")
+        return future
+
+    #Waits for the sender thread to send a read, so time spent queued behind other commands doesn't count against its timeout
+    #Returns when it was sent
+    def wait_sent(self, sent, future):
+        while not sent.wait(self.cdi_wait_time):
+            if (future.done() or self.stop_event.is_set()):
+                break
+        return time.perf_counter()
+
+    #Sleeps until a time from time.perf_counter(), or until told to stop
+    def wait_until(self, when):
+        self.stop_event.wait(max(when - time.perf_counter(), 0))
+
+    #Reads a list of registers with all the reads in flight at once, returns a dictionary of register to value
+    #Registers that don't answer in time are retried one at a time with read_reg, and are None if that fails too
+    def read_many(self, regs):
+        regs = [int(i) for i in regs]
+        estimator = self.rtt_estimators["reg"]
+        sent = [threading.Event() for reg in regs]
+        futures = [(reg, self.read_reg_async(reg, event), event) for reg, event in zip(regs, sent)]
+        results = {}
+        lost_after = 0
+        for reg, future, event in futures:
+            #Each read gets the usual timeout from when it went out
+            timeout = estimator.timeout()
+            deadline = self.wait_sent(event, future) + timeout
+            try:
+                results[reg] = future.result(max(deadline - time.perf_counter(), 0))["data"]
+            except FutureTimeout:
+                lost_after = max(lost_after, self.processing.reg.give_up_read(future, timeout))
+                results[reg] = None
+            except CancelledError:
+                if (self.link_error):
+                    self.logger.error(f"Registers can't be read, the link is down ({self.link_error})")
+                else:
+                    self.logger.debug(f"read_many has been told to stop. Exiting...")
+                #Every register is in the result, the ones that weren't read are None
+                return {reg: results.get(reg) for reg in regs}
+        self.wait_until(lost_after)
+        for reg in regs:
+            if (results[reg] is None):
+                self.logger.warning(f"Register {hex(reg)} didn't answer in the batch read. Retrying")
+                results[reg] = self.read_reg(reg)
+            else:
+                self.update_shadow(reg, results[reg])
+        return results
+
+    #Returns the shadowed value of a register if there is one, otherwise reads it from the board
+    def read_reg_cached(self, reg):
+        reg = int(reg)
+        with self.shadow_lock:
+            if (self.shadow_enabled and reg in self.shadow):
+                return self.shadow[reg]
+        return self.read_reg(reg)
+
+    #Records a value the board holds. For writes, returns whether the write actually needs to be sent
+    def update_shadow(self, reg, val, write = False):
+        if (not self.shadow_enabled or reg in self.volatile_registers):
+            return True
+        with self.shadow_lock:
+            if (write and self.shadow.get(reg) == val):
+                self.shadow_writes_skipped += 1
+                return False
+            self.shadow[reg] = val
+        return True
+
+    def forget_shadow(self, reg):
+        with self.shadow_lock:
+            self.shadow.pop(reg, None)
+
+    #Needs to be called whenever the board registers go back to their defaults
+    def invalidate_shadow(self):
+        with self.shadow_lock:
+            self.shadow.clear()
+
+    #Reads every register from start to end, including end
+    def read_range(self, start, end):
+        return self.read_many(range(int(start), int(end) + 1))
+
     def send_bootloader_message(self, message):
+        self.cdi_latches.clear()
         self.write_cdi_reg(self.write_register, message, self.PORT_WREG)
         self.toggle_cdi_latch()
 
@@ -292,10 +657,12 @@ class LuSEE_ETHERNET:
 
     def reset(self):
         print("Python Ethernet --> Resetting, wait a few seconds")
+        self.invalidate_shadow()
         self.write_reg(self.spectrometer_reset,1)
         time.sleep(3)
         self.write_reg(self.spectrometer_reset,0)
         time.sleep(2)
+        self.cdi_latches.clear()
         self.write_cdi_reg(self.cdi_reset, 1, self.PORT_WREG)
         time.sleep(2)
         self.write_cdi_reg(self.cdi_reset, 0, self.PORT_WREG)
@@ -356,6 +723,24 @@ class LuSEE_ETHERNET:
                         self.processing.pfb_output_queue.get()
             return resp
 
+    #Throws away the PFB products waiting in the queue, returns how many there were
+    def clear_pfb_data(self):
+        cleared = 0
+        while True:
+            try:
+                resp = self.processing.pfb_output_queue.get_nowait()
+            except Empty:
+                break
+            self.processing.pfb_output_queue.task_done()
+            if resp is self.processing.stop_signal:
+                #Whoever waits next still has to see it
+                self.processing.pfb_output_queue.put(resp)
+                break
+            cleared += 1
+        if (cleared):
+            self.logger.warning(f"Cleared {cleared} PFB products from the queue")
+        return cleared
+
     def get_calib_data(self, timeout = 10, clear = False):
         self.logger.debug(f"Waiting for Calibration data")
         while not self.stop_event.is_set():
@@ -424,30 +809,14 @@ class LuSEE_ETHERNET:
         else:
             return formatted_data
 
-<<<<<<< HEAD
-    #Unpack the header files into a dictionary, this is common for all CDI responses
+    #Unpack the header into a LuSEE_HEADER record, this is common for all CDI responses
     def organize_header(self, formatted_data):
-        header_dict = {}
-
-        header_dict["udp_packet_num"] = hex((formatted_data[0] << 16) + formatted_data[1])
-        header_dict["header_user_info"] = hex((formatted_data[2] << 48) + (formatted_data[3] << 32) + (formatted_data[4] << 16) + formatted_data[5])
-        header_dict["system_status"] = hex((formatted_data[6] << 16) + formatted_data[7])
-        header_dict["message_id"] = hex(formatted_data[8] >> 10)
-        header_dict["message_length"] = hex(formatted_data[8] & 0x3FF)
-        header_dict["message_spare"] = hex(formatted_data[9])
-        header_dict["ccsds_version"] = hex(formatted_data[10] >> 13)
-        header_dict["ccsds_packet_type"] = hex((formatted_data[10] >> 12) & 0x1)
-        header_dict["ccsds_secheaderflag"] = hex((formatted_data[10] >> 11) & 0x1)
-        header_dict["ccsds_appid"] = hex(formatted_data[10] & 0x7FF)
-        header_dict["ccsds_groupflags"] = hex(formatted_data[11] >> 14)
-        header_dict["ccsds_sequence_cnt"] = hex(formatted_data[11] & 0x3FFF)
-        header_dict["ccsds_packetlen"] = hex(formatted_data[12])
-        return header_dict
+        return LuSEE_HEADER(formatted_data)
 
     def check_data_adc(self, data):
         udp_packet_count = 0
         cdi_packet_count = 0
-        data_packet = []
+        data_packet = bytearray()
         header_dict = {}
         #Packet format defined by Jack Fried in VHDL for custom CDI interface
         #Headers come in as 16 bit words. ADC and counter payload comes in as 16 bit words
@@ -457,14 +826,13 @@ class LuSEE_ETHERNET:
         carry_val = 0;
         for num,i in enumerate(data):
             header_dict[num] = {}
-            unpack_buffer = int((len(i))/2)
-            #Unpacking into shorts in increments of 2 bytes
-            formatted_data = struct.unpack_from(f">{unpack_buffer}H",i)
+            #Unpacking the header into shorts in increments of 2 bytes
+            formatted_data = struct.unpack_from(">13H",i)
             header_dict[num] = self.organize_header(formatted_data)
-            #ADC data is simple, it's the 16 bit shorts that were already unpacked
-            data_packet.extend(formatted_data[13:])
+            #ADC data is simple, it's 16 bit shorts
+            data_packet.extend(i[26:])
 
-        return data_packet, header_dict
+        return self.processing.decoder.output(self.processing.decoder.adc(data_packet)), header_dict
 
     def check_data_pfb(self, data):
         udp_packet_count = 0
@@ -480,18 +848,14 @@ class LuSEE_ETHERNET:
         for num,i in enumerate(data):
             header_dict[num] = {}
             #print(f"Length is {len(i)}")
-            unpack_buffer = int((len(i))/2)
             #Unpacking into shorts in increments of 2 bytes just for the header
-            formatted_data = struct.unpack_from(f">{unpack_buffer}H",i)
+            formatted_data = struct.unpack_from(">13H",i)
             header_dict[num] = self.organize_header(formatted_data)
             #Payload starts at nibble 26
             raw_data.extend(i[26:])
 
         #After the payload part of all the incoming packets has been concatenated, we know it's exactly 2048 bins and can unpack it appropriately
-        formatted_data2 = struct.unpack_from(">2048I",raw_data)
-        #But each 2 byte section of the 4 byte value is reversed
-        formatted_data3 = [(j >> 16) + ((j & 0xFFFF) << 16) for j in formatted_data2]
-        return formatted_data3, header_dict
+        return self.processing.decoder.output(self.processing.decoder.words(raw_data, 2048)), header_dict
 
     def check_data_cal(self, data, data_len):
         udp_packet_count = 0
@@ -507,21 +871,18 @@ class LuSEE_ETHERNET:
         for num,i in enumerate(data):
             header_dict[num] = {}
             #print(f"Length is {len(i)}")
-            unpack_buffer = int((len(i))/2)
             #Unpacking into shorts in increments of 2 bytes just for the header
-            formatted_data = struct.unpack_from(f">{unpack_buffer}H",i)
+            formatted_data = struct.unpack_from(">13H",i)
             header_dict[num] = self.organize_header(formatted_data)
             #Payload starts at nibble 26
             raw_data.extend(i[26:])
 
         #After the payload part of all the incoming packets has been concatenated, we know it's exactly 2048 bins and can unpack it appropriately
-        formatted_data2 = struct.unpack_from(f">{data_len}I",raw_data)
-        #But each 2 byte section of the 4 byte value is reversed
-        formatted_data3 = [(j >> 16) + ((j & 0xFFFF) << 16) for j in formatted_data2]
-        return formatted_data3, header_dict
+        return self.processing.decoder.output(self.processing.decoder.words(raw_data, data_len)), header_dict
 
     #Writes a bootloader command without waiting for a result
     def send_bootloader_message(self, message):
+        self.cdi_latches.clear()
         self.write_cdi_reg(self.write_register, message)
         self.toggle_cdi_latch()
 
@@ -586,18 +947,11 @@ class LuSEE_ETHERNET:
         bootloader_dict = {}
         num = 0
         for i in data:
-            unpack_buffer = int((len(i))/2)
-            #Unpacking into shorts in increments of 2 bytes
-            formatted_data = struct.unpack_from(f">{unpack_buffer}H",i)
-            header_dict[num] = self.organize_header(formatted_data)
+            #Unpacking the header into shorts in increments of 2 bytes
+            formatted_data = struct.unpack_from(">13H",i)
+            header_dict[num] = self.organize_header(formatted_data).to_dict()
             #The header is 13 bytes (26 hex byte characters) and the payload starts after as 32 bit ints
-            pkt = bytearray()
-            pkt.extend(i[26:])
-
-            data_size = int(len(pkt)/4)
-            formatted_data2 = struct.unpack_from(f">{data_size}I",pkt)
-            #But the payload is reversed 2 bytes by 2 bytes
-            formatted_data3 = [(j >> 16) + ((j & 0xFFFF) << 16) for j in formatted_data2]
+            formatted_data3 = self.processing.decoder.words(i[26:]).tolist()
             #fm3 = [hex(i) for i in formatted_data3]
             #print(fm3)
             #With the formatted payload, get all relevant info
@@ -609,20 +963,15 @@ class LuSEE_ETHERNET:
     #The bootloader response has the standard CDI header, so that's formatted
     #And the payload is sent for further processing
     def check_data_bootloader(self, data):
-        data_packet = bytearray()
         header_dict = {}
 
-        unpack_buffer = int((len(data))/2)
-        #Unpacking into shorts in increments of 2 bytes
-        formatted_data = struct.unpack_from(f">{unpack_buffer}H",data)
-        header_dict = self.organize_header(formatted_data)
+        #Unpacking the header into shorts in increments of 2 bytes
+        formatted_data = struct.unpack_from(">13H",data)
+        header_dict = self.organize_header(formatted_data).to_dict()
 
         #The header is 13 bytes (26 hex byte characters) and the payload starts after as 32 bit ints
-        data_packet.extend(data[26:])
-        data_size = int(len(data_packet)/4)
-        formatted_data2 = struct.unpack_from(f">{data_size}I",data_packet)
-        #But for every 4 byte value in the payload, the first and last 2 bytes are reversed
-        formatted_data3 = [(j >> 16) + ((j & 0xFFFF) << 16) for j in formatted_data2]
+        #Bootloader fields get combined into values wider than 32 bits, so they're unpacked as Python ints
+        formatted_data3 = self.processing.decoder.words(data[26:]).tolist()
 
         #With the formatted payload, get all relevant header info
         if (formatted_data3):
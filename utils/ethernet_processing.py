@@ -5,53 +5,69 @@ import logging
 import logging.config
 import time
 
+from utils import LuSEE_DECODER
+from utils import LuSEE_BUFFER_POOL
+from utils import LuSEE_RING_QUEUE
+from utils import LuSEE_HEADER
 from utils import LuSEE_PROCESS_DATA
 from utils import LuSEE_PROCESS_HK
 from utils import LuSEE_PROCESS_REG
 
+#Every LuSEE_ETHERNET connection has its own processing, with its own queues and threads
 class LuSEE_PROCESSING:
-    _instance = None
+    def __init__(self):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.debug("Class created")
+        self.stop_event = threading.Event()
+        self.stop_signal = object()
 
-    def __new__(cls, *args, **kwargs):
-        if cls._instance is None:
-            cls._instance = super().__new__(cls, *args, **kwargs)
-        return cls._instance
+        #Shared by the processing threads to turn packet payloads into arrays
+        self.decoder = LuSEE_DECODER()
+        #Receive buffers, filled by the listeners and given back by the processing threads once a packet is used
+        self.buffer_pool = LuSEE_BUFFER_POOL()
 
-    def __init__(self):
-        if not hasattr(self, '_initialized'):
-            self._initialized = True
-            self.logger = logging.getLogger(self.__class__.__name__)
-            self.logger.debug("Class created")
-            self.stop_event = threading.Event()
-            self.stop_signal = object()
+        #Every queue is bounded so a slow or absent reader can't make memory grow forever
+        #Each entry is the most items it holds and what to do when it's full, see LuSEE_RING_QUEUE
+        #The input queues hold receive buffers, so those go back to the pool when they're dropped
+        self.queue_settings = {"reg_input_queue": (1024, "drop_oldest"),
+                               "data_input_queue": (8192, "drop_oldest"),
+                               "hk_input_queue": (1024, "drop_oldest"),
+                               "dcb_emulator_queue": (1024, "drop_oldest"),
+                               "reg_output_queue": (1024, "drop_oldest"),
+                               "count_output_queue": (16, "drop_oldest"),
+                               "adc_output_queue": (16, "drop_oldest"),
+                               "pfb_output_queue": (64, "drop_oldest"),
+                               "hk_output_queue": (256, "drop_oldest"),
+                               "calib_output_queue": (256, "drop_oldest")}
+        for name, (maxsize, policy) in self.queue_settings.items():
+            on_drop = self.buffer_pool.release if name.endswith("input_queue") else None
+            setattr(self, name, LuSEE_RING_QUEUE(maxsize, policy, stop_signal = self.stop_signal, on_drop = on_drop))
 
-            self.reg_input_queue = queue.Queue()
-            self.data_input_queue = queue.Queue()
-            self.hk_input_queue = queue.Queue()
+        self.reg = LuSEE_PROCESS_REG(self)
+        self.data = LuSEE_PROCESS_DATA(self)
+        self.hk = LuSEE_PROCESS_HK(self)
 
-            self.dcb_emulator_queue = queue.Queue()
-            self.reg_output_queue = queue.Queue()
-            self.count_output_queue = queue.Queue()
-            self.adc_output_queue = queue.Queue()
-            self.pfb_output_queue = queue.Queue()
-            self.hk_output_queue = queue.Queue()
-            self.calib_output_queue = queue.Queue()
+        process_thread_settings = [(self.reg.process_reg, "Register Response Processing Thread"),
+                                   (self.data.process_data, "Data Processing Thread"),
+                                   (self.hk.process_hk, "Housekeeping Processing Thread")]
+        self.process_threads = []
+        for process_settings in process_thread_settings:
+            thread = threading.Thread(target=process_settings[0],
+                        name=process_settings[1],
+                        daemon = True
+                        )
+            thread.start()
+            self.process_threads.append(thread)
 
-            self.reg = LuSEE_PROCESS_REG(self)
-            self.data = LuSEE_PROCESS_DATA(self)
-            self.hk = LuSEE_PROCESS_HK(self)
+    #Changes how big a queue can get and what happens when it's full, like set_queue_policy("pfb_output_queue", 16, "drop_newest")
+    def set_queue_policy(self, name, maxsize, policy):
+        q = getattr(self, name)
+        with q.mutex:
+            q.maxsize = maxsize
+        q.set_policy(policy)
 
-            process_thread_settings = [(self.reg.process_reg, "Register Response Processing Thread"),
-                                       (self.data.process_data, "Data Processing Thread"),
-                                       (self.hk.process_hk, "Housekeeping Processing Thread")]
-            self.process_threads = []
-            for process_settings in process_thread_settings:
-                thread = threading.Thread(target=process_settings[0],
-                            name=process_settings[1],
-                            daemon = True
-                            )
-                thread.start()
-                self.process_threads.append(thread)
+    def get_queue_stats(self):
+        return {name: getattr(self, name).get_stats() for name in self.queue_settings}
 
     def stop(self):
         self.logger.debug("Stopping all threads")
@@ -65,20 +81,6 @@ class LuSEE_PROCESSING:
             i.join()
             self.logger.debug(f"Class sees that {i.name} is done")
 
-    #Unpack the header files into a dictionary, this is common for all CDI responses
+    #Unpack the header into a LuSEE_HEADER record, this is common for all CDI responses
     def organize_header(self, formatted_data):
-        header_dict = {}
-        header_dict["udp_packet_num"] = hex((formatted_data[0] << 16) + formatted_data[1])
-        header_dict["header_user_info"] = hex((formatted_data[2] << 48) + (formatted_data[3] << 32) + (formatted_data[4] << 16) + formatted_data[5])
-        header_dict["system_status"] = hex((formatted_data[6] << 16) + formatted_data[7])
-        header_dict["message_id"] = hex(formatted_data[8] >> 10)
-        header_dict["message_length"] = hex(formatted_data[8] & 0x3FF)
-        header_dict["message_spare"] = hex(formatted_data[9])
-        header_dict["ccsds_version"] = hex(formatted_data[10] >> 13)
-        header_dict["ccsds_packet_type"] = hex((formatted_data[10] >> 12) & 0x1)
-        header_dict["ccsds_secheaderflag"] = hex((formatted_data[10] >> 11) & 0x1)
-        header_dict["ccsds_appid"] = hex(formatted_data[10] & 0x7FF)
-        header_dict["ccsds_groupflags"] = hex(formatted_data[11] >> 14)
-        header_dict["ccsds_sequence_cnt"] = hex(formatted_data[11] & 0x3FFF)
-        header_dict["ccsds_packetlen"] = hex(formatted_data[12])
-        return header_dict
+        return LuSEE_HEADER(formatted_data)
@@ -0,0 +1,149 @@
+import struct
+import socket
+import threading
+import contextlib
+import logging
+import logging.config
+
+#A link to the DCB over one persistent TCP connection, for when it's somewhere else on the network
+#Every channel is multiplexed over it. Each datagram becomes a frame of its length (32 bits), its UDP port (16 bits) and then the datagram itself
+#The far end (see lusee_tcp_bridge.py) turns frames back into datagrams to and from the DCB emulator
+#Same calls as LuSEE_LINK_UDP
+class LuSEE_LINK_TCP:
+    #TCP keeps every word in order up to the bridge. The bridge still sends them on to the DCB emulator as UDP datagrams,
+    #so that alone doesn't make it safe to send CDI words without confirming each one
+    ordered = True
+
+    frame_struct = struct.Struct(">IH")
+
+    def __init__(self, host, port, buffer_pool, connect_timeout = 5):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.debug("Class created")
+        self.host = host
+        self.port = port
+        self.buffer_pool = buffer_pool
+        self.connect_timeout = connect_timeout
+        self.recv_size = 65536
+        self.send_lock = threading.Lock()
+        #Writes made inside coalesce() are held per thread and go out together
+        self.local = threading.local()
+        self.stop_event = threading.Event()
+        self.stats = {"wakeups": 0, "datagrams": 0, "max_batch": 0, "frames_sent": 0, "sends": 0, "errors": 0}
+        self.thread = None
+
+    def start(self, deliver, lost = None):
+        self.deliver = deliver
+        self.lost = lost
+        self.sock = socket.create_connection((self.host, self.port), self.connect_timeout)
+        self.sock.settimeout(None)
+        #Register words are tiny, so don't let Nagle hold them back waiting for more
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self.logger.info(f"Connected to {self.host}:{self.port}")
+        self.thread = threading.Thread(target=self.receiver,
+                        name="Receive Thread",
+                        daemon = True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        try:
+            #Wakes up the receive thread with an end of stream
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        if (self.thread):
+            self.logger.debug(f"Waiting for {self.thread.name} to join")
+            self.thread.join()
+        self.sock.close()
+
+    def frame(self, port, data):
+        return self.frame_struct.pack(len(data), port) + bytes(data)
+
+    def send(self, port, data):
+        pending = getattr(self.local, "pending", None)
+        if (pending is not None):
+            pending.append(self.frame(port, data))
+            return
+        self.send_frames([self.frame(port, data)])
+
+    #Once the connection is gone nothing can be sent, the receive thread reports why
+    def send_frames(self, frames):
+        with self.send_lock:
+            try:
+                self.sock.sendall(b"".join(frames))
+            except OSError as e:
+                self.stats["errors"] += 1
+                self.logger.error(f"Couldn't send {len(frames)} frames to {self.host}:{self.port}: {e}")
+                return
+            self.stats["frames_sent"] += len(frames)
+            self.stats["sends"] += 1
+
+    #Everything sent inside this goes out in one write when the outermost block ends, like
+    #    with link.coalesce():
+    #        for word in words:
+    #            link.send(port, word)
+    @contextlib.contextmanager
+    def coalesce(self):
+        outer = getattr(self.local, "pending", None) is None
+        if (outer):
+            self.local.pending = []
+        try:
+            yield
+        finally:
+            if (outer):
+                frames = self.local.pending
+                self.local.pending = None
+                if (frames):
+                    self.send_frames(frames)
+
+    def report_lost(self, reason):
+        if (self.lost and not self.stop_event.is_set()):
+            self.lost(reason)
+
+    def receiver(self):
+        name = threading.current_thread().name
+        self.logger.debug(f"{name} started, reading frames from {self.host}:{self.port}")
+        pool = self.buffer_pool
+        stream = bytearray()
+        header_size = self.frame_struct.size
+        try:
+            while not self.stop_event.is_set():
+                chunk = self.sock.recv(self.recv_size)
+                if not chunk:
+                    if not self.stop_event.is_set():
+                        self.logger.error(f"Connection to {self.host}:{self.port} was closed by the other end")
+                        self.report_lost("the connection was closed by the other end")
+                    return
+                self.stats["wakeups"] += 1
+                stream += chunk
+                offset = 0
+                batch = 0
+                while len(stream) - offset >= header_size:
+                    length, port = self.frame_struct.unpack_from(stream, offset)
+                    start = offset + header_size
+                    if (len(stream) - start < length):
+                        break
+                    offset = start + length
+                    buf = pool.acquire()
+                    if (length > len(buf)):
+                        pool.release(buf)
+                        self.logger.warning(f"Dropping a {length} byte frame for port {port}, it's bigger than a receive buffer")
+                        continue
+                    buf[:length] = stream[start:offset]
+                    try:
+                        self.deliver(port, memoryview(buf)[:length])
+                    except Exception as e:
+                        #One bad frame mustn't stop everything after it from being received
+                        self.stats["errors"] += 1
+                        self.logger.error(f"{name} couldn't handle a {length} byte frame for port {port}: {e}")
+                    batch += 1
+                del stream[:offset]
+                self.stats["datagrams"] += batch
+                self.stats["max_batch"] = max(self.stats["max_batch"], batch)
+        except Exception as e:
+            if not self.stop_event.is_set():
+                self.logger.error(f"Exception in {name}, nothing more will be received: {e}")
+                self.report_lost(e)
+        finally:
+            self.logger.debug(f"{name} exited")
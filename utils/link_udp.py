@@ -0,0 +1,129 @@
+import socket
+import selectors
+import threading
+import contextlib
+import logging
+import logging.config
+
+#The link LuSEE_ETHERNET uses to talk straight to the DCB emulator, one UDP port per channel
+#Every link has the same calls: start(deliver, lost), send(port, data), coalesce() and stop()
+#deliver(port, view) is called from the link's receive thread with a memoryview of a buffer pool slot, and whoever gets it gives the slot back
+#lost(reason) is called from the receive thread if it can't receive anything more before stop()
+class LuSEE_LINK_UDP:
+    #UDP datagrams to different ports can be handled out of order, so every CDI word is confirmed before the next goes out
+    ordered = False
+
+    def __init__(self, remote_ip, local_ip, listen_ports, buffer_pool, rcvbuf_size = None):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.debug("Class created")
+        self.remote_ip = remote_ip
+        self.local_ip = local_ip
+        self.listen_ports = listen_ports
+        self.buffer_pool = buffer_pool
+        self.buffer_size = buffer_pool.slot_size
+        #Kernel receive buffer for each listening socket, so bursts like a calibrator dump aren't dropped by the OS
+        #The OS may cap it (net.core.rmem_max on Linux). None leaves the OS default
+        self.rcvbuf_size = rcvbuf_size
+        self.stop_event = threading.Event()
+        self.stats = {"wakeups": 0, "datagrams": 0, "max_batch": 0, "errors": 0}
+        self.thread = None
+
+    def start(self, deliver, lost = None):
+        self.deliver = deliver
+        self.lost = lost
+        self.dummy_socket, self.dummy_socket_wakeup = socket.socketpair()
+        #One thread receives on all the listening ports
+        self.selector = selectors.DefaultSelector()
+        for port in self.listen_ports:
+            self.selector.register(self.open_listen_socket(port), selectors.EVENT_READ, port)
+        self.selector.register(self.dummy_socket, selectors.EVENT_READ, None)
+        #Set up socket for IPv4 and UDP
+        self.sock_write = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.thread = threading.Thread(target=self.receiver,
+                        name="Receive Thread",
+                        daemon = True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        try:
+            self.dummy_socket_wakeup.send(b'\x00')
+        except OSError:
+            pass
+        if (self.thread):
+            self.logger.debug(f"Waiting for {self.thread.name} to join")
+            self.thread.join()
+        self.sock_write.close()
+
+    def open_listen_socket(self, port):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if (self.rcvbuf_size):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf_size)
+            self.logger.debug(f"Receive buffer for port {port} is {sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)} bytes")
+        sock.bind((self.local_ip, port))
+        sock.setblocking(False)
+        return sock
+
+    def send(self, port, data):
+        self.sock_write.sendto(data, (self.remote_ip, port))
+
+    #Each datagram goes out on its own anyway
+    @contextlib.contextmanager
+    def coalesce(self):
+        yield
+
+    def report_lost(self, reason):
+        if (self.lost and not self.stop_event.is_set()):
+            self.lost(reason)
+
+    def receiver(self):
+        name = threading.current_thread().name
+        self.logger.debug(f"{name} started, will listen at {self.local_ip} on ports {self.listen_ports}")
+        pool = self.buffer_pool
+        try:
+            while not self.stop_event.is_set():
+                #This blocks at an OS level until any of the sockets has data
+                #The dummy socket is there to wake it up when it's time to exit
+                events = self.selector.select()
+                self.stats["wakeups"] += 1
+                batch = 0
+                for key, _ in events:
+                    if key.fileobj is self.dummy_socket:
+                        self.logger.debug(f"{name} has been told to stop. Exiting...")
+                        return
+                    sock = key.fileobj
+                    port = key.data
+                    #Take everything that's waiting on this socket before going back to sleep
+                    while True:
+                        buf = pool.acquire()
+                        try:
+                            nbytes, addr = sock.recvfrom_into(buf, self.buffer_size)
+                        except BlockingIOError:
+                            pool.release(buf)
+                            break
+                        except OSError as e:
+                            pool.release(buf)
+                            self.logger.error(f"OSError in {name}, nothing more will be received: {e}")
+                            self.report_lost(e)
+                            return
+                        try:
+                            self.deliver(port, memoryview(buf)[:nbytes])
+                        except Exception as e:
+                            #One bad datagram mustn't stop everything after it from being received
+                            self.stats["errors"] += 1
+                            self.logger.error(f"{name} couldn't handle a {nbytes} byte datagram on port {port}: {e}")
+                        batch += 1
+                self.stats["datagrams"] += batch
+                self.stats["max_batch"] = max(self.stats["max_batch"], batch)
+        except Exception as e:
+            self.logger.error(f"Exception in {name}, nothing more will be received: {e}")
+            self.report_lost(e)
+        finally:
+            self.logger.debug(f"{name} finally")
+            for key in list(self.selector.get_map().values()):
+                self.selector.unregister(key.fileobj)
+                key.fileobj.close()
+            self.selector.close()
+            if self.dummy_socket_wakeup:
+                self.dummy_socket_wakeup.close()
+            self.logger.debug(f"{name} exited")
@@ -1,15 +1,19 @@
 import time
+import threading
 import logging
 import logging.config
+from queue import Empty
+import numpy as np
 from datetime import datetime
 from utils import LuSEE_ETHERNET
 import copy
 class LuSEE_COMMS:
-    def __init__(self):
+    #Give it a LuSEE_ETHERNET connection to talk to a particular board, otherwise it uses the default one (see LuSEE_ETHERNET.__new__)
+    def __init__(self, connection = None):
         self.logger = logging.getLogger(self.__class__.__name__)
         self.version = 1.13
 
-        self.connection = LuSEE_ETHERNET()
+        self.connection = connection or LuSEE_ETHERNET()
 
         self.pcb_fix = 0x002
         self.dcb_ts_1 = 0x020
@@ -118,6 +122,9 @@ class LuSEE_COMMS:
         self.debug_fifo_used = 0x852
         self.weight_base = 0x850
 
+        #APIDs the FPGA path sends each FFT readout with
+        self.fpga_fft_apids = {1: 0x2E0, 2: 0x2E1, 3: 0x2E2, 4: 0x2E3}
+
         self.readout_modes = {
             "FFT1": 0,
             "ADC1": 1,
@@ -135,11 +142,15 @@ class LuSEE_COMMS:
         self.tries = 5
         self.bytes_per_packet = 0x7F8
         self.cycle_time = 40e-6
+        #Products are never waited on for less than this, even when they've been coming back faster
+        self.product_min_timeout = 0.05
         self.avg = 0
         self.notch_avg = 0
         self.Nac1_val = 0
         self.Nac2_val = 0
         self.wait_time = 0.025
+        #Set by stop_pfb_stream() to end stream_pfb_data_sw()
+        self.stream_stop = threading.Event()
 
     def stop(self):
         self.connection.stop()
@@ -164,6 +175,7 @@ class LuSEE_COMMS:
 
     def reset_spectrometer(self):
         self.connection.write_reg(self.sengine_reset, 1)
+        self.connection.invalidate_shadow()
 
     def set_pcb(self, board):
         self.connection.write_reg(self.pcb_fix, board)
@@ -419,9 +431,38 @@ class LuSEE_COMMS:
             resp = self.compute_index_send(in_position, inverse_mask, reg)
             return resp
 
+    #Sets all 16 main and notch correlator indexes at once, computed here instead of a read-modify-write per channel
+    def set_index_arrays(self, main, notch):
+        if (len(main) != 16 or len(notch) != 16):
+            print(f"Python LuSEE Comm --> You need to supply 16 main and 16 notch indexes, you supplied {len(main)} and {len(notch)}")
+            return
+        main_words = self.pack_index_array(main)
+        notch_words = self.pack_index_array(notch)
+        self.connection.write_regs([(self.corr_array1, main_words[0]),
+                                    (self.corr_array2, main_words[1]),
+                                    (self.corr_array3, main_words[2]),
+                                    (self.notch_array1, notch_words[0]),
+                                    (self.notch_array2, notch_words[1]),
+                                    (self.notch_array3, notch_words[2])])
+        return main_words, notch_words
+
+    #The 6 bit indexes sit back to back across the three 32 bit array registers, channel 0 in the lowest bits of the first one
+    #That's why channels 5 and 10 straddle two registers in set_index_array
+    def pack_index_array(self, indexes):
+        packed = 0
+        for num, val in enumerate(indexes):
+            packed |= (int(val) & 0x3F) << (6 * num)
+        return [(packed >> (32 * i)) & 0xFFFFFFFF for i in range(3)]
+
+    #Turns the three array register values back into the 16 channel indexes
+    def unpack_index_array(self, words):
+        packed = (int(words[0]) & 0xFFFFFFFF) + ((int(words[1]) & 0xFFFFFFFF) << 32) + ((int(words[2]) & 0xFFFFFFFF) << 64)
+        return [(packed >> (6 * num)) & 0x3F for num in range(16)]
+
     def compute_index_send(self, in_position, inverse_mask, register):
         #Get the current value of the register from the FPGA for comparisons
-        current_val = self.connection.read_reg(register)
+        #With the shadow register file enabled, this is the value last written without a round trip
+        current_val = self.connection.read_reg_cached(register)
         #print(f"current_val is {hex(current_val)}")
 
         #Turn the mask of 1s in the spot where the data will be applied into the inverse
@@ -455,14 +496,26 @@ class LuSEE_COMMS:
         self.connection.write_reg(register, add_value)
         return add_value
 
+    #The timeout for a product adapts to how long it's been taking at this setting, starting from the worst case of expected * 1.5
+    #It never goes below expected * 1.2, the time the spectrometer needs to average
+    def product_estimator(self, name, expected):
+        return self.connection.get_rtt_estimator(name,
+                                                 initial = max(expected * 1.5, 1.0),
+                                                 minimum = max(expected * 1.2, self.product_min_timeout),
+                                                 maximum = max(expected * 6, 10.0))
+
     def get_adc_data(self):
+        estimator = self.product_estimator("adc", 0)
         tries = 10
         for i in range(tries):
             self.connection.request_fw_packet()
-            resp = self.connection.get_adc_data()
+            start = time.perf_counter()
+            resp = self.connection.get_adc_data(timeout = estimator.timeout())
             if (resp):
+                estimator.sample(time.perf_counter() - start)
                 return resp
             else:
+                estimator.timed_out()
                 self.logger.warning(f"ADC failed for the {i} time. Retrying")
         self.logger.warning(f"ADC data collection could not get data after {tries} tries")
         return None
@@ -472,17 +525,184 @@ class LuSEE_COMMS:
         return self.connection.get_count_data()
 
     def get_pfb_data(self):
+        estimator = self.product_estimator(f"pfb_avg{self.avg}", self.cycle_time * (2**self.avg))
         self.connection.request_fw_packet()
-        wait_time = self.cycle_time * (2**self.avg) * 1.5
+        wait_time = estimator.timeout()
         if (wait_time > 1.0):
             self.logger.info(f"Waiting up to {wait_time} seconds for PFB data because average setting is {self.avg} for {2**self.avg} averages")
-        else:
-            wait_time = 1
-        return self.connection.get_pfb_data(timeout = wait_time, clear = True)
+        start = time.perf_counter()
+        try:
+            resp = self.connection.get_pfb_data(timeout = wait_time, clear = True)
+        except Empty:
+            estimator.timed_out()
+            raise
+        if (resp):
+            estimator.sample(time.perf_counter() - start)
+        return resp
+
+    #Reads the FPGA spectra of ffts from frames snapshots, like set_function() and get_pfb_data() for each but without the waits in between
+    #Every snapshot loads the FFT FIFOs and then reads out each FFT in turn. Each readout's register writes go out as one batch
+    #as soon as the last product has come in, and the products are copied into one preallocated array
+    #Returns a (frames, len(ffts), 2048) uint32 array, the headers and a (frames, len(ffts)) bool array of which readouts came in
+    #headers[k][j] is for FFT ffts[j] of snapshot k. Readouts that never came are left as zeros with a None header, check valid before using them
+    def get_pfb_burst(self, frames, ffts = (1, 2, 3, 4)):
+        modes = [self.readout_modes[f"FFT{i}"] for i in ffts]
+        spectra = np.zeros((frames, len(modes), 2048), dtype = np.uint32)
+        headers = [[None] * len(modes) for k in range(frames)]
+        valid = np.zeros((frames, len(modes)), dtype = bool)
+        #Loading the FIFOs waits for the spectrometer to finish averaging, after that each FFT is only its readout time
+        load_estimator = self.product_estimator(f"pfb_burst_avg{self.avg}", self.cycle_time * (2**self.avg))
+        read_estimator = self.product_estimator("pfb_burst", 0)
+        old_val = self.connection.read_reg(self.load_data)
+        if (old_val is None):
+            self.logger.error(f"Could not read Register {hex(self.load_data)}, no burst was taken")
+            return spectra, headers, valid
+        load = [(self.load_data, old_val | 0x4), (self.load_data, old_val)]
+        request = [(self.load_data, old_val | 0x1), (self.load_data, old_val)]
+        self.connection.clear_pfb_data()
+        acks = []
+        for k in range(frames):
+            for j, mode in enumerate(modes):
+                #Any of these could be the one that was lost, so a retry sends them all again
+                writes = (load if j == 0 else []) + [(self.data_src_sel, mode)] + request
+                estimator = load_estimator if j == 0 else read_estimator
+                apid = self.fpga_fft_apids[ffts[j]]
+                for i in range(self.tries):
+                    acks.extend(self.connection.write_regs(writes, wait = False))
+                    start = time.perf_counter()
+                    try:
+                        resp = self.get_fpga_fft(apid, start + estimator.timeout())
+                    except Empty:
+                        estimator.timed_out()
+                        self.logger.warning(f"FFT{ffts[j]} of snapshot {k} didn't come for the {i} time. Retrying")
+                        continue
+                    if (resp is None):
+                        #The connection was stopped
+                        self.connection.wait_writes(acks)
+                        return spectra, headers, valid
+                    if (i == 0):
+                        #Only a readout that was asked for once can be timed
+                        estimator.sample(time.perf_counter() - start)
+                    else:
+                        #The request that timed out may still answer, and with the same APID it would be taken for the next snapshot's
+                        self.drain_pfb_data(read_estimator.timeout())
+                    spectra[k, j] = resp["data"]
+                    headers[k][j] = resp["header"]
+                    valid[k, j] = True
+                    break
+                else:
+                    self.logger.error(f"FFT{ffts[j]} of snapshot {k} didn't come after {self.tries} tries")
+        self.connection.wait_writes(acks)
+        return spectra, headers, valid
+
+    #Waits until deadline for the FPGA spectrum with this APID, dropping anything else that comes first, like a late answer to an earlier request
+    #Raises Empty if it doesn't come, and returns None if the connection was stopped
+    def get_fpga_fft(self, apid, deadline):
+        while True:
+            resp = self.connection.get_pfb_data(timeout = max(deadline - time.perf_counter(), 0))
+            if (resp is None):
+                return None
+            got = getattr(resp["header"][0], "ccsds_appid", None) if resp["header"] else None
+            if (got == apid):
+                return resp
+            got = hex(got) if got is not None else "none"
+            self.logger.warning(f"Expected FPGA FFT APID {hex(apid)} and received APID {got}, dropping it")
+
+    #Throws away the PFB products that come in for timeout seconds
+    def drain_pfb_data(self, timeout):
+        deadline = time.perf_counter() + timeout
+        while True:
+            try:
+                resp = self.connection.get_pfb_data(timeout = max(deadline - time.perf_counter(), 0))
+            except Empty:
+                return
+            if (resp is None):
+                return
+            self.logger.warning("Dropping a PFB product that came in after it was asked for again")
 
     def get_pfb_data_sw(self, header_return = False, avg = None, test = False):
         if (avg != None):
             self.avg = avg
+        self.start_uC_readout(test)
+        all_data = []
+        all_header = []
+        #Wait for averaging
+        estimator = self.product_estimator(f"pfb_sw_avg{self.avg}", self.cycle_time * (2**self.avg))
+        self.get_spec_errors()
+        acks = []
+        #Will return all 16 correlations
+        for i in range(16):
+            channel = self.get_pfb_channel_sw(i, estimator, acks)
+            if (channel is None):
+                self.connection.wait_writes(acks)
+                return all_data
+            data, header = channel
+            all_data.append(data)
+            all_header.append(header)
+        self.connection.wait_writes(acks)
+        self.get_spec_errors()
+        if (header_return):
+            return all_data, all_header
+        else:
+            return all_data
+
+    #Keeps the microcontroller sending frames of all 16 correlations and yields each frame as it's finished, like
+    #    for data in comm.stream_pfb_data_sw(frames = 100):
+    #The restart handshake and error dumps are only done once, after that each correlation only needs its acknowledgement
+    #With frames = None it goes on until stop_pfb_stream() is called or the loop is left
+    #If it's stopped partway through a frame, that frame is dropped and the microcontroller is left waiting, like after errors.
+    #The next readout restarts it anyway
+    def stream_pfb_data_sw(self, frames = None, header_return = False, avg = None, test = False):
+        if (avg != None):
+            self.avg = avg
+        self.stream_stop.clear()
+        enable = self.start_uC_readout(test)
+        estimator = self.product_estimator(f"pfb_sw_avg{self.avg}", self.cycle_time * (2**self.avg))
+        self.get_spec_errors()
+        count = 0
+        try:
+            while not self.stream_stop.is_set() and (frames is None or count < frames):
+                all_data = []
+                all_header = []
+                acks = []
+                for i in range(16):
+                    #The output stays on through the last correlation if another frame is wanted, so the microcontroller starts it right away
+                    more = (i == 15) and (frames is None or count + 1 < frames) and not self.stream_stop.is_set()
+                    channel = self.get_pfb_channel_sw(i, estimator, acks, keep_enabled = enable if more else None)
+                    if (channel is None or (self.stream_stop.is_set() and i < 15)):
+                        self.connection.wait_writes(acks)
+                        return
+                    data, header = channel
+                    all_data.append(data)
+                    all_header.append(header)
+                self.connection.wait_writes(acks)
+                count += 1
+                if (header_return):
+                    yield all_data, all_header
+                else:
+                    yield all_data
+        finally:
+            self.connection.write_reg(self.df_enable, 0)
+            self.get_spec_errors()
+            self.logger.info(f"PFB stream stopped after {count} frames")
+
+    #Calls callback with every frame from stream_pfb_data_sw() until it returns False or the stream ends
+    #Returns how many frames it got
+    def stream_pfb_data_sw_callback(self, callback, **kwargs):
+        count = 0
+        for frame in self.stream_pfb_data_sw(**kwargs):
+            count += 1
+            if (callback(frame) is False):
+                break
+        return count
+
+    #Can be called from another thread. The stream ends after the correlation it's waiting on
+    def stop_pfb_stream(self):
+        self.stream_stop.set()
+
+    #Puts the microcontroller in control of readout and restarts its sequence from the first correlation
+    #Returns the df_enable value that turns the spectrometer output on
+    def start_uC_readout(self, test = False):
         #Put Python in control of readout
         #self.connection.write_reg(self.client_control, 1)
 
@@ -498,79 +718,79 @@ class LuSEE_COMMS:
         #Resets the CDI output FIFOs
         self.connection.write_reg(self.fifo_rst, 1)
         self.connection.write_reg(self.fifo_rst, 0)
+        #Correlations left over from a readout that was cut short would be taken for this one's
+        self.connection.clear_pfb_data()
         #Spectrometer outputs will go to microcontroller
         if (test):
             #Enables the test bit as well
-            self.connection.write_reg(self.df_enable, 3)
+            enable = 3
         else:
-            self.connection.write_reg(self.df_enable, 1)
-        all_data = []
-        all_header = []
-        #Wait for averaging
-        wait_time = self.cycle_time * (2**self.avg)
-        self.get_spec_errors()
-        #Will return all 16 correlations
-        for i in range(16):
-            received = False
-            errors = 0
-            while (not received):
-                apid = 0x210 + i
-                wait_i = 0
-                wait_time = self.cycle_time * (2**self.avg) * 1.2
-                if (wait_time > 1.0):
-                    self.logger.info(f"Waiting up to {wait_time} seconds for PFB data because average setting is {self.avg} for {2**self.avg} averages")
-                else:
-                    wait_time = 1
-                final_header= self.connection.get_pfb_data(timeout = wait_time)
-                header = final_header["header"]
-                data = final_header["data"]
-                self.connection.write_reg(self.df_enable, 0)
-                if header == []:
-                    self.connection.write_reg(self.scratchpad_1, 0x10 + (apid & 0xF))
-                    received = False
-                    errors += 1
-                    print(f"Header is empty")
-                    print(f"Retrying channel {i}")
+            enable = 1
+        self.connection.write_reg(self.df_enable, enable)
+        return enable
+
+    #Waits for correlation i from the microcontroller and acknowledges it, asking for it again until it comes in right
+    #keep_enabled is the df_enable value to turn the output back on with before the acknowledgement, so the microcontroller goes on to another frame
+    #The acknowledgement writes go out in one batch without waiting on them, so the wait for the next correlation starts right away.
+    #Their futures are added to acks, for the caller to wait on once the frame is done
+    #Returns (data, header), or None after 10 errors in a row
+    def get_pfb_channel_sw(self, i, estimator, acks, keep_enabled = None):
+        received = False
+        errors = 0
+        while (not received):
+            apid = 0x210 + i
+            wait_time = estimator.timeout()
+            if (wait_time > 1.0):
+                self.logger.info(f"Waiting up to {wait_time} seconds for PFB data because average setting is {self.avg} for {2**self.avg} averages")
+            start = time.perf_counter()
+            try:
+                final_header = self.connection.get_pfb_data(timeout = wait_time)
+                estimator.sample(time.perf_counter() - start)
+            except Empty:
+                #Handled like an empty product, the microcontroller is asked to send it again
+                estimator.timed_out()
+                final_header = {"header": [], "data": []}
+            header = final_header["header"]
+            data = final_header["data"]
+            status = self.check_pfb_header_sw(header, apid, i)
+            received = (status == (apid & 0xF))
+            if (not received):
+                errors += 1
+            writes = [(self.df_enable, 0),
+                      (self.scratchpad_1, status)]
+            if (errors > 10):
+                self.logger.error("That's 10 errors in a row in lusee_comm, exiting")
+                acks.extend(self.connection.write_regs(writes, wait = False))
+                return None
+            if (received and keep_enabled):
+                writes.append((self.df_enable, keep_enabled))
+            #Clear the acknowledge flag to tell microcontroller to check our response
+            writes.append((self.client_ack, 0))
+            acks.extend(self.connection.write_regs(writes, wait = False))
+        return data, header
+
+    #Returns the status code for scratchpad_1 that tells the microcontroller whether correlation i came in right
+    #It's just the channel when it did, anything 0x10 or more asks for it again
+    def check_pfb_header_sw(self, header, apid, i):
+        if header == []:
+            print(f"Header is empty")
+            print(f"Retrying channel {i}")
+            return 0x10 + (apid & 0xF)
+        #Data usually comes in 3 packets and has 3 separate headers
+        for pkt in range(3):
+            if pkt in header:
+                if hasattr(header[pkt], 'ccsds_appid'):
+                    if (header[pkt].ccsds_appid != apid):
+                        self.logger.error(f"Expected APID was {hex(apid)} and received APID was {hex(header[pkt].ccsds_appid)}")
+                        return 0x20 + (apid & 0xF)
                 else:
-                    #Data usually comes in 3 packets and has 3 separate headers
-                    for pkt in range(3):
-                        if pkt in header:
-                            if 'ccsds_appid' in header[pkt]:
-                                if (int(header[pkt]['ccsds_appid'], 16) == apid):
-                                    #This is the successful case where everything matches
-                                    self.connection.write_reg(self.scratchpad_1, (apid & 0xF))
-                                    #print(f"Wrote {apid & 0xF} to scratchpad")
-                                    received = True
-                                else:
-                                    self.connection.write_reg(self.scratchpad_1, 0x20 + (apid & 0xF))
-                                    received = False
-                                    errors += 1
-                                    self.logger.error(f"Expected APID was {hex(apid)} and received APID was {hex(int(header[pkt]['ccsds_appid'], 16))}")
-                                    break
-                            else:
-                                self.connection.write_reg(self.scratchpad_1, 0x30 + (apid & 0xF))
-                                received = False
-                                errors += 1
-                                self.logger.error("ccsds_appid not in the header dictionary")
-                                break
-                        else:
-                            self.connection.write_reg(self.scratchpad_1, 0x40 + (apid & 0xF))
-                            received = False
-                            errors += 1
-                            self.logger.error(f"Header doesn't have key {pkt}")
-                            break
-                if (errors > 10):
-                    self.logger.error("That's 10 errors in a row in lusee_comm, exiting")
-                    return all_data
-                #Clear the acknowledge flag to tell microcontroller to check our response
-                self.connection.write_reg(self.client_ack, 0)
-            all_data.append(data)
-            all_header.append(header)
-        self.get_spec_errors()
-        if (header_return):
-            return all_data, all_header
-        else:
-            return all_data
+                    self.logger.error("ccsds_appid not in the header record")
+                    return 0x30 + (apid & 0xF)
+            else:
+                self.logger.error(f"Header doesn't have key {pkt}")
+                return 0x40 + (apid & 0xF)
+        #This is the successful case where everything matches
+        return apid & 0xF
 
     def get_calib_data_sw(self, calib_mode, header_return = False, notch_avg = None, Nac1 = None, Nac2 = None, test = False,
                           wait_for_confirmation = False):
@@ -644,34 +864,31 @@ class LuSEE_COMMS:
             self.logger.info(f"Received {i}")
             header = final_header["header"]
             data = final_header["data"]
-            self.logger.info(f"Recieved proper packet of {hex(int(header[0]['ccsds_appid'], 16))}")
+            self.logger.info(f"Recieved proper packet of {hex(header[0].ccsds_appid)}")
             all_data.append(copy.deepcopy(data))
             all_header.append(copy.deepcopy(header))
         self.connection.write_reg(self.CF_Enable, 0)
         if (header_return):
             d = {}
             d['debug_fifo_used'] = self.connection.read_reg(self.debug_fifo_used)
-            for i in range(0x81c, 0x83B+1):
-                d[f"Register {hex(i)}"] = hex(self.connection.read_reg(i))
-            for i in range(0x9EB, 0x9EE+1):
-                d[f"Register {hex(i)}"] = hex(self.connection.read_reg(i))
+            for reg, val in self.read_calib_error_registers().items():
+                d[f"Register {hex(reg)}"] = hex(val)
             all_header.append(d)
             return all_data, all_header
         else:
             return all_data
 
-    def get_calib_errors(self):
-        for i in range(0x81c, 0x83B+1):
-            self.logger.warning(f"Register {hex(i)} is {hex(self.connection.read_reg(i))}")
+    def read_calib_error_registers(self):
+        return self.connection.read_many(list(range(0x81c, 0x83B+1)) + list(range(0x9EB, 0x9EE+1)))
 
-        for i in range(0x9EB, 0x9EE+1):
-            self.logger.warning(f"Register {hex(i)} is {hex(self.connection.read_reg(i))}")
+    def get_calib_errors(self):
+        for reg, val in self.read_calib_error_registers().items():
+            self.logger.warning(f"Register {hex(reg)} is {hex(val)}")
 
     def get_spec_errors(self):
         self.logger.warning(f"Lusee_comm getting spec errors")
-        self.logger.warning(f"Register 0x432 is {hex(self.connection.read_reg(0x432))}")
-        for i in range(0x460, 0x46F+1):
-            self.logger.warning(f"Register {hex(i)} is {hex(self.connection.read_reg(i))}")
+        for reg, val in self.connection.read_many([0x432] + list(range(0x460, 0x46F+1))).items():
+            self.logger.warning(f"Register {hex(reg)} is {hex(val)}")
 
     def set_chan_gain(self, ch, in1, in2, gain):
         chs=[2,1,0,3,4,5,6,7]
@@ -704,42 +921,46 @@ class LuSEE_COMMS:
                          driftSD1_index, driftSD2_index, default_drift, have_lock_value, have_lock_radian, lower_guard_value, upper_guard_value, power_ratio, antenna_enable,
                          power_slice, fdsd_slice, fdxsdx_slice, sum0shift, SNRon, SNRoff, Nsettle, delta_drift_cor_A, delta_drift_cor_B, prod_index, prod_index2):
 
-        self.connection.write_reg(self.Nac1, Nac1)
-        self.connection.write_reg(self.Nac2, Nac2)
-        self.connection.write_reg(self.notch_index, notch_index)
-        self.connection.write_reg(self.cplx_index, cplx_index)
-        self.connection.write_reg(self.sum1_index, sum1_index)
-        self.connection.write_reg(self.sum2_index, sum2_index)
-        self.connection.write_reg(self.powertop_index, powertop_index)
-        self.connection.write_reg(self.powerbot_index, powerbot_index)
-        self.connection.write_reg(self.driftFD_index, driftFD_index)
-        self.connection.write_reg(self.driftSD1_index, driftSD1_index)
-        self.connection.write_reg(self.driftSD2_index, driftSD2_index)
-        self.connection.write_reg(self.default_drift, default_drift)
-        self.connection.write_reg(self.have_lock_value, have_lock_value)
-        self.connection.write_reg(self.have_lock_radian, have_lock_radian)
-        self.connection.write_reg(self.lower_guard_value, lower_guard_value)
-        self.connection.write_reg(self.upper_guard_value, upper_guard_value)
-        self.connection.write_reg(self.power_ratio, power_ratio)
-        self.connection.write_reg(self.antenna_enable, antenna_enable)
-
-        self.connection.write_reg(0x83D, power_slice)
-        self.connection.write_reg(0x83E, fdsd_slice)
-        self.connection.write_reg(0x83F, fdxsdx_slice)
-
-        self.connection.write_reg(0x841, sum0shift)
-        self.connection.write_reg(0x842, SNRon)
-        self.connection.write_reg(0x843, SNRoff)
-        self.connection.write_reg(0x844, Nsettle)
-        self.connection.write_reg(0x845, delta_drift_cor_A)
-        self.connection.write_reg(0x846, delta_drift_cor_B)
-        self.connection.write_reg(0x9F0, prod_index)
-        self.connection.write_reg(0x9F1, prod_index2)
+        self.connection.write_regs([(self.Nac1, Nac1),
+                                    (self.Nac2, Nac2),
+                                    (self.notch_index, notch_index),
+                                    (self.cplx_index, cplx_index),
+                                    (self.sum1_index, sum1_index),
+                                    (self.sum2_index, sum2_index),
+                                    (self.powertop_index, powertop_index),
+                                    (self.powerbot_index, powerbot_index),
+                                    (self.driftFD_index, driftFD_index),
+                                    (self.driftSD1_index, driftSD1_index),
+                                    (self.driftSD2_index, driftSD2_index),
+                                    (self.default_drift, default_drift),
+                                    (self.have_lock_value, have_lock_value),
+                                    (self.have_lock_radian, have_lock_radian),
+                                    (self.lower_guard_value, lower_guard_value),
+                                    (self.upper_guard_value, upper_guard_value),
+                                    (self.power_ratio, power_ratio),
+                                    (self.antenna_enable, antenna_enable),
+
+                                    (0x83D, power_slice),
+                                    (0x83E, fdsd_slice),
+                                    (0x83F, fdxsdx_slice),
+
+                                    (0x841, sum0shift),
+                                    (0x842, SNRon),
+                                    (0x843, SNRoff),
+                                    (0x844, Nsettle),
+                                    (0x845, delta_drift_cor_A),
+                                    (0x846, delta_drift_cor_B),
+                                    (0x9F0, prod_index),
+                                    (0x9F1, prod_index2)])
 
     def apply_weight(self, weight, val):
         weight_register = self.weight_base + weight
         self.connection.write_reg(weight_register, val)
 
+    #Writes all the weights in one batch, weights is a list of values starting at weight 0
+    def apply_weights(self, weights):
+        self.connection.write_regs([(self.weight_base + num, val) for num, val in enumerate(weights)])
+
     def get_adc_stats(self, num, high, low):
         self.connection.write_reg(self.adc_stat_clr, 1)
         self.connection.write_reg(self.adc_stat_samples, num)
@@ -751,19 +972,23 @@ class LuSEE_COMMS:
             print(f"Waiting for {num} samples, currently at {self.connection.read_reg(self.adc0_stat_avg_cnt)}")
             time.sleep(1)
 
+        stat_regs = [self.adc0_stat_avg_cnt, self.adc0_stat_avg, self.adc0_stat_savg, self.adc0_stat_max, self.adc0_stat_min,
+                     self.adc0_stat_high_cnt, self.adc0_stat_low_cnt, self.adc0_stat_ovf]
+        stats = self.connection.read_many([reg + (i * self.adc_stat_next) for i in range(4) for reg in stat_regs])
+
         adc_results = {}
         for i in range(4):
-            adc_results[f"ADC{i}_CNT"] = self.connection.read_reg(self.adc0_stat_avg_cnt + (i * self.adc_stat_next))
+            adc_results[f"ADC{i}_CNT"] = stats[self.adc0_stat_avg_cnt + (i * self.adc_stat_next)]
 
-            adc_results[f"ADC{i}_MAX"] = self.connection.read_reg(self.adc0_stat_max + (i * self.adc_stat_next))
-            adc_results[f"ADC{i}_MIN"] = self.connection.read_reg(self.adc0_stat_min + (i * self.adc_stat_next))
-            adc_results[f"ADC{i}_HIGH_CNT"] = self.connection.read_reg(self.adc0_stat_high_cnt + (i * self.adc_stat_next))
-            adc_results[f"ADC{i}_LOW_CNT"] = self.connection.read_reg(self.adc0_stat_low_cnt + (i * self.adc_stat_next))
+            adc_results[f"ADC{i}_MAX"] = stats[self.adc0_stat_max + (i * self.adc_stat_next)]
+            adc_results[f"ADC{i}_MIN"] = stats[self.adc0_stat_min + (i * self.adc_stat_next)]
+            adc_results[f"ADC{i}_HIGH_CNT"] = stats[self.adc0_stat_high_cnt + (i * self.adc_stat_next)]
+            adc_results[f"ADC{i}_LOW_CNT"] = stats[self.adc0_stat_low_cnt + (i * self.adc_stat_next)]
 
-            overflow = self.connection.read_reg(self.adc0_stat_ovf + (i * self.adc_stat_next))
-            avg_value = self.connection.read_reg(self.adc0_stat_avg + (i * self.adc_stat_next)) + ((overflow & 0xFF) << 32)
+            overflow = stats[self.adc0_stat_ovf + (i * self.adc_stat_next)]
+            avg_value = stats[self.adc0_stat_avg + (i * self.adc_stat_next)] + ((overflow & 0xFF) << 32)
             adc_results[f"ADC{i}_AVG"] = round(avg_value/adc_results[f"ADC{i}_CNT"], 3)
-            savg_value = self.connection.read_reg(self.adc0_stat_savg + (i * self.adc_stat_next)) + (((overflow & 0xFF0000) >> 16) << 32)
+            savg_value = stats[self.adc0_stat_savg + (i * self.adc_stat_next)] + (((overflow & 0xFF0000) >> 16) << 32)
             adc_results[f"ADC{i}_SAVG"] = round(savg_value/adc_results[f"ADC{i}_CNT"], 3)
 
         return adc_results
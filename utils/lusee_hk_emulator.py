@@ -9,11 +9,11 @@ from utils import LuSEE_COMMS
 from utils import LuSEE_ETHERNET
 
 class LuSEE_HK_EMULATOR:
-    def __init__(self):
+    def __init__(self, connection = None):
         self.logger = logging.getLogger(self.__class__.__name__)
         self.logger.debug("Class created")
-        self.comm        = LuSEE_COMMS()
-        self.connection  = LuSEE_ETHERNET()
+        self.comm        = LuSEE_COMMS(connection)
+        self.connection  = self.comm.connection
         self.tvs_cntl    = 0x004
         self.tvs_1_0v    = 0x005
         self.tvs_1_8v    = 0x006
@@ -0,0 +1,464 @@
+import os
+import sys
+import json
+import time
+import math
+import random
+import struct
+import socket
+import select
+import threading
+import queue
+import logging
+import logging.config
+
+import numpy as np
+
+#Stand-in for the DCB emulator and the spectrometer board, so the readout stack can run and be benchmarked on a plain computer
+#It speaks the same CDI protocol that LuSEE_ETHERNET.write_cdi_reg uses, keeps a spectrometer register file
+#and sends back CCSDS data packets the way the board does. Packet sizes and APIDs follow what LuSEE_PROCESS_DATA expects,
+#the data itself is a deterministic pattern rather than anything physical
+class LuSEE_STANDIN:
+    def __init__(self, endpoint = None, settings = None):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.debug("Class created")
+
+        #By default everything stays on this computer
+        self.UDP_IP = "127.0.0.1"
+        self.PC_IP = "127.0.0.1"
+
+        self.PORT_WREG = 32000
+        self.PORT_RREG = 32001
+        self.PORT_RREGRESP = 32002
+        self.PORT_HSDATA = 32003
+        self.PORT_HK = 32004
+        self.BUFFER_SIZE = 9014
+
+        for key, val in (endpoint or {}).items():
+            if key not in ("UDP_IP", "PC_IP", "PORT_WREG", "PORT_RREG", "PORT_RREGRESP", "PORT_HSDATA", "PORT_HK"):
+                self.logger.warning(f"Endpoint setting {key} is not a valid setting, ignoring it")
+                continue
+            setattr(self, key, val)
+
+        #These must match LuSEE_ETHERNET
+        self.KEY1 = 0xDEAD
+        self.KEY2 = 0xBEEF
+        self.latch_register = 0x1
+        self.write_register = 0x2
+        self.readback_register = 0xB
+        self.cdi_reset = 0x0
+        self.latch_done = 0x80000000
+
+        self.first_data_pack = 0xA0
+        self.second_data_pack = 0xA1
+        self.address_write = 0xA2
+        self.address_read = 0xA3
+        self.bootloader_message = 0xB0
+
+        #Spectrometer registers that make the stand-in do something when written
+        self.spectrometer_reset = 0x0
+        self.uC_reset = 0x100
+        self.scratchpad_1 = 0x120
+        self.scratchpad_2 = 0x121
+        self.load_data = 0x210
+        self.num_samples = 0x211
+        self.data_src_sel = 0x212
+        self.cdi_src_sel = 0x21F
+        self.df_enable = 0x220
+        self.client_control = 0x240
+        self.client_ack = 0x241
+        self.main_average = 0x411
+        self.CF_Enable = 0x814
+        self.cal_enable = 0x83C
+        self.cal_mode = 0x84D
+
+        #Data stream knobs, all of them can be set from the settings dictionary
+        #Maximum data packets per second, 0 sends as fast as possible
+        self.packet_rate = 0
+        #Random extra delay of up to this many seconds before each data packet
+        self.jitter = 0.0
+        #Probability that any data packet gets lost
+        self.loss = 0.0
+        #Same as LuSEE_COMMS, the time one spectrum takes before averaging
+        self.cycle_time = 40e-6
+        self.seed = 0
+
+        self.fft_bins = 2048
+        self.fft_packets = 3
+        self.adc_samples = 16384
+        self.adc_packets = 9
+        self.calib_words = 1024
+        self.gout_words = 512
+        self.count_bytes_per_packet = 0x7F8
+
+        for key, val in (settings or {}).items():
+            if not hasattr(self, key):
+                self.logger.warning(f"Stand-in setting {key} is not a valid setting, ignoring it")
+                continue
+            setattr(self, key, val)
+
+        #Readout modes for register 0x212, from LuSEE_COMMS.readout_modes
+        self.fpga_fft_apids = {0: 0x2E0, 6: 0x2E1, 7: 0x2E2, 8: 0x2E3}
+        self.fpga_adc_apids = {1: 0x2F0, 2: 0x2F1, 3: 0x2F2, 4: 0x2F3}
+        self.count_apid = 0x209
+        self.sw_fft_apid = 0x210
+        #What each calibrator mode (register 0x84D) sends, as (APID, number of packets, number of 32 bit words)
+        self.calib_modes = {0: [(0x230 + i, 2, self.calib_words) for i in range(8)] + [(0x260, 1, 1), (0x261, 2, self.calib_words)],
+                            1: [(0x270 + i, 1, self.gout_words) for i in range(8)],
+                            2: [(0x238 + i, 2, self.calib_words) for i in range(16)],
+                            3: [(0x250 + i, 3, self.calib_words) for i in range(16)] + [(0x240 + i, 2, self.calib_words) for i in range(8)]}
+
+        #Python's socket module doesn't name this option, 35 is its value on Linux
+        self.SO_TIMESTAMPNS = getattr(socket, "SO_TIMESTAMPNS", 35 if sys.platform.startswith("linux") else None)
+
+        self.random = random.Random(self.seed)
+        self.lock = threading.Condition()
+        self.stop_event = threading.Event()
+        self.stop_signal = object()
+        self.data_queue = queue.Queue()
+
+        #The DCB emulator numbers the datagrams going to each port separately
+        self.udp_packet_num = {}
+        self.sequence_cnt = {}
+        self.stats = {"cdi_writes": 0,
+                      "cdi_reads": 0,
+                      "data_packets": 0,
+                      "data_packets_lost": 0,
+                      "hk_packets": 0}
+        self.reset_cdi()
+        self.reset_registers()
+
+    def reset_cdi(self):
+        self.cdi_registers = {self.latch_register: self.latch_done}
+        self.latch_armed = False
+        self.data_msb = 0
+        self.data_lsb = 0
+
+    def reset_registers(self):
+        self.registers = {0x0FC: 0x113,
+                          0x0FD: 0x4C55,
+                          0x0FE: 0x20241018,
+                          0x0FF: 0x123456,
+                          0x324: 1}
+        #The ADC stats need a nonzero count, since LuSEE_COMMS.get_adc_stats divides by it
+        for i in range(4):
+            self.registers[0x330 + (i * 0x10)] = 0xFFFE
+        self.uC_running = False
+        self.uC_channel = 0
+
+    def start(self):
+        self.sock_wreg = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock_wreg.bind((self.UDP_IP, self.PORT_WREG))
+        self.sock_rreg = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock_rreg.bind((self.UDP_IP, self.PORT_RREG))
+        for sock in (self.sock_wreg, self.sock_rreg):
+            #Kernel receive timestamps put the datagrams from the two ports back in order
+            if (self.SO_TIMESTAMPNS):
+                sock.setsockopt(socket.SOL_SOCKET, self.SO_TIMESTAMPNS, 1)
+            sock.setblocking(False)
+        self.sock_write = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.dummy_socket, self.dummy_socket_wakeup = socket.socketpair()
+
+        thread_settings = [(self.cdi_server, "Stand-in CDI Thread"),
+                           (self.data_sender, "Stand-in Data Thread"),
+                           (self.microcontroller, "Stand-in Microcontroller Thread")]
+        self.threads = []
+        for target, name in thread_settings:
+            thread = threading.Thread(target=target, name=name, daemon = True)
+            thread.start()
+            self.threads.append(thread)
+        self.logger.info(f"Stand-in listening at {self.UDP_IP}:{self.PORT_WREG} and {self.UDP_IP}:{self.PORT_RREG}, answering to {self.PC_IP}")
+
+    def stop(self):
+        self.logger.debug("Stopping all threads")
+        self.stop_event.set()
+        self.data_queue.put(self.stop_signal)
+        with self.lock:
+            self.lock.notify_all()
+        try:
+            self.dummy_socket_wakeup.send(b'\x00')
+        except OSError:
+            pass
+        for i in self.threads:
+            i.join()
+        for sock in (self.sock_wreg, self.sock_rreg, self.sock_write, self.dummy_socket, self.dummy_socket_wakeup):
+            sock.close()
+        self.logger.info("Stand-in closed gracefully")
+
+    #Both CDI ports are serviced by one thread, so writes and reads are handled in the order they come in
+    def cdi_server(self):
+        name = threading.current_thread().name
+        self.logger.debug(f"{name} started")
+        while not self.stop_event.is_set():
+            ready, _, _ = select.select([self.sock_rreg, self.sock_wreg, self.dummy_socket], [], [], None)
+            if self.dummy_socket in ready:
+                break
+            #Everything waiting on both ports is handled in the order the kernel received it
+            #Otherwise a read could overtake the writes sent just before it, which can't happen on the DCB emulator's one link
+            messages = []
+            for sock in (self.sock_rreg, self.sock_wreg):
+                messages.extend(self.receive_all(sock))
+            messages.sort(key = lambda i: i[0])
+            for received, sock, data in messages:
+                if (len(data) < 12):
+                    self.logger.warning(f"{name} got a message that's too short: {data}")
+                    continue
+                key1, key2, reg, dataMSB, dataLSB, footer = struct.unpack_from(">6H", data)
+                if (key1 != self.KEY1 or key2 != self.KEY2):
+                    self.logger.warning(f"{name} got a message with the wrong keys: {data}")
+                    continue
+                if (sock is self.sock_wreg):
+                    self.cdi_write(reg, (dataMSB << 16) + dataLSB)
+                else:
+                    self.cdi_read(reg)
+        self.logger.debug(f"{name} exited")
+
+    #Returns (receive time, socket, data) for every datagram waiting on the socket
+    #Without kernel timestamps, datagrams keep the order they were read in
+    def receive_all(self, sock):
+        messages = []
+        while True:
+            try:
+                data, ancdata, flags, addr = sock.recvmsg(self.BUFFER_SIZE, socket.CMSG_SPACE(16))
+            except BlockingIOError:
+                return messages
+            received = 0
+            for level, kind, value in ancdata:
+                if (level == socket.SOL_SOCKET and kind == self.SO_TIMESTAMPNS):
+                    sec, nsec = struct.unpack_from("@qq", value)
+                    received = sec * 1000000000 + nsec
+            messages.append((received, sock, data))
+
+    def cdi_write(self, reg, val):
+        self.stats["cdi_writes"] += 1
+        if (reg == self.latch_register):
+            #The write register is acted on when the latch goes back down, then the latch register reports done in bit 31
+            if (val & 0x1):
+                self.latch_armed = True
+                self.cdi_registers[self.latch_register] = 0
+            elif (self.latch_armed):
+                self.latch_armed = False
+                self.latch_word(self.cdi_registers.get(self.write_register, 0))
+                self.cdi_registers[self.latch_register] = self.latch_done
+        elif (reg == self.cdi_reset):
+            if (val & 0x1):
+                self.reset_cdi()
+        else:
+            self.cdi_registers[reg] = val
+
+    def cdi_read(self, reg):
+        self.stats["cdi_reads"] += 1
+        self.sock_write.sendto(struct.pack(">HI", reg, self.cdi_registers.get(reg, 0)), (self.PC_IP, self.PORT_RREGRESP))
+
+    def latch_word(self, word):
+        command = (word >> 16) & 0xFF
+        value = word & 0xFFFF
+        if (command == self.first_data_pack):
+            self.data_msb = value
+        elif (command == self.second_data_pack):
+            self.data_lsb = value
+        elif (command == self.address_write):
+            self.spectrometer_write(value, (self.data_msb << 16) + self.data_lsb)
+        elif (command == self.address_read):
+            #The DCB emulator fetches the spectrometer register into its readback register
+            with self.lock:
+                self.cdi_registers[self.readback_register] = self.registers.get(value, 0)
+        elif (command == self.bootloader_message):
+            self.bootloader(value)
+        else:
+            self.logger.warning(f"Unknown CDI command {hex(word)}")
+
+    def spectrometer_write(self, reg, val):
+        with self.lock:
+            old = self.registers.get(reg, 0)
+            self.registers[reg] = val
+            if (reg == self.spectrometer_reset and (val & 0x1)):
+                self.reset_registers()
+                self.registers[reg] = val
+            elif (reg == self.uC_reset and old and not val):
+                self.send_hk(self.bootloader_header(0))
+            elif (reg == self.load_data and (val & 0x1) and not (old & 0x1)):
+                self.fpga_packet()
+            elif (reg == self.scratchpad_2 and val == 3):
+                self.uC_running = False
+                self.uC_channel = 0
+            elif (reg == self.df_enable and (val & 0x1) and not (old & 0x1)):
+                if (not self.uC_running and self.registers.get(self.client_control, 0) == 0):
+                    self.uC_running = True
+                    self.uC_channel = 0
+                    self.registers[self.client_ack] = 0
+            elif ((reg == self.CF_Enable or reg == self.cal_enable) and val and not old):
+                if (self.registers.get(self.CF_Enable, 0) and self.registers.get(self.cal_enable, 0)):
+                    self.calibrator_packets()
+            self.lock.notify_all()
+
+    #Products requested through the FPGA path go out straight away
+    def fpga_packet(self):
+        mode = self.registers.get(self.data_src_sel, 0)
+        if (mode in self.fpga_fft_apids):
+            apid = self.fpga_fft_apids[mode]
+            self.queue_product(apid, self.pack_words(self.fft_pattern(apid)), self.fft_packets)
+        elif (mode in self.fpga_adc_apids):
+            apid = self.fpga_adc_apids[mode]
+            self.queue_product(apid, self.adc_pattern(mode).astype(">u2").tobytes(), self.adc_packets)
+        elif (mode == 5):
+            num = self.registers.get(self.num_samples, 0)
+            counter = (np.arange(num // 2) & 0xFFFF).astype(">u2").tobytes()
+            self.queue_product(self.count_apid, counter, (len(counter) // self.count_bytes_per_packet) + 1)
+        else:
+            self.logger.warning(f"Readout mode {mode} doesn't send anything")
+
+    def calibrator_packets(self):
+        mode = self.registers.get(self.cal_mode, 0)
+        for apid, packets, words in self.calib_modes.get(mode, []):
+            self.queue_product(apid, self.pack_words(self.calib_pattern(apid, words)), packets)
+
+    #Walks the 16 correlations like the microcontroller does, waiting for the client to clear client_ack after each one
+    #A status code of 0x10 or more in scratchpad_1 means the client wants the channel again
+    def microcontroller(self):
+        name = threading.current_thread().name
+        self.logger.debug(f"{name} started")
+        while not self.stop_event.is_set():
+            with self.lock:
+                while not self.stop_event.is_set() and not self.uC_running:
+                    self.lock.wait()
+                if self.stop_event.is_set():
+                    break
+                channel = self.uC_channel
+                avg = self.registers.get(self.main_average, 0)
+            time.sleep(self.cycle_time * (2 ** avg))
+            apid = self.sw_fft_apid + channel
+            with self.lock:
+                if (not self.uC_running):
+                    continue
+                self.registers[self.client_ack] = 1
+                self.queue_product(apid, self.pack_words(self.fft_pattern(apid)), self.fft_packets)
+                while not self.stop_event.is_set() and self.uC_running and self.registers.get(self.client_ack, 0):
+                    self.lock.wait()
+                if (not self.uC_running):
+                    continue
+                if (self.registers.get(self.scratchpad_1, 0) >= 0x10):
+                    continue
+                self.uC_channel = (channel + 1) % 16
+                #After a whole frame, the microcontroller only keeps going while the spectrometer output is still enabled
+                if (self.uC_channel == 0 and not (self.registers.get(self.df_enable, 0) & 0x1)):
+                    self.uC_running = False
+        self.logger.debug(f"{name} exited")
+
+    def bootloader(self, message):
+        if (message == 0x07):
+            self.send_hk(self.bootloader_header(1) + [1, 1])
+        elif (message == 0x08):
+            self.send_hk(self.bootloader_header(2) + [0x100, 0x1234, 0x1234] * 6 + [0x100, 0x1234])
+        elif (message == 0x09):
+            self.send_hk(self.bootloader_header(3) + [0x0000fc4f])
+
+    def bootloader_header(self, message):
+        timestamp = int(time.monotonic() * 1e6)
+        return [message, 0, timestamp & 0xFFFFFFFF, (timestamp >> 32) & 0xFFFFFFFF, 0x20241018, 0x123456, 0x1, 0xFFFFFFFF]
+
+    def send_hk(self, words):
+        self.stats["hk_packets"] += 1
+        packet = self.header(0x200, 3, len(words) * 4, self.PORT_HK) + self.pack_words(np.array(words, dtype = np.uint32))
+        self.sock_write.sendto(packet, (self.PC_IP, self.PORT_HK))
+
+    def fft_pattern(self, apid):
+        return (np.arange(self.fft_bins, dtype = np.uint32) * 16) + ((apid & 0xFF) << 24)
+
+    def calib_pattern(self, apid, words):
+        return np.arange(words, dtype = np.uint32) + ((apid & 0xFF) << 24)
+
+    #14 bit two's complement sine wave, the same format as the real ADCs
+    def adc_pattern(self, adc):
+        samples = np.arange(self.adc_samples)
+        wave = np.round(4000 * np.sin(2 * math.pi * samples * adc / 2048)).astype(np.int32)
+        return (wave & 0x3FFF).astype(np.uint16)
+
+    #32 bit values go out big endian, but with the lower 16 bits first
+    def pack_words(self, words):
+        words = np.asarray(words, dtype = np.uint32)
+        packed = np.empty((len(words), 2), dtype = ">u2")
+        packed[:, 0] = words & 0xFFFF
+        packed[:, 1] = words >> 16
+        return packed.tobytes()
+
+    #Header format from LuSEE_PROCESSING.organize_header, 13 16 bit words
+    def header(self, apid, groupflags, payload_len, port):
+        udp_packet_num = (self.udp_packet_num.get(port, 0) + 1) & 0xFFFFFFFF
+        self.udp_packet_num[port] = udp_packet_num
+        sequence_cnt = self.sequence_cnt.get(apid, 0)
+        self.sequence_cnt[apid] = (sequence_cnt + 1) & 0x3FFF
+        return struct.pack(">13H",
+                           udp_packet_num >> 16, udp_packet_num & 0xFFFF,
+                           0, 0, 0, 0,
+                           0, 0,
+                           (1 << 10) + ((payload_len // 2) & 0x3FF), 0,
+                           (1 << 11) + (apid & 0x7FF),
+                           (groupflags << 14) + sequence_cnt,
+                           (payload_len - 1) & 0xFFFF)
+
+    #Splits a product into packets with CCSDS group flags and per APID sequence counts, and queues them to go out
+    def queue_product(self, apid, payload, packets):
+        packets = max(int(packets), 1)
+        #Keeps 32 bit values from being split between packets
+        chunk = -(-len(payload) // (packets * 4)) * 4
+        for num in range(packets):
+            if (packets == 1):
+                groupflags = 3
+            elif (num == 0):
+                groupflags = 1
+            elif (num == packets - 1):
+                groupflags = 2
+            else:
+                groupflags = 0
+            piece = payload[num * chunk:(num + 1) * chunk]
+            self.data_queue.put(self.header(apid, groupflags, len(piece), self.PORT_HSDATA) + piece)
+
+    def data_sender(self):
+        name = threading.current_thread().name
+        self.logger.debug(f"{name} started")
+        next_time = time.perf_counter()
+        while not self.stop_event.is_set():
+            packet = self.data_queue.get()
+            if packet is self.stop_signal:
+                break
+            if (self.packet_rate):
+                next_time = max(next_time + (1 / self.packet_rate), time.perf_counter())
+                delay = next_time - time.perf_counter()
+            else:
+                delay = 0
+            if (self.jitter):
+                delay += self.random.uniform(0, self.jitter)
+            if (delay > 0):
+                time.sleep(delay)
+            if (self.loss and self.random.random() < self.loss):
+                self.stats["data_packets_lost"] += 1
+                continue
+            self.stats["data_packets"] += 1
+            self.sock_write.sendto(packet, (self.PC_IP, self.PORT_HSDATA))
+        self.logger.debug(f"{name} exited")
+
+if __name__ == "__main__":
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    relative_path = '../config/config_logger.ini'
+    config_path = os.path.join(script_dir, relative_path)
+    logging.config.fileConfig(config_path)
+
+    endpoint = None
+    settings = None
+    if (len(sys.argv) > 1):
+        with open(sys.argv[1], "r") as jsonfile:
+            json_data = json.load(jsonfile)
+        endpoint = json_data.get("endpoint")
+        settings = json_data.get("settings")
+
+    standin = LuSEE_STANDIN(endpoint = endpoint, settings = settings)
+    standin.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        standin.logger.debug("Keyboard interrupt")
+    finally:
+        standin.stop()
+        standin.logger.info(standin.stats)
@@ -0,0 +1,189 @@
+import os
+import sys
+import json
+import time
+import struct
+import socket
+import selectors
+import threading
+import logging
+import logging.config
+
+#The far end of LuSEE_LINK_TCP. It sits next to the DCB emulator (or the stand-in) and turns TCP frames back into UDP datagrams
+#Frames from the client go out to the DCB emulator on the port in the frame, and datagrams the DCB emulator sends
+#to the register, data and housekeeping ports go back to the client as frames. Only one client is served at a time
+#Run it locally with the stand-in to test the TCP link without hardware
+class LuSEE_TCP_BRIDGE:
+    def __init__(self, endpoint = None, tcp_ip = "127.0.0.1", tcp_port = 32010):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.debug("Class created")
+
+        #Same meaning as in LuSEE_ETHERNET, this is the UDP side the bridge speaks to the DCB emulator
+        self.UDP_IP = "192.168.121.1"
+        self.PC_IP = "192.168.121.50"
+        self.PORT_WREG = 32000
+        self.PORT_RREG = 32001
+        self.PORT_RREGRESP = 32002
+        self.PORT_HSDATA = 32003
+        self.PORT_HK = 32004
+        self.BUFFER_SIZE = 9014
+        self.RCVBUF_SIZE = 4 * 1024 * 1024
+        for key, val in (endpoint or {}).items():
+            if not hasattr(self, key):
+                self.logger.warning(f"Endpoint setting {key} is not a valid setting, ignoring it")
+                continue
+            setattr(self, key, val)
+
+        self.tcp_ip = tcp_ip
+        self.tcp_port = tcp_port
+        #Must match LuSEE_LINK_TCP.frame_struct
+        self.frame_struct = struct.Struct(">IH")
+        self.recv_size = 65536
+        self.client = None
+        self.stream = bytearray()
+        self.stop_event = threading.Event()
+        self.stats = {"clients": 0,
+                      "frames_to_dcb": 0,
+                      "frames_to_client": 0,
+                      "datagrams_dropped": 0}
+
+    def start(self):
+        self.selector = selectors.DefaultSelector()
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((self.tcp_ip, self.tcp_port))
+        self.server.listen(1)
+        self.selector.register(self.server, selectors.EVENT_READ, "accept")
+        for port in (self.PORT_RREGRESP, self.PORT_HSDATA, self.PORT_HK):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            if (self.RCVBUF_SIZE):
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.RCVBUF_SIZE)
+            sock.bind((self.PC_IP, port))
+            sock.setblocking(False)
+            self.selector.register(sock, selectors.EVENT_READ, port)
+        self.sock_write = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.dummy_socket, self.dummy_socket_wakeup = socket.socketpair()
+        self.selector.register(self.dummy_socket, selectors.EVENT_READ, "stop")
+        self.thread = threading.Thread(target=self.bridge, name="TCP Bridge Thread", daemon = True)
+        self.thread.start()
+        self.logger.info(f"Bridge listening at {self.tcp_ip}:{self.tcp_port}, forwarding to {self.UDP_IP}")
+
+    def stop(self):
+        self.logger.debug("Stopping")
+        self.stop_event.set()
+        try:
+            self.dummy_socket_wakeup.send(b'\x00')
+        except OSError:
+            pass
+        self.thread.join()
+        for key in list(self.selector.get_map().values()):
+            key.fileobj.close()
+        self.selector.close()
+        self.sock_write.close()
+        self.dummy_socket_wakeup.close()
+        self.logger.info("Bridge closed gracefully")
+
+    #Everything is done from this one thread, so frames and datagrams keep their order
+    def bridge(self):
+        name = threading.current_thread().name
+        self.logger.debug(f"{name} started")
+        while not self.stop_event.is_set():
+            for key, _ in self.selector.select():
+                if (key.data == "stop"):
+                    self.logger.debug(f"{name} has been told to stop. Exiting...")
+                    return
+                elif (key.data == "accept"):
+                    self.accept()
+                elif (key.data == "client"):
+                    self.from_client()
+                else:
+                    self.from_dcb(key.fileobj, key.data)
+        self.logger.debug(f"{name} exited")
+
+    def accept(self):
+        client, addr = self.server.accept()
+        if (self.client):
+            self.logger.warning(f"Refusing {addr}, a client is already connected")
+            client.close()
+            return
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.client = client
+        self.stream = bytearray()
+        self.selector.register(client, selectors.EVENT_READ, "client")
+        self.stats["clients"] += 1
+        self.logger.info(f"Client connected from {addr}")
+
+    def drop_client(self):
+        self.logger.info("Client disconnected")
+        self.selector.unregister(self.client)
+        self.client.close()
+        self.client = None
+
+    def from_client(self):
+        try:
+            chunk = self.client.recv(self.recv_size)
+        except OSError:
+            chunk = b""
+        if not chunk:
+            self.drop_client()
+            return
+        self.stream += chunk
+        offset = 0
+        header_size = self.frame_struct.size
+        while len(self.stream) - offset >= header_size:
+            length, port = self.frame_struct.unpack_from(self.stream, offset)
+            start = offset + header_size
+            if (len(self.stream) - start < length):
+                break
+            offset = start + length
+            self.sock_write.sendto(self.stream[start:offset], (self.UDP_IP, port))
+            self.stats["frames_to_dcb"] += 1
+        del self.stream[:offset]
+
+    #Everything waiting on the port goes to the client in one write
+    def from_dcb(self, sock, port):
+        frames = []
+        while True:
+            try:
+                data = sock.recv(self.BUFFER_SIZE)
+            except BlockingIOError:
+                break
+            frames.append(self.frame_struct.pack(len(data), port) + data)
+        if not frames:
+            return
+        if (self.client is None):
+            self.stats["datagrams_dropped"] += len(frames)
+            return
+        try:
+            self.client.sendall(b"".join(frames))
+            self.stats["frames_to_client"] += len(frames)
+        except OSError:
+            self.stats["datagrams_dropped"] += len(frames)
+            self.drop_client()
+
+if __name__ == "__main__":
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    relative_path = '../config/config_logger.ini'
+    config_path = os.path.join(script_dir, relative_path)
+    logging.config.fileConfig(config_path)
+
+    endpoint = None
+    tcp_ip = "127.0.0.1"
+    tcp_port = 32010
+    if (len(sys.argv) > 1):
+        with open(sys.argv[1], "r") as jsonfile:
+            json_data = json.load(jsonfile)
+        endpoint = json_data.get("endpoint")
+        tcp_ip = json_data.get("TCP_IP", tcp_ip)
+        tcp_port = json_data.get("TCP_PORT", tcp_port)
+
+    bridge = LuSEE_TCP_BRIDGE(endpoint = endpoint, tcp_ip = tcp_ip, tcp_port = tcp_port)
+    bridge.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        bridge.logger.debug("Keyboard interrupt")
+    finally:
+        bridge.stop()
+        bridge.logger.info(bridge.stats)
@@ -0,0 +1,57 @@
+import logging
+import logging.config
+
+import numpy as np
+
+#Turns CCSDS packet payloads into numpy arrays without touching every value in Python
+#Packet format defined by Jack Fried in VHDL for custom CDI interface
+#The header is 13 16 bit words, and the payload after it is 16 bit words (ADC and counter) or 32 bit words (everything else)
+class LuSEE_DECODER:
+    def __init__(self):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.debug("Class created")
+        self.header_bytes = 26
+        self.adc_bits = 14
+        #Products carry numpy arrays. Set this to True to get plain Python lists in products like before
+        self.list_output = False
+
+    #Payload as 16 bit words, converted from big endian to native
+    def shorts(self, payload, count = -1):
+        return np.frombuffer(payload, dtype = ">u2", count = count).astype(np.uint16)
+
+    #Payload as 32 bit words. Each 32 bit value comes big endian, but with its lower 16 bits first
+    #So the 16 bit halves are read in order and byte swapped, and then the pairs are already a little endian 32 bit value
+    def words(self, payload, count = -1):
+        if (count < 0):
+            count = len(payload) // 4
+        halves = np.frombuffer(payload, dtype = ">u2", count = count * 2)
+        return halves.astype("<u2").view("<u4")
+
+    #Raw ADC samples, the same 16 bit values the board sends
+    def adc(self, payload):
+        return self.shorts(payload)
+
+    #ADC samples are 14 bit two's complement inside the 16 bit words
+    def adc_signed(self, data, bits = None):
+        bits = bits or self.adc_bits
+        data = np.asarray(data, dtype = np.int32) & ((1 << bits) - 1)
+        return np.where(data & (1 << (bits - 1)), data - (1 << bits), data).astype(np.int16)
+
+    #What goes into products, depending on list_output
+    def output(self, data):
+        if (self.list_output):
+            return data.tolist()
+        return data
+
+    #For json.dump(..., default = decoder.json_default), so products with arrays and header records can be written like before
+    def json_default(self, obj):
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        if isinstance(obj, np.integer):
+            return int(obj)
+        if isinstance(obj, np.floating):
+            return float(obj)
+        #Packet header records turn into the dictionaries of hex strings that were always written out
+        if hasattr(obj, "to_dict"):
+            return obj.to_dict()
+        return str(obj)
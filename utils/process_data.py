@@ -17,192 +17,249 @@ class LuSEE_PROCESS_DATA:
         self.adc_output_queue = parent.adc_output_queue
         self.pfb_output_queue = parent.pfb_output_queue
         self.calib_output_queue = parent.calib_output_queue
+        self.decoder = parent.decoder
 
         self.count_num = None
         self.bytes_per_packet = 0x7F8
-        self.count_pkt_num = None
-        self.count_apid = "0x209"
-        self.adc_pkt_num = 9
-        self.adc_apids = ["0x220", "0x221", "0x222", "0x223", "0x2f0", "0x2f1", "0x2f2", "0x2f3"]
-        self.fft_pkt_num = 3
-        self.fft_apids = ["0x210", "0x211", "0x212", "0x213", "0x214", "0x215", "0x216", "0x217", "0x218", "0x219", "0x21a", "0x21b", "0x21c", "0x21d", "0x21e", "0x21f", "0x2e0", "0x2e1", "0x2e2", "0x2e3"]
-        #self.calib_pkt_num = 2
-        self.calib_apids = ['0x230', '0x231', '0x232', '0x233', '0x234', '0x235', '0x236', '0x237', '0x238', '0x239', '0x23a', '0x23b', '0x23c', '0x23d', '0x23e', '0x23f', '0x240', '0x241', '0x242', '0x243', '0x244', '0x245', '0x246', '0x247', '0x250', '0x251', '0x252', '0x253', '0x254', '0x255', '0x256', '0x257', '0x258', '0x259', '0x25a', '0x25b', '0x25c', '0x25d', '0x25e', '0x25f', '0x261']
-        self.calib_apids3 = ['0x250', '0x251', '0x252', '0x253', '0x254', '0x255', '0x256', '0x257', '0x258', '0x259', '0x25a', '0x25b', '0x25c', '0x25d', '0x25e', '0x25f']
-        self.gNacc_apid = '0x260'
-        self.gout_apid = ['0x270', '0x271', '0x272', '0x273', '0x274', '0x275', '0x276', '0x277']
-        self.gphase_apid = '0x261'
+
+        #CCSDS group flags, for packets that are part of a bigger product
+        self.group_continuation = 0
+        self.group_first = 1
+        self.group_last = 2
+        self.group_standalone = 3
+        self.sequence_mask = 0x3FFF
+
+        #Each APID is reassembled separately, so interleaved products don't break each other
+        #A context holds the packets of one product in flight, by their place in the product
+        self.contexts = {}
+        self.last_sequence = {}
+        self.last_udp_packet_num = None
+        #Finished product buffers waiting to be reused, by product spec
+        self.product_buffers = {}
+        self.stats_lock = threading.Lock()
+        self.stats = {"products": 0,
+                      "gaps": 0,
+                      "packets_missing": 0,
+                      "duplicates": 0,
+                      "out_of_order": 0,
+                      "incomplete": 0,
+                      "orphans": 0,
+                      "udp_gaps": 0}
+
+        #Every APID the spectrometer sends maps to the product it belongs to
+        #Adding a new product type only needs another register_product() call here
+        self.products = {}
+        self.register_product("FFT", list(range(0x210, 0x220)) + list(range(0x2e0, 0x2e4)), packets = 3, dtype = "u32", length = 2048, output_queue = self.pfb_output_queue)
+        self.register_product("ADC", list(range(0x220, 0x224)) + list(range(0x2f0, 0x2f4)), packets = 9, dtype = "u16", length = None, output_queue = self.adc_output_queue)
+        #The number of counter packets depends on the requested number of samples, see count_packets()
+        self.register_product("Count", [0x209], packets = None, dtype = "u16", length = None, output_queue = self.count_output_queue)
+        self.register_product("Calib", list(range(0x230, 0x248)), packets = 2, dtype = "u32", length = 1024, output_queue = self.calib_output_queue)
+        self.register_product("Calib", list(range(0x250, 0x260)), packets = 3, dtype = "u32", length = 1024, output_queue = self.calib_output_queue)
+        self.register_product("gNacc", [0x260], packets = 1, dtype = "u32", length = 1, output_queue = self.calib_output_queue)
+        self.register_product("gphase", [0x261], packets = 2, dtype = "u32", length = 1024, output_queue = self.calib_output_queue)
+        self.register_product("gout", list(range(0x270, 0x278)), packets = 1, dtype = "u32", length = 512, output_queue = self.calib_output_queue)
+
+    #dtype is "u32" for 32 bit words with swapped halves or "u16" for 16 bit words, and length is how many of them to decode (None for all)
+    def register_product(self, product, apids, packets, dtype, length, output_queue):
+        for apid in apids:
+            self.products[apid] = {"product": product,
+                                   "packets": packets,
+                                   "dtype": dtype,
+                                   "length": length,
+                                   "output_queue": output_queue}
+
+    def count_packets(self):
+        if not self.count_num:
+            self.logger.error(f"Counter packet receiving state machine does not know counter size. Count size in bytes must be set")
+            return None
+        return (self.count_num // self.bytes_per_packet) + 1
+
+    def decode(self, spec, raw_data):
+        if (spec["dtype"] == "u32"):
+            return self.decoder.output(self.decoder.words(raw_data, spec["length"] if spec["length"] else -1))
+        return self.decoder.output(self.decoder.shorts(raw_data, spec["length"] if spec["length"] else -1))
+
+    def count_event(self, event, num = 1):
+        with self.stats_lock:
+            self.stats[event] += num
+
+    def get_stats(self):
+        with self.stats_lock:
+            return dict(self.stats)
+
+    def reset_contexts(self):
+        self.contexts = {}
+        self.last_sequence = {}
+        self.last_udp_packet_num = None
+
+    #Compares the sequence count to the last one from this APID to catch lost, repeated or late packets
+    def check_sequence(self, header):
+        apid = header.ccsds_appid
+        last = self.last_sequence.get(apid)
+        if (last is not None):
+            step = (header.ccsds_sequence_cnt - last) & self.sequence_mask
+            if (step == 0):
+                self.logger.warning(f"Duplicate packet {header.ccsds_sequence_cnt} for APID {hex(apid)}")
+                self.count_event("duplicates")
+                return False
+            elif (step > (self.sequence_mask >> 1)):
+                #Older than the last one, it's still kept if its product is in flight
+                self.logger.warning(f"Packet {header.ccsds_sequence_cnt} for APID {hex(apid)} came after {last}")
+                self.count_event("out_of_order")
+                return True
+            elif (step > 1):
+                self.logger.warning(f"{step - 1} packets missing before packet {header.ccsds_sequence_cnt} for APID {hex(apid)}")
+                self.count_event("gaps")
+                self.count_event("packets_missing", step - 1)
+        self.last_sequence[apid] = header.ccsds_sequence_cnt
+        return True
+
+    def check_udp_packet_num(self, header):
+        if (self.last_udp_packet_num is not None):
+            step = (header.udp_packet_num - self.last_udp_packet_num) & 0xFFFFFFFF
+            if (1 < step < 0x80000000):
+                self.count_event("udp_gaps")
+        self.last_udp_packet_num = header.udp_packet_num
+
+    #Places one packet of a multi packet product and returns the finished product once all of its packets are in
+    #Packets are kept by sequence count, so they can arrive in any order as long as the product's first packet is known
+    #Payloads are copied straight into a product buffer, so the receive slot can go back to the pool right away
+    def reassemble(self, spec, header, payload, pkt_num):
+        apid = header.ccsds_appid
+        seq = header.ccsds_sequence_cnt
+        flags = header.ccsds_groupflags
+        context = self.contexts.get(apid)
+        if (context is None):
+            context = {"first": None, "parts": {}, "buffer": self.get_product_buffer(spec, pkt_num), "used": 0}
+            self.contexts[apid] = context
+
+        if (seq in context["parts"]):
+            self.count_event("duplicates")
+            return None
+        if (flags == self.group_first):
+            self.start_product(spec, context, seq, pkt_num)
+        elif (flags == self.group_last and context["first"] is None):
+            self.start_product(spec, context, (seq - pkt_num + 1) & self.sequence_mask, pkt_num)
+        elif (flags == self.group_standalone):
+            #Without group flags, sequence counts keep going from one product to the next
+            if (context["first"] is None or ((seq - context["first"]) & self.sequence_mask) >= pkt_num):
+                self.start_product(spec, context, seq, pkt_num)
+
+        start = context["used"]
+        end = start + len(payload)
+        if (end > len(context["buffer"])):
+            context["buffer"].extend(bytes(end - len(context["buffer"])))
+        context["buffer"][start:end] = payload
+        context["used"] = end
+        context["parts"][seq] = (header, start, end)
+
+        if (context["first"] is None):
+            #Still waiting for the first packet. If it never comes, these can't be placed
+            if (len(context["parts"]) >= pkt_num):
+                self.logger.warning(f"{len(context['parts'])} packets for APID {hex(apid)} are from a {spec['product']} that never started")
+                self.count_event("orphans", len(context["parts"]))
+                context["parts"] = {}
+                context["used"] = 0
+            return None
+
+        sequence = [(context["first"] + i) & self.sequence_mask for i in range(pkt_num)]
+        self.logger.info(f"This is packet #{sequence.index(seq) + 1 if seq in sequence else '?'} in a {spec['product']} sequence")
+        if not all(i in context["parts"] for i in sequence):
+            return None
+
+        del self.contexts[apid]
+        self.logger.info(f"Final packet for {spec['product']}")
+        ordered = [context["parts"][i] for i in sequence]
+        buffer = memoryview(context["buffer"])
+        #Usually the packets came in order and the product is already in one piece in the buffer
+        if all(ordered[i][2] == ordered[i + 1][1] for i in range(pkt_num - 1)):
+            raw_data = buffer[ordered[0][1]:ordered[-1][2]]
+        else:
+            raw_data = b"".join(buffer[i[1]:i[2]] for i in ordered)
+        try:
+            #The product has to be as long as declared, otherwise it can't be decoded into the full array
+            if (spec["length"] and len(raw_data) < spec["length"] * self.item_size(spec)):
+                self.logger.warning(f"{spec['product']} for APID {hex(apid)} has {len(raw_data)} bytes, less than the {spec['length'] * self.item_size(spec)} declared")
+                self.count_event("incomplete")
+                return None
+            #The decoder copies out of the buffer, so it can be used again for the next product
+            return {"header" : {num: i[0] for num, i in enumerate(ordered)},
+                    "data" : self.decode(spec, raw_data),
+                    "product" : spec["product"]
+                    }
+        finally:
+            self.product_buffers.setdefault(id(spec), []).append(context["buffer"])
+
+    #Product buffers are sized for the whole product, from the declared length when it's known
+    def get_product_buffer(self, spec, pkt_num):
+        free = self.product_buffers.get(id(spec))
+        if (free):
+            return free.pop()
+        if (spec["length"]):
+            return bytearray(spec["length"] * self.item_size(spec))
+        return bytearray(pkt_num * (self.parent.buffer_pool.slot_size - 26))
+
+    #Sets where a product starts. Packets already held that belong to an older product are dropped
+    def start_product(self, spec, context, first, pkt_num):
+        context["first"] = first
+        stale = [i for i in context["parts"] if ((i - first) & self.sequence_mask) >= pkt_num]
+        if (stale):
+            self.logger.warning(f"New {spec['product']} started before the last one finished, dropping {len(stale)} packets")
+            self.count_event("incomplete")
+            for i in stale:
+                del context["parts"][i]
+        if (not context["parts"]):
+            context["used"] = 0
+
+    def item_size(self, spec):
+        return 4 if spec["dtype"] == "u32" else 2
 
     def process_data(self):
         name = threading.current_thread().name
         self.logger.debug(f"{name} started")
-        #This will track the type of data packet we are receiving and what number packet we're on
-        current_type = [None, 0]
-        running_process = {"header" : {}}
         while not self.stop_event.is_set():
             data = self.data_input_queue.get()
             self.data_input_queue.task_done()
             if data is self.stop_signal:
                 self.logger.debug(f"{name} has been told to stop. Exiting...")
                 break
-
-            #Packet format defined by Jack Fried in VHDL for custom CDI interface
-            #Headers come in as 16 bit words
-            unpack_buffer = int((len(data))/2)
-            #Unpacking into shorts in increments of 2 bytes
-            formatted_data = struct.unpack_from(f">{unpack_buffer}H",data)
-            header = self.parent.organize_header(formatted_data)
-            if ((header["ccsds_appid"] in self.fft_apids) and ((current_type[0] == None) or (current_type[0] == "FFT"))):
-                running_process["header"][current_type[1]] = header
-                current_type[1] += 1
-                self.logger.info(f"This is packet #{current_type[1]} in an FFT sequence")
-                #self.logger.info(formatted_data)
-                if (current_type[1] < self.fft_pkt_num):
-                    #The rest of the raw data is after the 13 * 2 byte header
-                    if ("raw_data" in running_process):
-                        running_process["raw_data"] += (data[26:])
-                    else:
-                        running_process["raw_data"] = data[26:]
-                    current_type[0] = "FFT"
-                elif (current_type[1] == self.fft_pkt_num):
-                    self.logger.info("Final packet for FFT")
-                    running_process["raw_data"] += (data[26:])
-                    #self.logger.info(running_process)
-                    #After the payload part of all the incoming packets has been concatenated, we know it's exactly 2048 bins and can unpack it appropriately
-                    formatted_data2 = struct.unpack_from(">2048I",running_process["raw_data"])
-                    #But each 2 byte section of the 4 byte value is reversed
-                    formatted_data3 = [(j >> 16) + ((j & 0xFFFF) << 16) for j in formatted_data2]
-                    final_header = {"header" : running_process["header"],
-                                    "data" : formatted_data3
-                                    }
-                    self.logger.debug(f"Putting {final_header} into queue")
-                    self.pfb_output_queue.put(final_header)
-                    current_type = [None, 0]
-                    running_process = {"header" : {}}
-                else:
-                    self.logger.warning(f"Was reading FFT and packet number is {current_type[1]}")
-                    current_type = [None, 0]
-                    running_process = {"header" : {}}
-            elif ((header["ccsds_appid"] in self.adc_apids) and ((current_type[0] == None) or (current_type[0] == "ADC"))):
-                running_process["header"][current_type[1]] = header
-                current_type[1] += 1
-                self.logger.info(f"This is packet #{current_type[1]} in an ADC sequence")
-                if (current_type[1] < self.adc_pkt_num):
-                    #The rest of the raw data is after the 13 * 2 byte header
-                    #For the ADC, there's no chance of data stradding 2 packets, so it can be put in as a 16 bit value
-                    if ("data" in running_process):
-                        running_process["data"].extend(formatted_data[13:])
-                    else:
-                        running_process["data"] = list(formatted_data[13:])
-                    current_type[0] = "ADC"
-                elif (current_type[1] == self.adc_pkt_num):
-                    self.logger.info("Final packet for ADC")
-                    running_process["data"].extend(formatted_data[13:])
-                    self.adc_output_queue.put(running_process)
-                    current_type = [None, 0]
-                    running_process = {"header" : {}}
-                else:
-                    self.logger.warning(f"Was reading ADC and packet number is {current_type[1]}")
-                    current_type = [None, 0]
-                    running_process = {"header" : {}}
-            elif ((header["ccsds_appid"] == self.count_apid) and ((current_type[0] == None) or (current_type[0] == "Count"))):
-                running_process["header"][current_type[1]] = header
-                current_type[1] += 1
-                self.logger.info(f"This is packet #{current_type[1]} in a Counter sequence")
-                if (current_type[1] == 0):
-                    if not self.count_num:
-                        self.logger.error(f"Counter packet receiving state machine does not know counter size. Count size in bytes must be set")
-                        continue
-                    else:
-                        self.count_pkt_num = (self.count_num // self.bytes_per_packet) + 1
-                        running_process["data"] = list(formatted_data[13:])
-                        if (self.count_pkt_num == 1):
-                            self.count_output_queue.put(running_process)
-                            current_type = [None, 0]
-                            running_process = {"header" : {}}
-                        else:
-                            current_type[0] == "Count"
-                elif (not self.count_pkt_num):
-                    self.logger.error(f"Counter packet receiving state machine does not know counter packet num. But packet number was {current_type[1]}")
-                    continue
-                elif (current_type[1] < self.count_pkt_num):
-                    if ("data" in running_process):
-                        running_process["data"].extend(formatted_data[13:])
-                    else:
-                        self.logger.error(f"Counter packet receiving state machine has middle packets before first!")
-                    current_type[0] = "Count"
-                elif (current_type[1] == self.count_pkt_num):
-                    self.logger.info("Final packet for Counter")
-                    running_process["data"].extend(formatted_data[13:])
-                    self.count_output_queue.put(running_process)
-                    current_type = [None, 0]
-                    running_process = {"header" : {}}
-                else:
-                    self.logger.warning(f"Was reading Count and packet number is {current_type[1]}")
-                    current_type = [None, 0]
-                    running_process = {"header" : {}}
-            elif ((header["ccsds_appid"] in self.calib_apids) and ((current_type[0] == None) or (current_type[0] == "Calib"))):
-                if (header["ccsds_appid"] in self.calib_apids3):
-                    num_packets = 3
-                else:
-                    num_packets = 2
-                running_process["header"][current_type[1]] = header
-                current_type[1] += 1
-                self.logger.info(f"This is packet #{current_type[1]} in a calibrator sequence")
-                #self.logger.error(f"Total header is {header}")
-                #self.logger.info(formatted_data)
-                if (current_type[1] < num_packets):
-                    #The rest of the raw data is after the 13 * 2 byte header
-                    if ("raw_data" in running_process):
-                        running_process["raw_data"] += (data[26:])
-                    else:
-                        running_process["raw_data"] = data[26:]
-                    current_type[0] = "Calib"
-                elif (current_type[1] == num_packets):
-                    self.logger.info("Final packet for Calib")
-                    running_process["raw_data"] += (data[26:])
-                    #After the payload part of all the incoming packets has been concatenated, we know it's exactly 2048 bins and can unpack it appropriately
-                    formatted_data2 = struct.unpack_from(">1024I",running_process["raw_data"])
-                    #But each 2 byte section of the 4 byte value is reversed
-                    formatted_data3 = [(j >> 16) + ((j & 0xFFFF) << 16) for j in formatted_data2]
-                    final_header = {"header" : running_process["header"],
-                                    "data" : formatted_data3
-                                    }
-                    #self.logger.debug(f"Putting {final_header} into queue")
-                    self.calib_output_queue.put(final_header)
-                    current_type = [None, 0]
-                    running_process = {"header" : {}}
-                else:
-                    self.logger.warning(f"Was reading Calib and packet number is {current_type[1]}")
-                    current_type = [None, 0]
-                    running_process = {"header" : {}}
-            elif (header["ccsds_appid"] in self.gout_apid):
-                self.logger.info(f"This is a gout packet with apid {header['ccsds_appid']}")
-                self.logger.info(header)
-                self.logger.info(len(data))
-                running_process["header"][current_type[1]] = header
-                formatted_data2 = struct.unpack_from(">512I",data[26:])
-                #But each 2 byte section of the 4 byte value is reversed
-                formatted_data3 = [(j >> 16) + ((j & 0xFFFF) << 16) for j in formatted_data2]
-                final_header = {"header" : running_process["header"],
-                                "data" : formatted_data3
-                                }
-                #self.logger.info(f"Putting {header['ccsds_appid']} into queue")
-                self.calib_output_queue.put(final_header)
-                #time.sleep(1)
-            elif (header["ccsds_appid"] == self.gNacc_apid):
-                self.logger.info(f"This is the gNacc packet {data[26:]}")
-                running_process["header"][current_type[1]] = header
-                formatted_data2 = struct.unpack_from(">1I",data[26:])
-                #But each 2 byte section of the 4 byte value is reversed
-                formatted_data3 = [(j >> 16) + ((j & 0xFFFF) << 16) for j in formatted_data2]
-                final_header = {"header" : running_process["header"],
-                                "data" : formatted_data3
-                                }
-                #self.logger.info(f"Putting {final_header} into queue")
-                self.calib_output_queue.put(final_header)
-            else:
-                self.logger.error(f"APID is {header['ccsds_appid']}, running type is {current_type}")
-                #self.logger.error(f"Total header is {header}")
+            try:
+                spec, final_header = self.process_packet(data)
+            finally:
+                #Everything needed from the packet has been copied out by now
+                self.parent.buffer_pool.release(data)
+            if final_header is None:
+                continue
+            self.count_event("products")
+            self.logger.debug("Putting %s into queue", final_header)
+            spec["output_queue"].put(final_header)
 
         self.logger.info(f"{name} exited")
+
+    #Returns the product spec and the finished product, if this packet finished one
+    def process_packet(self, data):
+        #Packet format defined by Jack Fried in VHDL for custom CDI interface
+        #Headers come in as 16 bit words, only those 13 are unpacked here and the payload is left for the decoder
+        formatted_data = struct.unpack_from(">13H",data)
+        header = self.parent.organize_header(formatted_data)
+        self.check_udp_packet_num(header)
+        spec = self.products.get(header.ccsds_appid)
+        if (spec is None):
+            self.logger.error(f"APID is {hex(header.ccsds_appid)}, which isn't a registered product")
+            return None, None
+        if not self.check_sequence(header):
+            return spec, None
+
+        #The rest of the raw data is after the 13 * 2 byte header
+        payload = memoryview(data)[26:]
+        #Single packet products can come in the middle of other sequences and don't disturb them
+        if (spec["packets"] == 1):
+            self.logger.info(f"This is a {spec['product']} packet with apid {hex(header.ccsds_appid)}")
+            return spec, {"header" : {0: header},
+                          "data" : self.decode(spec, payload),
+                          "product" : spec["product"]
+                          }
+        pkt_num = spec["packets"] if spec["packets"] else self.count_packets()
+        if not pkt_num:
+            return spec, None
+        return spec, self.reassemble(spec, header, payload, pkt_num)
@@ -25,26 +25,24 @@ class LuSEE_PROCESS_HK:
             if data is self.stop_signal:
                 self.logger.debug(f"{name} has been told to stop. Exiting...")
                 break
-            self.hk_output_queue.put(self.check_data_bootloader(data))
+            resp = self.check_data_bootloader(data)
+            self.parent.buffer_pool.release(data)
+            self.hk_output_queue.put(resp)
         self.logger.debug(f"{name} exited")
 
     #The bootloader response has the standard CDI header, so that's formatted
     #And the payload is sent for further processing
     def check_data_bootloader(self, data):
-        data_packet = bytearray()
         header_dict = {}
 
-        unpack_buffer = int((len(data))/2)
-        #Unpacking into shorts in increments of 2 bytes
-        formatted_data = struct.unpack_from(f">{unpack_buffer}H",data)
-        header_dict = self.parent.organize_header(formatted_data)
+        #Unpacking the header into shorts in increments of 2 bytes
+        formatted_data = struct.unpack_from(">13H",data)
+        #The bootloader fields get added to the header, so this one is kept as a dictionary
+        header_dict = self.parent.organize_header(formatted_data).to_dict()
 
         #The header is 13 bytes (26 hex byte characters) and the payload starts after as 32 bit ints
-        data_packet.extend(data[26:])
-        data_size = int(len(data_packet)/4)
-        formatted_data2 = struct.unpack_from(f">{data_size}I",data_packet)
-        #But for every 4 byte value in the payload, the first and last 2 bytes are reversed
-        formatted_data3 = [(j >> 16) + ((j & 0xFFFF) << 16) for j in formatted_data2]
+        #Bootloader fields get combined into values wider than 32 bits, so they're unpacked as Python ints
+        formatted_data3 = self.parent.decoder.words(data[26:]).tolist()
 
         #With the formatted payload, get all relevant header info
         if (formatted_data3):
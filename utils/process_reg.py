@@ -1,8 +1,14 @@
-import binascii
+import struct
 import threading
 import queue
+import time
 import logging
 import logging.config
+import asyncio
+import itertools
+from collections import OrderedDict, deque
+from concurrent.futures import InvalidStateError, CancelledError, TimeoutError as FutureTimeout
+from asyncio import InvalidStateError as AsyncInvalidStateError
 
 #TODO: Add the register processing from the actual DCB, where the CDI header isn't stripped out.
 class LuSEE_PROCESS_REG:
@@ -17,6 +23,168 @@ class LuSEE_PROCESS_REG:
         self.reg_output_queue = parent.reg_output_queue
         self.dcb_emulator_queue = parent.dcb_emulator_queue
 
+        #Reads that have been sent to the DCB emulator and are still waiting on a response, oldest first
+        #The sender thread issues reads one at a time, so responses come back in the same order
+        #Readback responses don't say which read they're for, so every request is numbered in the order it went out
+        #When a latch poll sent after a readback is answered, that readback's response must have been lost, and it's failed
+        #instead of taking the next read's value
+        self.pending_lock = threading.Lock()
+        self.pending_reads = OrderedDict()
+        self.request_seq = itertools.count()
+        self.lost_responses = 0
+        #A read whose caller gave up is kept this long in case its response is just late, so it isn't given to the next read
+        self.stale_timeout = 5
+        self.stale_responses = 0
+        #Reads of the DCB emulator's own registers, oldest first. Responses carry the register, so they're matched by it
+        self.pending_cdi_reads = deque()
+        #Register responses are 6 bytes, the 16 bit register and then the 32 bit value
+        self.response_struct = struct.Struct(">HI")
+
+    #Called by the sender thread right before it tells the DCB emulator to read back the register
+    def add_pending_read(self, tag, reg, future):
+        with self.pending_lock:
+            self.pending_reads[tag] = {"reg": reg,
+                                       "future": future,
+                                       "seq": next(self.request_seq),
+                                       "sent": time.perf_counter()}
+
+    #Called when the caller stops waiting for a read after timeout seconds
+    #If its response hasn't come in after as long again, it's taken as lost instead of waiting out stale_timeout
+    #The sender has usually started the future already, which stops it from being cancelled, so the entry itself is marked
+    #Returns when it will be taken as lost. Responses don't say which read they're for, so a retry sent before then could have its response taken for the late one
+    #If the read isn't pending any more, its response was already found to be lost, and that's now
+    def give_up_read(self, future, timeout):
+        future.cancel()
+        now = time.perf_counter()
+        with self.pending_lock:
+            for entry in self.pending_reads.values():
+                if (entry["future"] is future):
+                    entry["lost_after"] = now + timeout
+                    return entry["lost_after"]
+        return now
+
+    def given_up(self, entry):
+        return entry["future"].done() or ("lost_after" in entry)
+
+    #Matches a readback response to the oldest outstanding read
+    def complete_pending_read(self, data_val):
+        now = time.perf_counter()
+        with self.pending_lock:
+            #Reads that were given up on a while ago have lost their response, they shouldn't swallow this one
+            while self.pending_reads:
+                tag, entry = next(iter(self.pending_reads.items()))
+                if (self.given_up(entry) and now > entry.get("lost_after", entry["sent"] + self.stale_timeout)):
+                    self.pending_reads.popitem(last = False)
+                else:
+                    break
+            if (not self.pending_reads):
+                self.stale_responses += 1
+                self.logger.warning(f"Received register value {hex(data_val)} with no read outstanding, dropping it")
+                return
+            tag, entry = self.pending_reads.popitem(last = False)
+        if (self.given_up(entry)):
+            self.stale_responses += 1
+            self.logger.warning(f"Dropping late response {hex(data_val)} for Register {hex(entry['reg'])} (read #{tag})")
+            return
+        if not self.complete(entry["future"], {"reg": entry["reg"],
+                                               "data": data_val,
+                                               "tag": tag,
+                                               "rtt": now - entry["sent"]}):
+            self.stale_responses += 1
+            self.logger.warning(f"Dropping response {hex(data_val)} for Register {hex(entry['reg'])} (read #{tag}), it was given up on")
+
+    #Called right before a DCB emulator register read is sent, so the response can't arrive before it's expected
+    def add_pending_cdi_read(self, reg, future):
+        with self.pending_lock:
+            self.pending_cdi_reads.append({"reg": reg,
+                                           "future": future,
+                                           "seq": next(self.request_seq),
+                                           "sent": time.perf_counter()})
+
+    #Returns False if nobody was waiting for this register
+    def complete_cdi_read(self, reg, data_val):
+        now = time.perf_counter()
+        with self.pending_lock:
+            entry = None
+            for i in self.pending_cdi_reads:
+                if (i["reg"] == reg and not i["future"].done()):
+                    entry = i
+                    break
+            #Reads that were given up on are cleared out as responses come in
+            self.pending_cdi_reads = deque(i for i in self.pending_cdi_reads if i is not entry and not i["future"].done())
+            missed = [] if entry is None else self.take_missed_reads(entry["seq"])
+        for tag, i in missed:
+            self.lost_responses += 1
+            self.logger.warning(f"The response for Register {hex(i['reg'])} (read #{tag}) never came, failing the read")
+            self.fail(i["future"], f"The response for Register {hex(i['reg'])} was lost")
+        if (entry is None):
+            return False
+        return self.complete(entry["future"], {"reg": reg,
+                                               "data": data_val,
+                                               "rtt": now - entry["sent"]})
+
+    #Must be called holding pending_lock
+    #Takes out the readbacks that went out before request seq. Responses come back in order, so theirs are lost
+    #Returns the ones still being waited on
+    def take_missed_reads(self, seq):
+        missed = []
+        while self.pending_reads:
+            tag, entry = next(iter(self.pending_reads.items()))
+            if (entry["seq"] > seq):
+                break
+            self.pending_reads.popitem(last = False)
+            if (not self.given_up(entry)):
+                missed.append((tag, entry))
+        return missed
+
+    #Ends a read whose response won't come, the same way as if its caller's wait had timed out
+    def fail(self, future, message):
+        exception = asyncio.TimeoutError(message) if isinstance(future, asyncio.Future) else FutureTimeout(message)
+        try:
+            future.set_exception(exception)
+        except (InvalidStateError, AsyncInvalidStateError):
+            pass
+
+    #The caller can cancel a future any time after it was looked up, so it's only completed if it still can be
+    #Returns whether it was
+    def complete(self, future, result):
+        try:
+            future.set_result(result)
+        except (InvalidStateError, AsyncInvalidStateError):
+            return False
+        return True
+
+    #Decodes a register response and completes whatever read was waiting on it
+    #This can run straight from the receive thread, or from process_reg when responses go through the queue
+    def handle_response(self, data):
+        if (len(data) < self.response_struct.size):
+            self.logger.warning(f"Register response is {len(data)} bytes, too short to be one. Dropping it: {bytes(data)}")
+            return
+        response_reg, data_val = self.response_struct.unpack_from(data)
+        if (response_reg != self.readback_register):
+            #This is the response for when toggling the latch, or actual DCB emulator registers
+            if not self.complete_cdi_read(response_reg, data_val):
+                self.dcb_emulator_queue.put({"reg": response_reg,
+                                             "data": data_val})
+        else:
+            #This one is when the DCB emulator is reporting on Spectrometer registers
+            self.complete_pending_read(data_val)
+
+    #Ends every read still waiting on a response, so its caller sees CancelledError right away
+    #The sender has usually started the future already, which stops it from being cancelled, so those get the exception set instead
+    def cancel_pending_reads(self):
+        with self.pending_lock:
+            entries = list(self.pending_reads.values()) + list(self.pending_cdi_reads)
+            self.pending_reads.clear()
+            self.pending_cdi_reads.clear()
+        for entry in entries:
+            future = entry["future"]
+            if (not future.cancel() and not isinstance(future, asyncio.Future)):
+                try:
+                    future.set_exception(CancelledError())
+                except InvalidStateError:
+                    pass
+
     def process_reg(self):
         name = threading.current_thread().name
         self.logger.debug(f"{name} started")
@@ -26,25 +194,14 @@ class LuSEE_PROCESS_REG:
             if data is self.stop_signal:
                 self.logger.debug(f"{name} has been told to stop. Exiting...")
                 self.reg_output_queue.put(self.stop_signal)
+                self.cancel_pending_reads()
                 break
-            dataHex = binascii.hexlify(data)
             #If reading, say register 0x290, you may get back
             #029012345678
-            #The first 4 bits are the register you requested, the next 8 bits are the value
-            #With a DCB emulator, those first 4 bits will be the register on the DCB emulator you requested
+            #The first 2 bytes are the register you requested, the next 4 bytes are the value
+            #With a DCB emulator, those first 2 bytes will be the register on the DCB emulator you requested
             #The register from the spectrometer is lost in the middle
-            #Return the data part of the response in integer form (it's just easier)
-            response_reg = int(dataHex[0:4],16)
-            data_val = int(dataHex[4:12],16)
-
-            response_dict = {"reg": response_reg,
-                             "data": data_val}
-            self.logger.debug(f"Received {response_dict}")
-            if (response_reg != self.readback_register):
-                #This queue is the response for when toggling the latch, or actual DCB emulator registers
-                self.dcb_emulator_queue.put(response_dict)
-            else:
-                #This one is when the DCB emulator is reporting on Spectrometer registers
-                self.reg_output_queue.put(response_dict)
+            self.handle_response(data)
+            self.parent.buffer_pool.release(data)
         self.logger.debug(f"{name} exited")
 
@@ -0,0 +1,60 @@
+import queue
+import logging
+import logging.config
+
+#A bounded queue.Queue that doesn't grow without limit when its consumer is slow or never reads
+#When it's full, the policy decides what happens to a new item:
+#"drop_oldest" throws away the oldest item to make room, "drop_newest" throws away the new item, "block" waits like queue.Queue
+#The stop signal is never dropped and never waits, so threads can always be told to exit
+class LuSEE_RING_QUEUE(queue.Queue):
+    policies = ("drop_oldest", "drop_newest", "block")
+
+    def __init__(self, maxsize = 0, policy = "drop_oldest", stop_signal = None, on_drop = None):
+        super().__init__(maxsize)
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.set_policy(policy)
+        self.stop_signal = stop_signal
+        #Called with every dropped item, for example to give a receive buffer back to its pool
+        self.on_drop = on_drop
+        self.enqueued = 0
+        self.dropped = 0
+        self.high_water = 0
+
+    def set_policy(self, policy):
+        if (policy not in self.policies):
+            raise ValueError(f"Queue policy must be one of {self.policies}, not {policy}")
+        self.policy = policy
+
+    def put(self, item, block = True, timeout = None):
+        if (self.policy == "block" and item is not self.stop_signal):
+            super().put(item, block, timeout)
+            with self.mutex:
+                self.enqueued += 1
+                self.high_water = max(self.high_water, self._qsize())
+            return
+        dropped = None
+        with self.mutex:
+            if (item is not self.stop_signal and 0 < self.maxsize <= self._qsize()):
+                if (self.policy == "drop_newest" or self.queue[0] is self.stop_signal):
+                    dropped = item
+                else:
+                    dropped = self._get()
+                    self.unfinished_tasks -= 1
+                self.dropped += 1
+            if (dropped is not item):
+                self._put(item)
+                self.unfinished_tasks += 1
+                self.enqueued += 1
+                self.high_water = max(self.high_water, self._qsize())
+                self.not_empty.notify()
+        if (dropped is not None and self.on_drop):
+            self.on_drop(dropped)
+
+    def get_stats(self):
+        with self.mutex:
+            return {"maxsize": self.maxsize,
+                    "policy": self.policy,
+                    "size": self._qsize(),
+                    "enqueued": self.enqueued,
+                    "dropped": self.dropped,
+                    "high_water": self.high_water}
@@ -0,0 +1,55 @@
+import threading
+import logging
+import logging.config
+
+#Works out how long to wait for a reply from how long replies have been taking, the way TCP picks its retransmission timeout (RFC 6298)
+#Keeps a smoothed round trip time and its variation, and the timeout is the smoothed time plus 4 variations
+#Every timeout doubles it until a reply comes back, up to maximum, so a flaky link isn't retried as fast as a healthy one
+class LuSEE_RTT_ESTIMATOR:
+    def __init__(self, name, initial = 1.0, minimum = 0.01, maximum = 10.0):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self.alpha = 1 / 8
+        self.beta = 1 / 4
+        self.k = 4
+        self.lock = threading.Lock()
+        self.srtt = None
+        self.rttvar = None
+        #Used until the first reply is timed
+        self.rto = min(max(initial, minimum), maximum)
+        self.backoff = 1
+        self.stats = {"samples": 0, "timeouts": 0}
+
+    #Adds the time one reply took. Only time replies to requests that were sent once, so a late reply isn't taken for a retry's
+    def sample(self, rtt):
+        with self.lock:
+            if (self.srtt is None):
+                self.srtt = rtt
+                self.rttvar = rtt / 2
+            else:
+                self.rttvar = (1 - self.beta) * self.rttvar + self.beta * abs(self.srtt - rtt)
+                self.srtt = (1 - self.alpha) * self.srtt + self.alpha * rtt
+            self.rto = min(max(self.srtt + self.k * self.rttvar, self.minimum), self.maximum)
+            self.backoff = 1
+            self.stats["samples"] += 1
+
+    def timed_out(self):
+        with self.lock:
+            self.backoff = min(self.backoff * 2, self.maximum / self.rto) if self.rto > 0 else 1
+            self.stats["timeouts"] += 1
+        self.logger.debug(f"{self.name} timed out, waiting up to {self.timeout()} seconds next time")
+
+    #How long to wait for the next reply
+    def timeout(self):
+        with self.lock:
+            return min(self.rto * self.backoff, self.maximum)
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats,
+                        srtt = self.srtt,
+                        rttvar = self.rttvar,
+                        rto = self.rto,
+                        timeout = min(self.rto * self.backoff, self.maximum))